@@ -0,0 +1,8 @@
+#!/usr/bin/env bash
+
+set -u   # crash on missing env variables
+set -e   # stop on any error
+set -x   # print what we are doing
+
+# the public read api only, see main.asgi
+uvicorn main.asgi:application --host 0.0.0.0 --port 8000 --workers "${ASGI_WORKERS:-2}"
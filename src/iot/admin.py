@@ -9,14 +9,52 @@ from django.utils.safestring import mark_safe
 from leaflet.admin import LeafletGeoAdmin, LeafletGeoAdminMixin
 from openpyxl import load_workbook
 
-from iot import models
+from iot import http_cache, models
+from iot.importers.import_sensor import Geocoder
 from iot.importers.import_xlsx import import_xlsx
 
-admin.site.register(models.Type)
-admin.site.register(models.Theme)
-admin.site.register(models.LegalGround)
-admin.site.register(models.ObservationGoal)
-admin.site.register(models.Project)
+
+class PurgeCacheMixin:
+    """
+    Purge the public api from the caches (see iot.http_cache) after saving or
+    deleting objects. By default every device response is purged, which is
+    what a change of one of the lookups requires.
+    """
+
+    def get_purge_keys(self, obj):
+        return [http_cache.DEVICES, http_cache.DEVICE]
+
+    def save_related(self, request, form, formsets, change):
+        # called after the object itself, its many to many relations and the
+        # inlines are saved
+        super().save_related(request, form, formsets, change)
+        http_cache.purge(self.get_purge_keys(form.instance))
+
+    def delete_model(self, request, obj):
+        keys = self.get_purge_keys(obj)
+        super().delete_model(request, obj)
+        http_cache.purge(keys)
+
+    def delete_queryset(self, request, queryset):
+        keys = [key for obj in queryset for key in self.get_purge_keys(obj)]
+        super().delete_queryset(request, queryset)
+        http_cache.purge(keys)
+
+
+class PurgeCacheAdmin(PurgeCacheMixin, admin.ModelAdmin):
+    pass
+
+
+@admin.register(models.Type)
+class TypeAdmin(PurgeCacheAdmin):
+    def get_purge_keys(self, obj):
+        return [http_cache.DEVICES, http_cache.type_key(obj.pk)]
+
+
+admin.site.register(models.Theme, PurgeCacheAdmin)
+admin.site.register(models.LegalGround, PurgeCacheAdmin)
+admin.site.register(models.ObservationGoal, PurgeCacheAdmin)
+admin.site.register(models.Project, PurgeCacheAdmin)
 
 
 LEAFLET_SETTINGS_OVERRIDES = {
@@ -35,7 +73,9 @@ def import_xlsx_view(request, message_user, redirect_to):
         file = request.FILES["selecteer_bestand"]
         num_created = 0
         num_updated = 0
+        num_unchanged = 0
         imported_sensors = []
+        geocoder = Geocoder()
         try:
             workbook = load_workbook(file)
 
@@ -59,12 +99,21 @@ def import_xlsx_view(request, message_user, redirect_to):
                 imported_sensors,
                 num_created,
                 num_updated,
-            ) = import_xlsx(workbook, action_logger)
+                num_unchanged,
+            ) = import_xlsx(workbook, action_logger, geocoder)
 
         except Exception as e:
             errors = [e]
 
-        send_messages_to_user(request, message_user, num_created, num_updated, errors)
+        send_messages_to_user(
+            request,
+            message_user,
+            num_created,
+            num_updated,
+            num_unchanged,
+            errors,
+            geocoder.stats,
+        )
 
         # warn about any sensors that do not have a lat/long, these sensors
         # will be imported in the registry, however it won't be possible to
@@ -93,12 +142,28 @@ def import_xlsx_view(request, message_user, redirect_to):
         return render(request, "import_xlsx.html", {"form": FileForm()})
 
 
-def send_messages_to_user(request, message_user, num_created, num_updated, errors):
+def send_messages_to_user(
+    request,
+    message_user,
+    num_created,
+    num_updated,
+    num_unchanged,
+    errors,
+    geocode_stats=None,
+):
     """
     Give the user feedback about what was imported, and any errors that
     occurred.
     """
-    message = f"{num_created} sensoren aangemaakt<br>{num_updated} sensoren bijgewerkt"
+    message = (
+        f"{num_created} sensoren aangemaakt<br>{num_updated} sensoren bijgewerkt"
+        f"<br>{num_unchanged} sensoren ongewijzigd"
+    )
+    if geocode_stats and geocode_stats.lookups:
+        message += (
+            f"<br>{geocode_stats.hits} van de {geocode_stats.lookups} adressen"
+            " gevonden in de cache"
+        )
 
     if errors:
         level = messages.WARNING if num_created and not num_updated else messages.ERROR
@@ -123,7 +188,7 @@ def send_messages_to_user(request, message_user, num_created, num_updated, error
 
 
 @admin.register(models.Device)
-class DeviceAdmin(LeafletGeoAdmin):
+class DeviceAdmin(PurgeCacheMixin, LeafletGeoAdmin):
     change_list_template = "devices_change_list.html"
     list_display = (
         'reference',
@@ -136,6 +201,9 @@ class DeviceAdmin(LeafletGeoAdmin):
     search_fields = 'reference', 'owner__organisation', 'owner__email', 'owner__name'
     list_filter = (('location', admin.EmptyFieldListFilter),)
 
+    def get_purge_keys(self, obj):
+        return [http_cache.DEVICES, http_cache.device_key(obj.pk)]
+
     def get_urls(self):
         _meta = self.model._meta
         context = dict(
@@ -153,10 +221,15 @@ class DeviceInline(LeafletGeoAdminMixin, admin.StackedInline):
 
 
 @admin.register(models.Person)
-class PersonAdmin(LeafletGeoAdmin):
+class PersonAdmin(PurgeCacheMixin, LeafletGeoAdmin):
     search_fields = 'organisation', 'email', 'name'
     inlines = [DeviceInline]
 
+    def get_purge_keys(self, obj):
+        # the devices (added, changed or deleted by the inlines) are all
+        # tagged with the owner key
+        return [http_cache.DEVICES, http_cache.owner_key(obj.pk)]
+
 
 class ObservationGoalAdmin(LeafletGeoAdmin):
     list_display = 'observation_goal', 'privacy_declaration', 'legal_ground'
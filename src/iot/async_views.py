@@ -0,0 +1,81 @@
+"""
+Async variants of the public read views, for the asgi deployment (see
+main.asgi).
+
+Under asgi, django runs all the sync views in one and the same thread, so a
+single slow query holds up every other request. The views here run the sync
+view in a thread of its own instead, including its database queries (django
+3.2 has no async database access) and the rendering of its response. The event
+loop is then only used to send the response, so slow clients (e.g. a map on a
+mobile connection) don't tie up a worker process, as they do under wsgi.
+
+Every worker thread keeps its own database connection (for CONN_MAX_AGE), so
+the number of connections is bounded by the size of the thread pool of the
+event loop.
+"""
+import functools
+import tempfile
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from django.http import FileResponse
+
+from . import views
+
+
+def run_sync_view(view, request, *args, **kwargs):
+    close_old_connections()
+    try:
+        response = view(request, *args, **kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+        if response.streaming and not isinstance(response, FileResponse):
+            # The asgi handler of django 3.2 iterates a streaming response in
+            # the event loop, where the database can't be used (and it can't
+            # iterate an async iterator either). The content is spooled to a
+            # temporary file here instead, which is then streamed like the
+            # files of a FileResponse, so e.g. the ndjson export still doesn't
+            # need more memory for more devices.
+            streamed = response
+            spool = tempfile.TemporaryFile()
+            try:
+                for chunk in streamed.streaming_content:
+                    spool.write(chunk)
+                spool.seek(0)
+            except BaseException:
+                spool.close()
+                raise
+            finally:
+                streamed.close()
+            response = FileResponse(spool, status=streamed.status_code)
+            for header, value in streamed.items():
+                response[header] = value
+        return response
+    finally:
+        close_old_connections()
+
+
+def in_thread(view):
+    """
+    The async variant of a sync view, which runs the view (and renders its
+    response) in a thread of its own.
+    """
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        return await sync_to_async(run_sync_view, thread_sensitive=False)(
+            view, request, *args, **kwargs
+        )
+
+    return wrapper
+
+
+device_list = in_thread(
+    views.DevicesViewSet.as_view({'get': 'list'}, basename='device', detail=False)
+)
+device_detail = in_thread(
+    views.DevicesViewSet.as_view({'get': 'retrieve'}, basename='device', detail=True)
+)
+devices_snapshot = in_thread(views.devices_snapshot)
+export_flatgeobuf = in_thread(views.export_flatgeobuf)
+bootstrap = in_thread(views.BootstrapView.as_view())
@@ -1,9 +1,20 @@
+import hashlib
+import threading
+import time
+from typing import Dict, Optional
+
+import jwt
 import keycloak_oidc.auth
+import requests
 from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
+from django.core.cache import cache
 from django.db import transaction
 from django.http import HttpResponseRedirect
 from django.urls import reverse
+from mozilla_django_oidc.contrib.drf import OIDCAuthentication
+from rest_framework import exceptions
 
 
 def oidc_login(request, **kwargs):
@@ -17,21 +28,34 @@ class OIDCAuthenticationBackend(keycloak_oidc.auth.OIDCAuthenticationBackend):
         """
         Transform roles obtained from keycloak into Django Groups and
         add them to the user. Note that any role not passed via keycloak
-        will be removed from the user.
+        will be removed from the user. Only the difference with the current
+        groups of the user is written, so a login without changed roles
+        does not write anything.
         """
+        roles = set(claims.get('roles') or [])
+        is_admin = any(
+            settings.DEBUG or role == settings.SENSOR_REGISTER_ADMIN_ROLE_NAME
+            for role in roles
+        )
+        groups = dict(user.groups.values_list('name', 'id'))
+        added = roles - groups.keys()
+        removed = groups.keys() - roles
+        admin_changed = user.is_staff != is_admin or user.is_superuser != is_admin
+        if not (added or removed or admin_changed):
+            return
+
         with transaction.atomic():
-            user.groups.clear()
-            user.is_staff = False
-            user.is_superuser = False
-            user.save()
-
-            for role in claims.get('roles'):
-                group, _ = Group.objects.get_or_create(name=role)
-                if settings.DEBUG or role == settings.SENSOR_REGISTER_ADMIN_ROLE_NAME:
-                    user.is_staff = True
-                    user.is_superuser = True
-                user.save()
-                group.user_set.add(user)
+            if removed:
+                user.groups.remove(*(groups[name] for name in removed))
+            if added:
+                Group.objects.bulk_create(
+                    [Group(name=name) for name in added], ignore_conflicts=True
+                )
+                user.groups.add(*Group.objects.filter(name__in=added))
+            if admin_changed:
+                user.is_staff = is_admin
+                user.is_superuser = is_admin
+                user.save(update_fields=['is_staff', 'is_superuser'])
 
     def authenticate(self, request, **kwargs):
         user = super().authenticate(request, **kwargs)
@@ -41,3 +65,134 @@ class OIDCAuthenticationBackend(keycloak_oidc.auth.OIDCAuthenticationBackend):
         if user and user.is_staff:
             return user
         return None
+
+
+class JWKS:
+    """
+    The signing keys of the identity provider (from OIDC_OP_JWKS_ENDPOINT),
+    these are fetched once and only fetched again when a token is signed with
+    a key that isn't known yet (i.e. after the keys have been rotated). To
+    prevent tokens with a made up key id (or an unreachable identity provider)
+    from hammering the identity provider the keys are fetched at most once per
+    OIDC_JWKS_MIN_REFRESH_INTERVAL, whether the fetch succeeded or not.
+
+    Only the requests that need a key that isn't known yet wait for a fetch,
+    the others keep using the known keys in the meantime.
+    """
+
+    def __init__(self):
+        self.keys: Dict[str, jwt.PyJWK] = {}
+        self.fetched_at: Optional[float] = None
+        self.fetch_lock = threading.Lock()
+
+    def clear(self):
+        with self.fetch_lock:
+            self.keys = {}
+            self.fetched_at = None
+
+    def fetch(self) -> Dict[str, jwt.PyJWK]:
+        try:
+            response = requests.get(settings.OIDC_OP_JWKS_ENDPOINT, timeout=10)
+            response.raise_for_status()
+            key_set = jwt.PyJWKSet.from_dict(response.json())
+        except (requests.RequestException, ValueError, jwt.PyJWTError) as e:
+            raise exceptions.AuthenticationFailed(f'Signing keys unavailable: {e}')
+        return {key.key_id: key for key in key_set.keys}
+
+    def get_signing_key(self, kid: str) -> jwt.PyJWK:
+        key = self.keys.get(kid)
+        if key is None:
+            with self.fetch_lock:
+                # the keys may have been fetched while waiting for the lock
+                key = self.keys.get(kid)
+                if key is None and (
+                    self.fetched_at is None
+                    or time.monotonic() - self.fetched_at
+                    >= settings.OIDC_JWKS_MIN_REFRESH_INTERVAL
+                ):
+                    # recorded before fetching, so a failed fetch isn't retried
+                    # right away either
+                    self.fetched_at = time.monotonic()
+                    self.keys = self.fetch()
+                    key = self.keys.get(kid)
+        if key is None:
+            raise exceptions.AuthenticationFailed('Unknown signing key')
+        return key
+
+
+jwks = JWKS()
+
+
+def decode_token(token: str) -> dict:
+    """
+    Verify the signature and the expiry (and issuer and audience, when these
+    are configured) of the access token, returns its claims.
+    """
+    try:
+        kid = jwt.get_unverified_header(token).get('kid')
+        key = jwks.get_signing_key(kid)
+        return jwt.decode(
+            token,
+            key.key,
+            algorithms=[settings.OIDC_RP_SIGN_ALGO],
+            audience=settings.OIDC_JWT_AUDIENCE,
+            issuer=settings.OIDC_JWT_ISSUER,
+            leeway=settings.OIDC_JWT_LEEWAY,
+            options={
+                'require': ['exp'],
+                'verify_aud': bool(settings.OIDC_JWT_AUDIENCE),
+                'verify_iss': bool(settings.OIDC_JWT_ISSUER),
+            },
+        )
+    except jwt.InvalidTokenError as e:
+        raise exceptions.AuthenticationFailed(f'Invalid token: {e}')
+
+
+class JWTAuthentication(OIDCAuthentication):
+    """
+    Authenticate api requests with an OIDC access token (bearer), like
+    mozilla_django_oidc's OIDCAuthentication, but the token is verified
+    locally with the keys of the identity provider, instead of calling its
+    userinfo endpoint for every request. A verified token is cached (with the
+    id of its user) until it expires, so the user is only created or updated
+    (from the claims) the first time the token is used.
+    """
+
+    def authenticate(self, request):
+        access_token = self.get_access_token(request)
+        if not access_token:
+            return None
+
+        cache_key = 'iot-jwt-' + hashlib.sha256(access_token.encode()).hexdigest()
+        user_id = cache.get(cache_key)
+        if user_id is None:
+            claims = decode_token(access_token)
+            user = self.get_or_create_user(claims)
+            timeout = claims['exp'] - time.time()
+            if timeout > 0:
+                cache.set(cache_key, user.pk, timeout)
+            return user, access_token
+
+        user = get_user_model().objects.filter(pk=user_id).first()
+        if user is None:
+            cache.delete(cache_key)
+            raise exceptions.AuthenticationFailed('Login failed: user not found')
+        return user, access_token
+
+    def get_or_create_user(self, claims):
+        # the roles are in the realm_access claim of the keycloak access token,
+        # which is where the backend gets them from too
+        claims = {**claims, 'roles': claims.get('realm_access', {}).get('roles', [])}
+        if not self.backend.verify_claims(claims):
+            raise exceptions.AuthenticationFailed('Claims verification failed')
+
+        users = self.backend.filter_users_by_claims(claims)
+        if len(users) == 1:
+            return self.backend.update_user(users[0], claims)
+        if len(users) > 1:
+            raise exceptions.AuthenticationFailed('Multiple users returned')
+        if self.backend.get_settings('OIDC_CREATE_USER', True):
+            return self.backend.create_user(claims)
+        raise exceptions.AuthenticationFailed(
+            'Login failed: No user found for the given access token.'
+        )
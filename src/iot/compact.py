@@ -0,0 +1,196 @@
+"""
+A compact, columnar representation of the device documents, for clients that
+load all the devices at once (e.g. the map on a mobile phone).
+
+Most of the values of the documents are repeated for many devices, like the
+owner, the type and the themes. In the compact representation these values are
+stored only once in a dictionary, and the devices refer to them by their
+position in that dictionary. The devices themselves are stored as columns, and
+the coordinates as integers (degrees * 10^6, which is about 10 cm). It looks
+like:
+
+    {
+        "encoding": "compact",
+        "count": 2,
+        "coordinate_scale": 1000000,
+        "dictionaries": {
+            "owners": [{"name": ..., "email": ..., "organisation": ...}],
+            "types": ["Camera", ...],
+            "themes": [...],
+            "regions": [...],
+            "legal_grounds": [...],
+            "observation_goals": [{..., "legal_ground": 0}, ...],
+            "project_paths": [["a", "b"], ...]
+        },
+        "columns": {
+            "id": [1, 2],
+            "owner": [0, 0],
+            "type": [0, 0],
+            "themes": [[0, 2], [1]],
+            "longitude": [4892288, 4893011],
+            ...
+        }
+    }
+
+To decode device i, take the value at position i of every column, and look up
+the dictionary encoded ones (see DICTIONARY_COLUMNS) in their dictionary. A
+null stays null. The observation goals refer to their legal ground in the same
+way. See decode below, which is the reference implementation.
+"""
+import json
+from typing import Dict, Hashable, List, Optional
+
+ENCODING = 'compact'
+
+COORDINATE_SCALE = 10**6
+
+# column -> dictionary, for the columns holding a single value
+DICTIONARY_COLUMNS = {
+    'owner': 'owners',
+    'type': 'types',
+}
+
+# column -> dictionary, for the columns holding a list of values
+DICTIONARY_LIST_COLUMNS = {
+    'themes': 'themes',
+    'regions': 'regions',
+    'observation_goals': 'observation_goals',
+    'project_paths': 'project_paths',
+}
+
+PLAIN_COLUMNS = [
+    'id',
+    'reference',
+    'active_until',
+    'contains_pi_data',
+    'datastream',
+    'location_description',
+]
+
+
+class Dictionary:
+    """
+    The distinct values in order of appearance, values that are not hashable
+    (objects and lists) are compared by their json representation.
+    """
+
+    def __init__(self):
+        self.values = []
+        self.positions: Dict[Hashable, int] = {}
+
+    def add(self, value) -> Optional[int]:
+        if value is None:
+            return None
+        key = value if isinstance(value, str) else json.dumps(value, sort_keys=True)
+        if key not in self.positions:
+            self.positions[key] = len(self.values)
+            self.values.append(value)
+        return self.positions[key]
+
+    def add_all(self, values) -> Optional[List[Optional[int]]]:
+        if values is None:
+            return None
+        return [self.add(value) for value in values]
+
+
+def quantise(value: Optional[float]) -> Optional[int]:
+    return None if value is None else round(value * COORDINATE_SCALE)
+
+
+def encode(documents: List[dict]) -> dict:
+    """
+    The compact representation of the given device documents.
+    """
+    dictionaries = {
+        name: Dictionary()
+        for name in [
+            *DICTIONARY_COLUMNS.values(),
+            *DICTIONARY_LIST_COLUMNS.values(),
+            'legal_grounds',
+        ]
+    }
+    columns = {
+        name: []
+        for name in [
+            *PLAIN_COLUMNS,
+            *DICTIONARY_COLUMNS,
+            *DICTIONARY_LIST_COLUMNS,
+            'longitude',
+            'latitude',
+        ]
+    }
+
+    for document in documents:
+        for name in PLAIN_COLUMNS:
+            columns[name].append(document[name])
+
+        for name, dictionary in DICTIONARY_COLUMNS.items():
+            columns[name].append(dictionaries[dictionary].add(document[name]))
+
+        for name, dictionary in DICTIONARY_LIST_COLUMNS.items():
+            values = document[name]
+            if name == 'observation_goals' and values is not None:
+                legal_grounds = dictionaries['legal_grounds']
+                values = [
+                    goal
+                    and {
+                        **goal,
+                        'legal_ground': legal_grounds.add(goal['legal_ground']),
+                    }
+                    for goal in values
+                ]
+            columns[name].append(dictionaries[dictionary].add_all(values))
+
+        location = document['location'] or {}
+        columns['longitude'].append(quantise(location.get('longitude')))
+        columns['latitude'].append(quantise(location.get('latitude')))
+
+    return {
+        'encoding': ENCODING,
+        'count': len(documents),
+        'coordinate_scale': COORDINATE_SCALE,
+        'dictionaries': {
+            name: dictionary.values for name, dictionary in dictionaries.items()
+        },
+        'columns': columns,
+    }
+
+
+def decode(payload: dict) -> List[dict]:
+    """
+    The device documents of a compact representation, with the coordinates
+    rounded to the precision of the encoding.
+    """
+    dictionaries = payload['dictionaries']
+    columns = payload['columns']
+    scale = payload['coordinate_scale']
+
+    def lookup(dictionary, position):
+        return None if position is None else dictionaries[dictionary][position]
+
+    observation_goals = [
+        goal and {**goal, 'legal_ground': lookup('legal_grounds', goal['legal_ground'])}
+        for goal in dictionaries['observation_goals']
+    ]
+    dictionaries = {**dictionaries, 'observation_goals': observation_goals}
+
+    documents = []
+    for i in range(payload['count']):
+        document = {name: columns[name][i] for name in PLAIN_COLUMNS}
+        for name, dictionary in DICTIONARY_COLUMNS.items():
+            document[name] = lookup(dictionary, columns[name][i])
+        for name, dictionary in DICTIONARY_LIST_COLUMNS.items():
+            positions = columns[name][i]
+            document[name] = (
+                None
+                if positions is None
+                else [lookup(dictionary, position) for position in positions]
+            )
+
+        longitude, latitude = columns['longitude'][i], columns['latitude'][i]
+        document['location'] = {
+            'latitude': None if latitude is None else latitude / scale,
+            'longitude': None if longitude is None else longitude / scale,
+        }
+        documents.append(document)
+    return documents
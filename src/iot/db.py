@@ -0,0 +1,47 @@
+import contextlib
+
+from django.db import OperationalError, connection, transaction
+from psycopg2 import errorcodes
+
+
+@contextlib.contextmanager
+def statement_timeout(milliseconds: int):
+    """
+    Set the statement timeout of the connection (in milliseconds, 0 disables
+    it), afterwards the timeout is reset to the default of the connection (see
+    DATABASE_STATEMENT_TIMEOUT).
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SET statement_timeout = %s', [milliseconds])
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute('RESET statement_timeout')
+
+
+@contextlib.contextmanager
+def repeatable_read():
+    """
+    A transaction in which all the queries see the same snapshot of the
+    database, e.g. to read a version together with the data of that version.
+    Within a transaction that was already started (e.g. in the tests) the
+    queries run in that transaction, at its isolation level.
+    """
+    started = connection.in_atomic_block
+    with transaction.atomic():
+        if not started:
+            with connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+        yield
+
+
+def is_statement_timeout(error: Exception) -> bool:
+    """
+    Whether the error is caused by a statement being cancelled because it took
+    longer than the statement timeout.
+    """
+    return (
+        isinstance(error, OperationalError)
+        and getattr(error.__cause__, 'pgcode', None) == errorcodes.QUERY_CANCELED
+    )
@@ -0,0 +1,90 @@
+from typing import Iterator, List
+
+from django.db import connection, transaction
+
+from iot.models import DeviceDocument
+
+# The table holding the stored documents and the view containing the live
+# aggregate they are built from, see the migration 0019_device_document. The
+# registry version is incremented whenever a document or a lookup table
+# changes, see the migrations 0020_registry_version and
+# 0025_registry_version_lookups.
+DOCUMENT_TABLE = 'iot_device_document'
+LIVE_VIEW = 'iot_device_document_live'
+REGISTRY_VERSION_TABLE = 'iot_registry_version'
+
+
+def get_registry_version() -> int:
+    """
+    The version of the registry, this changes whenever any device document
+    or any of the lookups (types, themes etc.) changes.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT "version" FROM "{REGISTRY_VERSION_TABLE}"')
+        return cursor.fetchone()[0]
+
+
+def get_documents() -> List[dict]:
+    """
+    All the stored device documents, ordered by device id.
+    """
+    return list(
+        DeviceDocument.objects.order_by('device_id').values_list('document', flat=True)
+    )
+
+
+def rebuild() -> int:
+    """
+    Replace all the stored device documents with the live aggregate, returns
+    the number of documents that were written.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        # delete rather than truncate, so readers don't have to wait for the
+        # exclusive lock that truncate takes
+        cursor.execute(f'DELETE FROM "{DOCUMENT_TABLE}"')
+        cursor.execute(
+            f'INSERT INTO "{DOCUMENT_TABLE}" ("device_id", "document") '
+            f'SELECT "device_id", "document" FROM "{LIVE_VIEW}"'
+        )
+        count = cursor.rowcount
+        cursor.execute(
+            f'UPDATE "{REGISTRY_VERSION_TABLE}" SET "version" = "version" + 1'
+        )
+        return count
+
+
+def verify() -> List[int]:
+    """
+    Compare the stored device documents with the live aggregate, returns the
+    ids of the devices for which they differ (including missing documents and
+    documents for devices that should not have one).
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT COALESCE("stored"."device_id", "live"."device_id")
+            FROM "{DOCUMENT_TABLE}" AS "stored"
+                 FULL OUTER JOIN "{LIVE_VIEW}" AS "live"
+                                 ON ("stored"."device_id" = "live"."device_id")
+            WHERE "stored"."document" IS DISTINCT FROM "live"."document"
+            ORDER BY 1
+            """
+        )
+        return [device_id for device_id, in cursor.fetchall()]
+
+
+def stream_ndjson(chunk_size: int = 1000) -> Iterator[bytes]:
+    """
+    Yield the stored device documents as newline delimited json. The documents
+    are read through a server side cursor, chunk_size at a time, and are passed
+    on as the text produced by postgres, without decoding and encoding them.
+    """
+    with connection.chunked_cursor() as cursor:
+        cursor.execute(
+            f'SELECT "document"::text FROM "{DOCUMENT_TABLE}" ORDER BY "device_id"'
+        )
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield ''.join(f'{document}\n' for document, in rows).encode()
@@ -0,0 +1,261 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.text import slugify
+
+from iot import db, device_documents, flatgeobuf
+
+FLATGEOBUF_COLUMNS = [
+    flatgeobuf.Column('id', flatgeobuf.COLUMN_TYPE_INT),
+    flatgeobuf.Column('reference', flatgeobuf.COLUMN_TYPE_STRING),
+    flatgeobuf.Column('type', flatgeobuf.COLUMN_TYPE_STRING),
+    flatgeobuf.Column('owner_name', flatgeobuf.COLUMN_TYPE_STRING),
+    flatgeobuf.Column('owner_email', flatgeobuf.COLUMN_TYPE_STRING),
+    flatgeobuf.Column('owner_organisation', flatgeobuf.COLUMN_TYPE_STRING),
+    flatgeobuf.Column('datastream', flatgeobuf.COLUMN_TYPE_STRING),
+    flatgeobuf.Column('location_description', flatgeobuf.COLUMN_TYPE_STRING),
+    flatgeobuf.Column('contains_pi_data', flatgeobuf.COLUMN_TYPE_BOOL),
+    flatgeobuf.Column('active_until', flatgeobuf.COLUMN_TYPE_DATETIME),
+    flatgeobuf.Column('themes', flatgeobuf.COLUMN_TYPE_JSON),
+    flatgeobuf.Column('regions', flatgeobuf.COLUMN_TYPE_JSON),
+    flatgeobuf.Column('observation_goals', flatgeobuf.COLUMN_TYPE_JSON),
+    flatgeobuf.Column('project_paths', flatgeobuf.COLUMN_TYPE_JSON),
+]
+
+
+def get_export_path(filename: str, build: Callable[[], bytes]) -> Path:
+    """
+    The path of the export file for the current registry version. The file is
+    built (only once) when it does not exist yet, at which point the files of
+    the previous versions are removed, see remove_previous_versions.
+    """
+    version = device_documents.get_registry_version()
+    root = Path(settings.EXPORT_ROOT)
+    root.mkdir(parents=True, exist_ok=True)
+
+    name, extension = filename.split('.', 1)
+    path = root / f'{name}-{version}.{extension}'
+    if not path.exists():
+        # write to a temporary file first, so a partially written file is never
+        # served (by this or any other worker)
+        with tempfile.NamedTemporaryFile(dir=root, delete=False) as file:
+            file.write(build())
+        os.replace(file.name, path)
+        remove_previous_versions(root, name, extension)
+
+    return path
+
+
+def remove_previous_versions(root: Path, name: str, extension: str):
+    """
+    Remove the export files of the previous registry versions, once they have
+    been superseded (by the file of the next version) for longer than
+    EXPORT_GRACE_PERIOD. Other workers may still be serving a previous file,
+    e.g. the ranges of a FlatGeobuf file requested by a map.
+    """
+    versions = {}
+    for path in root.glob(f'{name}-*.{extension}'):
+        version = path.name[len(name) + 1 : -len(extension) - 1]
+        if version.isdigit():
+            versions[int(version)] = path
+    paths = [versions[version] for version in sorted(versions)]
+
+    now = time.time()
+    for previous, superseded_by in zip(paths, paths[1:]):
+        try:
+            superseded_at = superseded_by.stat().st_mtime
+        except FileNotFoundError:
+            continue
+        if now - superseded_at >= settings.EXPORT_GRACE_PERIOD:
+            previous.unlink(missing_ok=True)
+
+
+def build_devices_json() -> bytes:
+    """
+    All the devices as a json list, in the same representation as the results
+    of the devices endpoint.
+    """
+    return json.dumps(device_documents.get_documents()).encode()
+
+
+def build_devices_json_gz() -> bytes:
+    path = get_export_path('devices.json', build_devices_json)
+    # without the modification time the output only depends on the input
+    return gzip.compress(path.read_bytes(), mtime=0)
+
+
+def to_json(value):
+    return None if value is None else json.dumps(value)
+
+
+def build_flatgeobuf() -> bytes:
+    """
+    All the devices (with a location) as a FlatGeobuf file.
+    """
+    features = (
+        flatgeobuf.Feature(
+            x=document['location']['longitude'],
+            y=document['location']['latitude'],
+            properties={
+                'id': document['id'],
+                'reference': document['reference'],
+                'type': document['type'],
+                'owner_name': document['owner']['name'],
+                'owner_email': document['owner']['email'],
+                'owner_organisation': document['owner']['organisation'],
+                'datastream': document['datastream'],
+                'location_description': document['location_description'],
+                'contains_pi_data': document['contains_pi_data'],
+                'active_until': document['active_until'],
+                'themes': to_json(document['themes']),
+                'regions': to_json(document['regions']),
+                'observation_goals': to_json(document['observation_goals']),
+                'project_paths': to_json(document['project_paths']),
+            },
+        )
+        for document in device_documents.get_documents()
+    )
+    return flatgeobuf.write_points(
+        'devices', FLATGEOBUF_COLUMNS, features, crs_code=4326
+    )
+
+
+def to_geojson(documents: List[dict]) -> dict:
+    return {
+        'type': 'FeatureCollection',
+        'features': [
+            {
+                'type': 'Feature',
+                'id': document['id'],
+                'geometry': {
+                    'type': 'Point',
+                    'coordinates': [
+                        document['location']['longitude'],
+                        document['location']['latitude'],
+                    ],
+                },
+                'properties': {
+                    key: value for key, value in document.items() if key != 'location'
+                },
+            }
+            for document in documents
+        ],
+    }
+
+
+def get_slugs(names) -> Dict[str, str]:
+    """
+    The slugs of the (distinct) names, to be used as file names. Names with the
+    same slug get a suffix in the order of the names, e.g. geluid and Geluid!
+    become geluid and geluid-2.
+    """
+    slugs = {}
+    used = set()
+    for name in sorted(set(names)):
+        slug = base = slugify(name)
+        suffix = 1
+        while slug in used:
+            suffix += 1
+            slug = f'{base}-{suffix}'
+        slugs[name] = slug
+        used.add(slug)
+    return slugs
+
+
+def get_static_api_files(documents: List[dict]) -> Dict[str, object]:
+    """
+    The files of the static api by their path: all the devices as json and
+    geojson, and the devices split by type and by theme.
+    """
+    by_type = defaultdict(list)
+    by_theme = defaultdict(list)
+    for document in documents:
+        by_type[document['type']].append(document)
+        # the themes of a device without themes are [null]
+        for theme in document['themes'] or []:
+            if theme is not None:
+                by_theme[theme].append(document)
+
+    files = {
+        'devices.json': documents,
+        'devices.geojson': to_geojson(documents),
+    }
+    for name, slug in get_slugs(by_type).items():
+        files[f'types/{slug}.json'] = by_type[name]
+    for name, slug in get_slugs(by_theme).items():
+        files[f'themes/{slug}.json'] = by_theme[name]
+    return files
+
+
+def write_static_api(directory: Path, version: int, documents: List[dict]) -> dict:
+    """
+    Write the files of the static api with their manifest to directory,
+    returns the manifest.
+    """
+    manifest = {
+        'version': version,
+        'generated': timezone.now().isoformat(),
+        'files': {},
+    }
+    for filename, content in get_static_api_files(documents).items():
+        data = json.dumps(content).encode()
+        path = directory / filename
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+        manifest['files'][filename] = {
+            'size': len(data),
+            'sha256': hashlib.sha256(data).hexdigest(),
+        }
+    (directory / 'manifest.json').write_text(json.dumps(manifest, indent=2))
+    # mkdtemp creates the directory only accessible by the owner
+    directory.chmod(0o755)
+    return manifest
+
+
+def export_static_api(root: Path) -> dict:
+    """
+    Write the public registry as static files to root, which can then be
+    served by any web server or CDN. A manifest.json lists every file with its
+    size and sha256 hash.
+
+    The files are written to a new directory next to root, after which root
+    (a symlink) is swapped to point to it. So readers always see either the
+    previous or the new export in full. Returns the manifest.
+    """
+    root = Path(root)
+    if root.exists() and not root.is_symlink():
+        raise ValueError(f'{root} exists and is not a symlink to an export')
+
+    # the documents of exactly the version in the manifest
+    with db.repeatable_read():
+        version = device_documents.get_registry_version()
+        documents = device_documents.get_documents()
+
+    root.parent.mkdir(parents=True, exist_ok=True)
+    directory = Path(tempfile.mkdtemp(prefix=f'{root.name}-', dir=root.parent))
+    link = root.parent / f'.{directory.name}'
+    try:
+        manifest = write_static_api(directory, version, documents)
+        previous = root.resolve() if root.is_symlink() else None
+        link.symlink_to(directory.name)
+        os.replace(link, root)
+    except BaseException:
+        # a failed export leaves nothing behind
+        link.unlink(missing_ok=True)
+        shutil.rmtree(directory, ignore_errors=True)
+        raise
+
+    if previous is not None and previous != directory.resolve():
+        shutil.rmtree(previous, ignore_errors=True)
+
+    return manifest
@@ -0,0 +1,297 @@
+"""
+A minimal FlatGeobuf writer for point features, see
+https://github.com/flatgeobuf/flatgeobuf for the specification.
+
+The file consists of the magic bytes, the header, a packed Hilbert R-tree of
+the feature bounding boxes and the features themselves. The header and the
+features are size prefixed flatbuffers. The features are written in the order
+of the Hilbert curve, so features that are close together are also close
+together in the file. Together with the index this allows clients to fetch
+just the features within their viewport using http range requests.
+"""
+import dataclasses
+import math
+import struct
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import flatbuffers
+
+MAGIC_BYTES = b'fgb\x03fgb\x00'
+
+# the number of children of every node of the index
+INDEX_NODE_SIZE = 16
+
+# each node is stored as min x, min y, max x, max y and a (uint64) offset
+NODE_ITEM = struct.Struct('<ddddQ')
+
+HILBERT_MAX = (1 << 16) - 1
+
+# enum GeometryType
+GEOMETRY_TYPE_POINT = 1
+
+# enum ColumnType
+COLUMN_TYPE_BOOL = 2
+COLUMN_TYPE_INT = 5
+COLUMN_TYPE_STRING = 11
+COLUMN_TYPE_JSON = 12
+COLUMN_TYPE_DATETIME = 13
+
+# The number of fields of the flatbuffer tables (see header.fbs and
+# feature.fbs in the specification).
+HEADER_NUM_FIELDS = 14
+COLUMN_NUM_FIELDS = 11
+CRS_NUM_FIELDS = 6
+FEATURE_NUM_FIELDS = 3
+GEOMETRY_NUM_FIELDS = 8
+
+
+@dataclasses.dataclass
+class Column:
+    name: str
+    type: int
+
+
+@dataclasses.dataclass
+class Feature:
+    x: float
+    y: float
+    properties: Dict[str, Any]
+
+
+def write_points(
+    name: str, columns: List[Column], features: Iterable[Feature], crs_code: int
+) -> bytes:
+    """
+    Encode the point features as a FlatGeobuf file, including the spatial
+    index. The properties of the features should be a dict of column name to
+    value, values that are None are left out.
+    """
+    features = list(features)
+    extent = get_extent(features)
+    features = sorted(
+        features, key=lambda f: hilbert_value(f.x, f.y, extent), reverse=True
+    )
+
+    encoded_features = [encode_feature(columns, feature) for feature in features]
+
+    offset = 0
+    leaves = []
+    for feature, encoded in zip(features, encoded_features):
+        leaves.append((feature.x, feature.y, feature.x, feature.y, offset))
+        offset += len(encoded)
+
+    return b''.join(
+        [
+            MAGIC_BYTES,
+            encode_header(name, columns, len(features), extent, crs_code),
+            encode_index(leaves) if features else b'',
+            *encoded_features,
+        ]
+    )
+
+
+def get_extent(features: List[Feature]) -> Tuple[float, float, float, float]:
+    if not features:
+        return 0.0, 0.0, 0.0, 0.0
+    xs = [feature.x for feature in features]
+    ys = [feature.y for feature in features]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def hilbert(x: int, y: int) -> int:
+    """
+    The position of (x, y) on a 16 bit Hilbert curve, this is a port of the
+    implementation used by the reference FlatGeobuf implementation (which in
+    turn is based on https://github.com/rawrunprotected/hilbert_curves).
+    """
+    a = x ^ y
+    b = 0xFFFF ^ a
+    c = 0xFFFF ^ (x | y)
+    d = x & (y ^ 0xFFFF)
+
+    A = a | (b >> 1)
+    B = (a >> 1) ^ a
+    C = ((c >> 1) ^ (b & (d >> 1))) ^ c
+    D = ((a & (c >> 1)) ^ (d >> 1)) ^ d
+
+    a, b, c, d = A, B, C, D
+    A = (a & (a >> 2)) ^ (b & (b >> 2))
+    B = (a & (b >> 2)) ^ (b & ((a ^ b) >> 2))
+    C ^= (a & (c >> 2)) ^ (b & (d >> 2))
+    D ^= (b & (c >> 2)) ^ ((a ^ b) & (d >> 2))
+
+    a, b, c, d = A, B, C, D
+    A = (a & (a >> 4)) ^ (b & (b >> 4))
+    B = (a & (b >> 4)) ^ (b & ((a ^ b) >> 4))
+    C ^= (a & (c >> 4)) ^ (b & (d >> 4))
+    D ^= (b & (c >> 4)) ^ ((a ^ b) & (d >> 4))
+
+    a, b, c, d = A, B, C, D
+    C ^= (a & (c >> 8)) ^ (b & (d >> 8))
+    D ^= (b & (c >> 8)) ^ ((a ^ b) & (d >> 8))
+
+    a = C ^ (C >> 1)
+    b = D ^ (D >> 1)
+
+    i0 = x ^ y
+    i1 = b | (0xFFFF ^ (i0 | a))
+
+    i0 = (i0 | (i0 << 8)) & 0x00FF00FF
+    i0 = (i0 | (i0 << 4)) & 0x0F0F0F0F
+    i0 = (i0 | (i0 << 2)) & 0x33333333
+    i0 = (i0 | (i0 << 1)) & 0x55555555
+
+    i1 = (i1 | (i1 << 8)) & 0x00FF00FF
+    i1 = (i1 | (i1 << 4)) & 0x0F0F0F0F
+    i1 = (i1 | (i1 << 2)) & 0x33333333
+    i1 = (i1 | (i1 << 1)) & 0x55555555
+
+    return (i1 << 1) | i0
+
+
+def hilbert_value(x: float, y: float, extent: Tuple[float, float, float, float]):
+    min_x, min_y, max_x, max_y = extent
+    width = max_x - min_x
+    height = max_y - min_y
+    hx = math.floor(HILBERT_MAX * (x - min_x) / width) if width else 0
+    hy = math.floor(HILBERT_MAX * (y - min_y) / height) if height else 0
+    return hilbert(hx, hy)
+
+
+def get_level_bounds(num_items: int, node_size: int) -> List[Tuple[int, int]]:
+    """
+    The (start, end) positions of the nodes of every level of the tree, from
+    the leaves up to the root. The tree is stored root first, so the leaves are
+    at the end.
+    """
+    n = num_items
+    num_nodes = n
+    level_num_nodes = [n]
+    while True:
+        n = math.ceil(n / node_size)
+        num_nodes += n
+        level_num_nodes.append(n)
+        if n == 1:
+            break
+
+    bounds = []
+    n = num_nodes
+    for size in level_num_nodes:
+        bounds.append((n - size, n))
+        n -= size
+    return bounds
+
+
+def encode_index(leaves: List[Tuple]) -> bytes:
+    """
+    Build the packed Hilbert R-tree, the leaves are the bounding boxes of the
+    features (in the order of the features) with the byte offset of the
+    feature. The offset of the other nodes is the position of their first
+    child.
+    """
+    level_bounds = get_level_bounds(len(leaves), INDEX_NODE_SIZE)
+    num_nodes = level_bounds[0][1]
+    nodes: List[Optional[Tuple]] = [None] * num_nodes
+    nodes[level_bounds[0][0] :] = leaves
+
+    for (start, end), (parent, _) in zip(level_bounds, level_bounds[1:]):
+        for first_child in range(start, end, INDEX_NODE_SIZE):
+            children = nodes[first_child : min(first_child + INDEX_NODE_SIZE, end)]
+            nodes[parent] = (
+                min(child[0] for child in children),
+                min(child[1] for child in children),
+                max(child[2] for child in children),
+                max(child[3] for child in children),
+                first_child,
+            )
+            parent += 1
+
+    return b''.join(NODE_ITEM.pack(*node) for node in nodes)
+
+
+def encode_header(name, columns, features_count, extent, crs_code) -> bytes:
+    builder = flatbuffers.Builder(1024)
+
+    column_offsets = []
+    for column in columns:
+        column_name = builder.CreateString(column.name)
+        builder.StartObject(COLUMN_NUM_FIELDS)
+        builder.PrependUOffsetTRelativeSlot(0, column_name, 0)
+        builder.PrependUint8Slot(1, column.type, 0)
+        column_offsets.append(builder.EndObject())
+
+    builder.StartVector(4, len(column_offsets), 4)
+    for column_offset in reversed(column_offsets):
+        builder.PrependUOffsetTRelative(column_offset)
+    columns_vector = builder.EndVector()
+
+    envelope = None
+    if features_count:
+        builder.StartVector(8, len(extent), 8)
+        for value in reversed(extent):
+            builder.PrependFloat64(value)
+        envelope = builder.EndVector()
+
+    builder.StartObject(CRS_NUM_FIELDS)
+    builder.PrependInt32Slot(1, crs_code, 0)
+    crs = builder.EndObject()
+
+    header_name = builder.CreateString(name)
+
+    builder.StartObject(HEADER_NUM_FIELDS)
+    builder.PrependUOffsetTRelativeSlot(0, header_name, 0)
+    if envelope is not None:
+        builder.PrependUOffsetTRelativeSlot(1, envelope, 0)
+    builder.PrependUint8Slot(2, GEOMETRY_TYPE_POINT, 0)
+    builder.PrependUOffsetTRelativeSlot(7, columns_vector, 0)
+    builder.PrependUint64Slot(8, features_count, 0)
+    # an empty file has no index, which is marked by a node size of 0 (the
+    # default node size is 16, so only a different value is written)
+    builder.PrependUint16Slot(9, INDEX_NODE_SIZE if features_count else 0, 16)
+    builder.PrependUOffsetTRelativeSlot(10, crs, 0)
+    builder.FinishSizePrefixed(builder.EndObject())
+    return bytes(builder.Output())
+
+
+def encode_properties(columns: List[Column], properties: Dict[str, Any]) -> bytes:
+    """
+    Properties are encoded as the (uint16) index of the column followed by the
+    value, strings are prefixed with their (uint32) length in bytes.
+    """
+    encoded = bytearray()
+    for index, column in enumerate(columns):
+        value = properties.get(column.name)
+        if value is None:
+            continue
+        encoded += struct.pack('<H', index)
+        if column.type == COLUMN_TYPE_BOOL:
+            encoded += struct.pack('<?', value)
+        elif column.type == COLUMN_TYPE_INT:
+            encoded += struct.pack('<i', value)
+        else:
+            value = value.encode()
+            encoded += struct.pack('<I', len(value)) + value
+    return bytes(encoded)
+
+
+def encode_feature(columns: List[Column], feature: Feature) -> bytes:
+    builder = flatbuffers.Builder(1024)
+
+    properties = builder.CreateByteVector(
+        encode_properties(columns, feature.properties)
+    )
+
+    builder.StartVector(8, 2, 8)
+    builder.PrependFloat64(feature.y)
+    builder.PrependFloat64(feature.x)
+    xy = builder.EndVector()
+
+    builder.StartObject(GEOMETRY_NUM_FIELDS)
+    builder.PrependUOffsetTRelativeSlot(1, xy, 0)
+    geometry = builder.EndObject()
+
+    builder.StartObject(FEATURE_NUM_FIELDS)
+    builder.PrependUOffsetTRelativeSlot(0, geometry, 0)
+    builder.PrependUOffsetTRelativeSlot(1, properties, 0)
+    builder.FinishSizePrefixed(builder.EndObject())
+    return bytes(builder.Output())
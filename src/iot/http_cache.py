@@ -0,0 +1,164 @@
+"""
+Caching of the public api by reverse proxies and CDNs.
+
+The public responses get a Cache-Control header that allows shared caches to
+keep them (s-maxage) and to keep serving them while they are refreshed in the
+background (stale-while-revalidate). They are also tagged with surrogate keys,
+which identify the data a response contains:
+
+    devices       every response containing all (or a page of) the devices,
+                  including the exports and the bootstrap endpoint
+    device        every response of a single device
+    device-<id>   the response of the device
+    owner-<id>    the responses of the devices of the owner
+    type-<id>     the responses of the devices of the type
+    schema        the openapi schema
+
+After the data changes, purge is called with the keys of what changed, which
+passes them to the hook configured in settings.CACHE_PURGE_HOOK (the dotted path
+of a function that takes a list of keys). For example http_purge, which sends a
+PURGE request to settings.CACHE_PURGE_URL, as understood by varnish (xkey) and
+most CDNs. The keys are sent PURGE_BATCH_SIZE at a time, to stay within the
+header size limits of the proxies.
+"""
+import functools
+import logging
+from typing import Iterable, List
+
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.utils.cache import patch_cache_control
+from django.utils.module_loading import import_string
+
+from iot.utils import chunked
+
+logger = logging.getLogger(__name__)
+
+DEVICES = 'devices'
+DEVICE = 'device'
+SCHEMA = 'schema'
+
+# the most device keys purged after an import, beyond that all the responses of
+# a single device are purged (with DEVICE) instead
+MAX_DEVICE_KEYS = 100
+# the most keys sent in a single PURGE request
+PURGE_BATCH_SIZE = 100
+
+
+def device_key(pk) -> str:
+    return f'device-{pk}'
+
+
+def owner_key(pk) -> str:
+    return f'owner-{pk}'
+
+
+def type_key(pk) -> str:
+    return f'type-{pk}'
+
+
+def device_keys(device) -> List[str]:
+    """
+    The keys of the response of a single device.
+    """
+    return [
+        DEVICE,
+        device_key(device.pk),
+        owner_key(device.owner_id),
+        type_key(device.type_id),
+    ]
+
+
+class DeviceKeys:
+    """
+    Collects the keys of the devices changed by an import. Once there are more
+    than MAX_DEVICE_KEYS of them they are replaced by DEVICE, so neither the
+    memory used nor the purge depend on the size of the import.
+    """
+
+    def __init__(self):
+        self.keys = set()
+
+    def add(self, device):
+        if DEVICE in self.keys:
+            return
+        self.keys.add(device_key(device.pk))
+        if len(self.keys) > MAX_DEVICE_KEYS:
+            self.keys = {DEVICE}
+
+    def __iter__(self):
+        return iter(self.keys)
+
+
+def patch_cache_headers(response, keys: Iterable[str]):
+    """
+    Allow shared caches to cache the (successful, or partial) response, tagged
+    with the given surrogate keys.
+    """
+    if response.status_code not in (200, 206):
+        return response
+
+    patch_cache_control(
+        response,
+        public=True,
+        max_age=settings.CACHE_CONTROL_MAX_AGE,
+        s_maxage=settings.CACHE_CONTROL_S_MAXAGE,
+        stale_while_revalidate=settings.CACHE_CONTROL_STALE_WHILE_REVALIDATE,
+    )
+    response['Surrogate-Key'] = ' '.join(keys)
+    return response
+
+
+def surrogate_keys(*keys: str):
+    """
+    Decorator adding the cache headers (see patch_cache_headers) to the
+    response of a view.
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = view(request, *args, **kwargs)
+            return patch_cache_headers(response, keys)
+
+        return wrapper
+
+    return decorator
+
+
+def purge(keys: Iterable[str]):
+    """
+    Purge the responses tagged with any of the keys from the caches, once the
+    current transaction is committed. Failing to purge is logged, but doesn't
+    fail the change itself, the responses will expire after s-maxage anyway.
+    """
+    if not settings.CACHE_PURGE_HOOK:
+        return
+
+    keys = sorted(set(keys))
+    if not keys:
+        return
+
+    def run_hook():
+        try:
+            import_string(settings.CACHE_PURGE_HOOK)(keys)
+        except Exception:
+            logger.exception('failed to purge %s', ' '.join(keys))
+
+    transaction.on_commit(run_hook)
+
+
+def http_purge(keys: List[str]):
+    """
+    A purge hook sending PURGE requests for the keys to CACHE_PURGE_URL, with
+    at most PURGE_BATCH_SIZE keys each.
+    """
+    for batch in chunked(keys, PURGE_BATCH_SIZE):
+        response = requests.request(
+            'PURGE',
+            settings.CACHE_PURGE_URL,
+            headers={'Surrogate-Key': ' '.join(batch)},
+            timeout=10,
+        )
+        response.raise_for_status()
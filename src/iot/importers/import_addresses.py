@@ -0,0 +1,97 @@
+"""
+Loading of the addresses of a BAG extract, to geocode the postcodes and house
+numbers of the sensors without the atlas search api (see import_sensor.Geocoder).
+
+The extract is a csv file with (at least) the postcode, huisnummer, huisletter,
+huisnummertoevoeging, lon and lat columns, like the address extracts of
+NLExtract. The addresses are copied into a staging table, which then replaces
+the table of the addresses that were loaded before. So the geocoder can keep
+using the previous addresses while the extract is loaded, the table is only
+locked while it is swapped.
+"""
+import io
+from typing import Iterable, Optional
+
+from django.db import connection, transaction
+
+from iot import models
+from iot.importers.import_sensor import normalize_postcode, normalize_suffix
+from iot.importers.import_sensors import copy_value
+from iot.utils import chunked
+
+COLUMNS = ['postcode', 'house_number', 'suffix', 'point']
+STAGING_TABLE = 'iot_address_staging'
+
+
+def to_values(row: dict) -> Optional[list]:
+    """
+    The values of the columns of an address from a row of the extract, None
+    for the addresses without a postcode or location.
+    """
+    postcode = normalize_postcode(row.get('postcode') or '')
+    house_number = (row.get('huisnummer') or '').strip()
+    if not postcode or not house_number or not row.get('lon') or not row.get('lat'):
+        return None
+    suffix = normalize_suffix(
+        (row.get('huisletter') or '') + (row.get('huisnummertoevoeging') or '')
+    )
+    srid = models.Address._meta.get_field('point').srid
+    point = f'SRID={srid};POINT({float(row["lon"])} {float(row["lat"])})'
+    return [postcode, house_number, suffix, point]
+
+
+def load_addresses(rows: Iterable[dict], chunk_size: int = 100_000) -> int:
+    """
+    Replace the addresses by those of the rows of an extract, returns the
+    number of addresses that were loaded.
+    """
+    meta = models.Address._meta
+    table = meta.db_table
+    columns = ', '.join(f'"{column}"' for column in COLUMNS)
+    count = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE IF EXISTS "{STAGING_TABLE}"')
+        # with the default of the id, i.e. the staging table shares the
+        # sequence of the ids with the table
+        cursor.execute(
+            f'CREATE TABLE "{STAGING_TABLE}" '
+            f'(LIKE "{table}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'
+        )
+        addresses = filter(None, map(to_values, rows))
+        for chunk in chunked(addresses, chunk_size):
+            data = io.StringIO()
+            for values in chunk:
+                data.write('\t'.join(map(copy_value, values)) + '\n')
+            data.seek(0)
+            cursor.copy_expert(f'COPY "{STAGING_TABLE}" ({columns}) FROM STDIN', data)
+            count += len(chunk)
+
+        # the indexes are built after loading, under temporary names
+        pk = meta.pk.column
+        cursor.execute(
+            f'ALTER TABLE "{STAGING_TABLE}" '
+            f'ADD CONSTRAINT "{STAGING_TABLE}_pkey" PRIMARY KEY ("{pk}")'
+        )
+        indexes = {}
+        for i, index in enumerate(meta.indexes):
+            indexes[f'{STAGING_TABLE}_{i}'] = index.name
+            index_columns = ', '.join(
+                f'"{meta.get_field(name).column}"' for name in index.fields
+            )
+            cursor.execute(
+                f'CREATE INDEX "{STAGING_TABLE}_{i}" '
+                f'ON "{STAGING_TABLE}" ({index_columns})'
+            )
+
+        # swap the tables, the sequence of the ids is owned by the table, so it
+        # would be dropped with it
+        cursor.execute('SELECT pg_get_serial_sequence(%s, %s)', [table, pk])
+        (sequence,) = cursor.fetchone()
+        cursor.execute(f'ALTER SEQUENCE {sequence} OWNED BY "{STAGING_TABLE}"."{pk}"')
+        cursor.execute(f'DROP TABLE "{table}"')
+        cursor.execute(f'ALTER TABLE "{STAGING_TABLE}" RENAME TO "{table}"')
+        cursor.execute(f'ALTER INDEX "{STAGING_TABLE}_pkey" RENAME TO "{table}_pkey"')
+        for staging_name, name in indexes.items():
+            cursor.execute(f'ALTER INDEX "{staging_name}" RENAME TO "{name}"')
+
+    return count
@@ -1,11 +1,20 @@
-from collections import Counter
-from typing import Dict, Generator, List, Tuple
-
+import hashlib
+import json
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, Generator, Iterable, Iterator, List, Optional, Tuple, Union
+
+import ijson
+import requests
 from django.conf import settings
+from requests.adapters import HTTPAdapter
 
-from iot import models, validators
+from iot import http_cache, models
 from iot.dateclasses import LatLong, Location, ObservationGoal, PersonData, SensorData
-from iot.importers import import_person, import_sensor
+from iot.importers import import_person, import_sensors
+from iot.importers.resolver import LookupResolver
+from iot.utils import chunked
 from iot.validators import validate_person_data
 
 API = 'https://maps.amsterdam.nl/open_geodata/geojson_lnglat.php?'
@@ -25,44 +34,222 @@ API_MAPPER = {
 }
 
 
-def convert_api_data(api_name: str, api_data: dict) -> Tuple[List[Exception], int, int]:
+class ApiData:
     """
-    takes the api_name to find the parser, and the api_data to convert the data with the
-    existing data. The parser will return a generator of SensorData.
-    from the generator, use the import_person_data and import_senso_data.
-    It will return a tuple of a list of errors, number of insertions, number of updated
-    records.
+    The json data of an api, which is kept in a (temporary) file rather than in
+    memory. The features are parsed incrementally, when the parsers iterate over
+    data['features'], so only one of them is in memory at a time.
     """
-    parser = PARSERS_MAPPER[api_name]
 
-    sensors = list(parser(api_data))
-    owners_list = [sensor.owner for sensor in sensors]
+    def __init__(self, file):
+        self.file = file
+
+    def __getitem__(self, key: str) -> Iterator[dict]:
+        # the parsers only read the features
+        if key != 'features':
+            raise KeyError(key)
+        self.file.seek(0)
+        return ijson.items(self.file, 'features.item', use_float=True)
+
+    def close(self):
+        self.file.close()
 
-    for owner in owners_list:
-        validate_person_data(owner)
 
-    imported_owners = {
-        person_data.email.lower(): import_person.import_person(person_data)
-        for person_data in owners_list
+def content_hash(features: Iterable[dict]) -> str:
+    """
+    The hash of the features of an api, which doesn't depend on the order of
+    the keys of their objects.
+    """
+    digest = hashlib.sha256()
+    for feature in features:
+        normalised = json.dumps(feature, sort_keys=True, separators=(',', ':'))
+        digest.update(normalised.encode() + b'\n')
+    return digest.hexdigest()
+
+
+def fetch_api_data(
+    session: requests.Session,
+    url: str,
+    states: Iterable[models.UpstreamState] = (),
+    conditional: bool = True,
+) -> Optional[ApiData]:
+    """
+    Get the json data of an api, raises a RuntimeError when the api doesn't
+    return json. The response is streamed to a temporary file, see ApiData.
+    The states are those of the apis of the url, which are updated (but not
+    saved) with the ETag and Last-Modified headers of the response. When the
+    apis were all imported from the same response before, the request is
+    conditional and None is returned when the url wasn't modified since.
+    """
+    states = list(states)
+    headers = {}
+    if conditional and states:
+        etags = {state.etag for state in states}
+        if len(etags) == 1 and '' not in etags:
+            headers['If-None-Match'] = etags.pop()
+        last_modified = {state.last_modified for state in states}
+        if len(last_modified) == 1 and '' not in last_modified:
+            headers['If-Modified-Since'] = last_modified.pop()
+
+    with session.get(
+        url=url, headers=headers, stream=True, timeout=settings.IMPORT_API_TIMEOUT
+    ) as response:
+        if headers and response.status_code == 304:
+            return None
+        if (
+            response.status_code != 200
+            or 'application/json' not in response.headers["Content-Type"]
+        ):
+            raise RuntimeError(f"{response.status_code} - {response.content}")
+
+        for state in states:
+            state.etag = response.headers.get('ETag', '')
+            state.last_modified = response.headers.get('Last-Modified', '')
+
+        file = tempfile.TemporaryFile()
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            file.write(chunk)
+    return ApiData(file)
+
+
+def get_upstream_states(api_names: Iterable[str]) -> Dict[str, models.UpstreamState]:
+    """
+    The states of the apis at their last import, by their name. The apis that
+    weren't imported yet get a new (unsaved) state.
+    """
+    states = models.UpstreamState.objects.in_bulk(api_names, field_name='api_name')
+    return {
+        api_name: states.get(api_name)
+        or models.UpstreamState(api_name=api_name, url=API_MAPPER[api_name])
+        for api_name in api_names
     }
 
-    counter = Counter()
+
+def fetch_apis(
+    api_names: Iterable[str],
+    states: Optional[Dict[str, models.UpstreamState]] = None,
+    force: bool = False,
+) -> Dict[str, Optional[ApiData]]:
+    """
+    Get the data of the apis, by their name (see ApiData, which should be closed
+    once the apis are imported). The apis sharing a url (e.g. the
+    VIS layer of maps.amsterdam.nl) are fetched once, and the distinct urls are
+    fetched concurrently, with a shared session. The data is only read by the
+    parsers, so it is passed to every api of the url.
+
+    When the states of the apis are passed (see get_upstream_states), the data
+    of the apis that didn't change since their last import is None: the url
+    returned 304 Not Modified, or data with the same content_hash. The states
+    are updated, to be saved once the apis are imported. Unless forced, then
+    all the data is returned.
+    """
+    api_names = list(api_names)
+    states = states or {}
+    urls = list(dict.fromkeys(API_MAPPER[api_name] for api_name in api_names))
+    if not urls:
+        return {}
+
+    def fetch(session, url):
+        url_states = [
+            states[api_name]
+            for api_name in api_names
+            if API_MAPPER[api_name] == url and api_name in states
+        ]
+        return fetch_api_data(session, url, url_states, conditional=not force)
+
+    with requests.Session() as session, ThreadPoolExecutor(
+        max_workers=len(urls)
+    ) as executor:
+        session.mount('https://', HTTPAdapter(pool_maxsize=len(urls)))
+        data = dict(zip(urls, executor.map(partial(fetch, session), urls)))
+
+    hashes = {
+        url: content_hash(url_data['features'])
+        for url, url_data in data.items()
+        if url_data is not None and states
+    }
+    result = {}
+    for api_name in api_names:
+        url = API_MAPPER[api_name]
+        api_data = data[url]
+        state = states.get(api_name)
+        if api_data is not None and state is not None:
+            if state.content_hash == hashes[url] and not force:
+                api_data = None
+            state.content_hash = hashes[url]
+        result[api_name] = api_data
+    return result
+
+
+def convert_api_data(
+    api_name: str,
+    api_data: Union[dict, ApiData],
+    resolver: Optional[LookupResolver] = None,
+) -> Tuple[List[Exception], int, int, int]:
+    """
+    takes the api_name to find the parser, and the api_data to convert the data with the
+    existing data. The parser will return a generator of SensorData, which is imported
+    settings.IMPORT_CHUNK_SIZE sensors at a time, so the memory used doesn't depend on
+    the size of the api (when the data is an ApiData).
+    It will return a tuple of a list of errors, number of insertions, number of updated
+    and unchanged records. A resolver can be passed to share the lookups between the
+    imports of several apis.
+    """
+    parser = PARSERS_MAPPER[api_name]
+    if resolver is None:
+        resolver = LookupResolver()
 
     errors: List[Exception] = []
-    for sensor_data in sensors:
-        try:
-            validators.validate_sensor(sensor_data)
-            owner = imported_owners[sensor_data.owner.email.lower()]
-            _, created = import_sensor.import_sensor(sensor_data, owner)
-            counter.update([created])
-        except Exception as e:
-            errors.append(e)
+    created = updated = unchanged = 0
+    # the owners by their lower cased email, with the data they were imported with
+    imported_owners: Dict[str, Tuple[PersonData, models.Person]] = {}
+    # the keys of the created and updated devices, to purge from the caches
+    device_keys = http_cache.DeviceKeys()
+
+    for sensors in chunked(parser(api_data), settings.IMPORT_CHUNK_SIZE):
+        owners_list = [sensor.owner for sensor in sensors]
+
+        for owner in owners_list:
+            validate_person_data(owner)
+
+        # the owners and sensors of every chunk are imported in a transaction
+        with resolver.atomic():
+            # every owner is imported once, unless its data changes, so it ends up
+            # with its last data (as it would when importing them one at a time)
+            owners_by_email = {owner.email.lower(): owner for owner in owners_list}
+            for email, person_data in owners_by_email.items():
+                if (
+                    email not in imported_owners
+                    or imported_owners[email][0] != person_data
+                ):
+                    owner = import_person.import_person(person_data)
+                    imported_owners[email] = person_data, owner
+
+            result = import_sensors.import_sensors(
+                sensors,
+                {email: owner for email, (_, owner) in imported_owners.items()},
+                action_logger=lambda result: device_keys.add(result[0]),
+                resolver=resolver,
+            )
+        errors += result[0]
+        created += result[2]
+        updated += result[3]
+        unchanged += result[4]
+
+    # the owners are updated as well, which shows in all of their devices
+    http_cache.purge(
+        [
+            http_cache.DEVICES,
+            *device_keys,
+            *(http_cache.owner_key(owner.pk) for _, owner in imported_owners.values()),
+        ]
+    )
 
     # TODO: need to create something unique for each sensor source
     # delete sensors from the same owner that are not in the api
     # delete_not_found_sensors(sensors=sensors, source=api_name)
 
-    return (errors, counter[True], counter[False])
+    return (errors, created, updated, unchanged)
 
 
 def parse_wifi_sensor_crowd_management(data: dict) -> Generator[SensorData, None, None]:
@@ -1,13 +1,18 @@
-from typing import Dict, Union
+import dataclasses
+import datetime
+import re
+from typing import Dict, Optional, Tuple, Union
 
 import requests
 from django.conf import settings
 from django.contrib.gis.geos import Point
+from django.utils import timezone
 from rest_framework.exceptions import ValidationError
 
 from iot import models
 from iot.dateclasses import LatLong, PostcodeHouseNumber, SensorData
-from iot.utils import parse_date, remove_all
+from iot.importers.resolver import LookupResolver
+from iot.utils import LRUCache, parse_date, set_relations
 
 STADSDEEL_TO_STADSDEEL_CODE_MAPPING = {
     "Stadsdeel Centrum": "A",
@@ -21,22 +26,34 @@ STADSDEEL_TO_STADSDEEL_CODE_MAPPING = {
     "Stadsdeel Zuid": "K",
 }
 
+# the geocoded addresses of the process, in front of the database (see Geocoder)
+geocode_cache = LRUCache(settings.GEOCODE_CACHE_SIZE)
+
 
 def import_sensor(
-    sensor_data: SensorData, owner: models.Person, action_logger=lambda x: x
+    sensor_data: SensorData,
+    owner: models.Person,
+    action_logger=lambda x: x,
+    resolver: Optional[LookupResolver] = None,
 ):
     """
     Import sensor data parsed from an iprox or bulk registration excel file.
+    A resolver can be passed to share the lookups between the sensors of an
+    import, see import_sensors for importing many sensors at once.
     """
+    if resolver is None:
+        resolver = LookupResolver(action_logger)
 
+    resolver.resolve(models.Type, [sensor_data.type])
     defaults = {
-        'type': action_logger(models.Type.objects.get_or_create(name=sensor_data.type))[
-            0
-        ],
+        'type_id': resolver.get(models.Type, sensor_data.type),
         'datastream': sensor_data.datastream,
         'contains_pi_data': sensor_data.contains_pi_data == 'Ja',
         'active_until': parse_date(sensor_data.active_until),
         'owner': owner,
+        # every sensor is written, see import_sensors for skipping the sensors
+        # that didn't change
+        'fingerprint': '',
     }
     location = get_location(sensor_data)
     # update the defaults with only the location and location_description. This will
@@ -54,65 +71,76 @@ def import_sensor(
         )
     )
 
-    # many2many relations
-    remove_all(device.regions)
+    # many2many relations, only the changes are written
+    region_names = []
     if 'regions' in location:
-        for region_name in location['regions'].split(settings.IPROX_SEPARATOR):
-            region = action_logger(
-                models.Region.objects.get_or_create(
-                    name=STADSDEEL_TO_STADSDEEL_CODE_MAPPING.get(
-                        region_name, region_name
-                    )
-                )
-            )[0]
-            device.regions.add(region)
-
-    remove_all(device.themes)
-    for theme_name in sensor_data.themes.split(settings.IPROX_SEPARATOR):
-        theme = models.Theme.objects.get_or_create(name=theme_name)[0]
-        device.themes.add(theme)
-
-    remove_all(device.observation_goals)
-    for observation_goal in sensor_data.observation_goals:
-        # only create a legal_ground if it's not empty string and valid, otherwise make it None.
-        legal_ground = (
-            None
-            if not observation_goal.legal_ground
-            else action_logger(
-                models.LegalGround.objects.get_or_create(
-                    name=observation_goal.legal_ground
-                )
-            )[0]
+        region_names = [
+            STADSDEEL_TO_STADSDEEL_CODE_MAPPING.get(region_name, region_name)
+            for region_name in location['regions'].split(settings.IPROX_SEPARATOR)
+        ]
+    resolver.resolve(models.Region, region_names)
+    set_relations(
+        models.Device.regions,
+        {device.pk: [resolver.get(models.Region, name) for name in region_names]},
+    )
+
+    theme_names = sensor_data.themes.split(settings.IPROX_SEPARATOR)
+    resolver.resolve(models.Theme, theme_names)
+    set_relations(
+        models.Device.themes,
+        {device.pk: [resolver.get(models.Theme, name) for name in theme_names]},
+    )
+
+    # only create a legal_ground if it's not empty string and valid, otherwise
+    # make it None.
+    resolver.resolve(
+        models.LegalGround,
+        [
+            goal.legal_ground
+            for goal in sensor_data.observation_goals
+            if goal.legal_ground
+        ],
+    )
+    goals = [
+        (
+            goal.observation_goal,
+            goal.privacy_declaration,
+            resolver.get(models.LegalGround, goal.legal_ground)
+            if goal.legal_ground
+            else None,
         )
+        for goal in sensor_data.observation_goals
+    ]
+    resolver.resolve(models.ObservationGoal, goals)
+    set_relations(
+        models.Device.observation_goals,
+        {device.pk: [resolver.get(models.ObservationGoal, *goal) for goal in goals]},
+    )
 
-        import_result = action_logger(
-            models.ObservationGoal.objects.get_or_create(
-                observation_goal=observation_goal.observation_goal,
-                privacy_declaration=observation_goal.privacy_declaration,
-                legal_ground=legal_ground,
-            )
-        )[0]
-        device.observation_goals.add(import_result)
-
-    remove_all(device.projects)
-    for project in sensor_data.projects:
-        # only import the projects if the list is not empty
-        if project:
-            path = project.split(settings.IPROX_SEPARATOR)
-            # because it's a list of string, convert every string to a list because it's an
-            # arrayfield that will take a list of string for each path.
-            project_paths = action_logger(
-                models.Project.objects.get_or_create(path=path)
-            )[0]
-            device.projects.add(project_paths)
+    # only import the projects if the list is not empty, every project is a
+    # path (an array field) of names
+    paths = [
+        tuple(project.split(settings.IPROX_SEPARATOR))
+        for project in sensor_data.projects
+        if project
+    ]
+    resolver.resolve(models.Project, [(path,) for path in paths])
+    set_relations(
+        models.Device.projects,
+        {device.pk: [resolver.get(models.Project, path) for path in paths]},
+    )
 
     return device, created
 
 
-def get_location(sensor_data: SensorData) -> Dict:
+def get_location(
+    sensor_data: SensorData, geocoder: Optional['Geocoder'] = None
+) -> Dict:
     """
     Get the specific django field and value which should be filled for the
     location data that was provided. It will return a dict of one or multiple locations.
+    The postcodes and house numbers are geocoded by the geocoder (if any) to share its
+    statistics between the sensors of an import.
     """
     locations = {}  # empty dict to hold the locations.
     if sensor_data.location.regions:
@@ -125,9 +153,12 @@ def get_location(sensor_data: SensorData) -> Dict:
     if sensor_data.location.description:
         locations['location_description'] = sensor_data.location.description
     if isinstance(sensor_data.location.postcode_house_number, PostcodeHouseNumber):
-        location = get_center_coordinates(
+        if geocoder is None:
+            geocoder = Geocoder()
+        location = geocoder.get_center_coordinates(
             sensor_data.location.postcode_house_number.postcode,
             sensor_data.location.postcode_house_number.house_number,
+            sensor_data.location.postcode_house_number.suffix or '',
         )
         locations['location'] = location
     # if the locations dict is empty, raise an exception otherwise return it.
@@ -137,6 +168,112 @@ def get_location(sensor_data: SensorData) -> Dict:
         raise TypeError(f'Onbekend locatie type {type(sensor_data.location)}')
 
 
+@dataclasses.dataclass
+class GeocodeStats:
+    memory_hits: int = 0
+    address_hits: int = 0
+    database_hits: int = 0
+    misses: int = 0
+
+    @property
+    def lookups(self) -> int:
+        return self.hits + self.misses
+
+    @property
+    def hits(self) -> int:
+        return self.memory_hits + self.address_hits + self.database_hits
+
+
+class Geocoder:
+    """
+    Geocodes the postcodes and house numbers of the sensors. The addresses are
+    looked up in the addresses loaded by the import_addresses command first,
+    and are otherwise requested with get_center_coordinates (which makes at
+    least two requests to the atlas search api). The results of the api are
+    cached in the database (GeocodeResult) for settings.GEOCODE_CACHE_TTL
+    seconds, the addresses that weren't found for GEOCODE_NEGATIVE_CACHE_TTL
+    seconds. As the api ignores the suffix, its results are cached by the
+    postcode and house number only. The addresses that were found are cached
+    in the memory of the process as well (geocode_cache), those that weren't
+    are not, so every process finds them as soon as they are loaded by
+    import_addresses. The stats count where the results of the geocoder were
+    found.
+    """
+
+    def __init__(self):
+        self.stats = GeocodeStats()
+
+    def get_center_coordinates(
+        self, postcode: str, house_number: Union[int, str], suffix: str = ''
+    ) -> Point:
+        key = (
+            normalize_postcode(postcode),
+            str(house_number).strip(),
+            normalize_suffix(suffix),
+        )
+        now = timezone.now()
+
+        point, expires_at = geocode_cache.get(key, (None, None))
+        if expires_at is not None and expires_at > now:
+            self.stats.memory_hits += 1
+        else:
+            point, expires_at = self.lookup(key, postcode, house_number, now)
+            if point is not None:
+                geocode_cache.set(key, (point, expires_at))
+
+        if point is None:
+            raise ValidationError(postcode, house_number)
+        return point.clone()
+
+    def lookup(
+        self,
+        key: tuple,
+        postcode: str,
+        house_number: Union[int, str],
+        now: datetime.datetime,
+    ) -> Tuple[Optional[Point], datetime.datetime]:
+        """
+        The point of the address (None when it wasn't found) and until when it
+        can be cached.
+        """
+        postcode_key, house_number_key, suffix_key = key
+
+        points = dict(
+            models.Address.objects.filter(
+                postcode=postcode_key, house_number=house_number_key
+            ).values_list('suffix', 'point')
+        )
+        if points:
+            self.stats.address_hits += 1
+            # an unknown suffix is ignored, like get_center_coordinates does
+            point = points.get(suffix_key) or points.get('') or points[min(points)]
+            return point, now + datetime.timedelta(seconds=settings.GEOCODE_CACHE_TTL)
+
+        result = models.GeocodeResult.objects.filter(
+            postcode=postcode_key, house_number=house_number_key, expires_at__gt=now
+        ).first()
+        if result is not None:
+            self.stats.database_hits += 1
+            return result.point, result.expires_at
+
+        self.stats.misses += 1
+        try:
+            point = get_center_coordinates(postcode, house_number)
+        except ValidationError:
+            point = None
+        # an address that wasn't found may be added soon, e.g. a new building
+        ttl = settings.GEOCODE_CACHE_TTL
+        if point is None:
+            ttl = settings.GEOCODE_NEGATIVE_CACHE_TTL
+        expires_at = now + datetime.timedelta(seconds=ttl)
+        models.GeocodeResult.objects.update_or_create(
+            postcode=postcode_key,
+            house_number=house_number_key,
+            defaults={'point': point, 'expires_at': expires_at},
+        )
+        return point, expires_at
+
+
 def get_center_coordinates(postcode: str, house_number: Union[int, str]) -> Point:
     """
     :return: The centroid longitude and latitude coordinates for a postcode and
@@ -183,6 +320,13 @@ def normalize_postcode(postcode: str) -> str:
     return postcode.replace(' ', '').upper()
 
 
+def normalize_suffix(suffix: str) -> str:
+    """
+    The house letter and addition of an address, e.g. "a-1" and "A 1" are "A1".
+    """
+    return re.sub(r'[^0-9A-Za-z]', '', suffix or '').upper()
+
+
 def get_postcode_url(postcode: str) -> str:
     normalized = normalize_postcode(postcode)
     return f'{settings.ATLAS_POSTCODE_SEARCH}/?q={normalized}'
@@ -0,0 +1,431 @@
+"""
+Set based import of sensors, for importing many sensors at once.
+
+Rather than importing the sensors one at a time (see import_sensor), the
+sensors are copied into a staging table, from which the devices are inserted
+or updated by a single INSERT ... ON CONFLICT statement. The lookups (types,
+themes, regions, legal grounds, observation goals and projects) are resolved
+for all the sensors at once (see resolver.LookupResolver), and the changes of
+the many to many relations are written in bulk. The number of queries
+therefore doesn't depend on the number of sensors.
+
+Only the sensors that changed since they were last imported are written, which
+is told by the fingerprint (a hash of the normalised sensor data) stored with
+every device.
+"""
+import contextlib
+import datetime
+import hashlib
+import io
+import json
+from collections import Counter
+from typing import Dict, List, Optional, Set, Tuple
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+
+from iot import models
+from iot.dateclasses import SensorData
+from iot.importers.import_sensor import (
+    STADSDEEL_TO_STADSDEEL_CODE_MAPPING,
+    Geocoder,
+    get_location,
+)
+from iot.importers.resolver import LookupResolver
+from iot.utils import chunked, parse_date, set_relations
+from iot.validators import validate_sensor
+
+STAGING_TABLE = 'iot_device_staging'
+
+# The values of the devices, in the order of the columns of the staging table
+DEVICE_COLUMNS = [
+    'reference',
+    'owner_id',
+    'type_id',
+    'datastream',
+    'contains_pi_data',
+    'active_until',
+    'location',
+    'location_description',
+    'fingerprint',
+]
+
+
+def copy_value(value) -> str:
+    """
+    A value in the text format of COPY.
+    """
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, datetime.datetime):
+        value = value.date()
+    return (
+        str(value)
+        .replace('\\', '\\\\')
+        .replace('\t', '\\t')
+        .replace('\n', '\\n')
+        .replace('\r', '\\r')
+    )
+
+
+def get_regions(location: dict) -> List[str]:
+    if 'regions' not in location:
+        return []
+    return [
+        STADSDEEL_TO_STADSDEEL_CODE_MAPPING.get(name, name)
+        for name in location['regions'].split(settings.IPROX_SEPARATOR)
+    ]
+
+
+def get_themes(sensor_data: SensorData) -> List[str]:
+    return sensor_data.themes.split(settings.IPROX_SEPARATOR)
+
+
+def get_observation_goals(sensor_data: SensorData) -> List[tuple]:
+    """
+    The observation goals as (observation_goal, privacy_declaration,
+    legal_ground) tuples, with the name of the legal ground, if any.
+    """
+    return [
+        (goal.observation_goal, goal.privacy_declaration, goal.legal_ground or None)
+        for goal in sensor_data.observation_goals
+    ]
+
+
+def get_project_paths(sensor_data: SensorData) -> List[tuple]:
+    return [
+        tuple(project.split(settings.IPROX_SEPARATOR))
+        for project in sensor_data.projects
+        if project
+    ]
+
+
+def upsert_devices(rows: List[list]) -> List[Tuple[int, str, int, bool]]:
+    """
+    Insert or update the devices from the rows (with the DEVICE_COLUMNS), by
+    their reference and owner. When a device occurs more than once the last
+    row wins, as it would when importing the rows one at a time. Returns the
+    id, reference, owner id and whether it was created of every device.
+    """
+    srid = models.Device._meta.get_field('location').srid
+    columns = ', '.join(f'"{column}"' for column in DEVICE_COLUMNS)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            CREATE TEMPORARY TABLE IF NOT EXISTS "{STAGING_TABLE}" (
+                "row" integer NOT NULL,
+                "reference" varchar(64),
+                "owner_id" integer,
+                "type_id" integer,
+                "datastream" varchar(255),
+                "contains_pi_data" boolean,
+                "active_until" date,
+                "location" geometry(Point, {srid}),
+                "location_description" varchar(255),
+                "fingerprint" varchar(64)
+            ) ON COMMIT DROP
+            """
+        )
+        cursor.execute(f'TRUNCATE "{STAGING_TABLE}"')
+
+        data = io.StringIO()
+        for index, row in enumerate(rows):
+            values = [index, *row]
+            data.write('\t'.join(map(copy_value, values)) + '\n')
+        data.seek(0)
+        cursor.copy_expert(
+            f'COPY "{STAGING_TABLE}" ("row", {columns}) FROM STDIN', data
+        )
+
+        cursor.execute(
+            f"""
+            INSERT INTO "iot_device" ({columns})
+            SELECT DISTINCT ON ("reference", "owner_id") {columns}
+            FROM "{STAGING_TABLE}"
+            ORDER BY "reference", "owner_id", "row" DESC
+            ON CONFLICT ("reference", "owner_id") DO UPDATE SET
+                "type_id" = EXCLUDED."type_id",
+                "datastream" = EXCLUDED."datastream",
+                "contains_pi_data" = EXCLUDED."contains_pi_data",
+                "active_until" = EXCLUDED."active_until",
+                -- only set when the sensor has them, like import_sensor
+                "location" = COALESCE(EXCLUDED."location", "iot_device"."location"),
+                "location_description" = COALESCE(
+                    EXCLUDED."location_description",
+                    "iot_device"."location_description"
+                ),
+                "fingerprint" = EXCLUDED."fingerprint"
+            RETURNING "id", "reference", "owner_id", ("xmax" = 0) AS "created"
+            """
+        )
+        return cursor.fetchall()
+
+
+def fingerprint(sensor: SensorData, location: dict) -> str:
+    """
+    The hash of the normalised data of a (validated) sensor with its location,
+    which is what is stored for a device, apart from its reference and owner.
+    The names of the lookups are case insensitive, and the relations unordered.
+    """
+    active_until = parse_date(sensor.active_until)
+    if isinstance(active_until, datetime.datetime):
+        active_until = active_until.date()
+    goals = {
+        (goal, privacy_declaration, (legal_ground or '').lower())
+        for goal, privacy_declaration, legal_ground in get_observation_goals(sensor)
+    }
+    data = {
+        'type': sensor.type.lower(),
+        'datastream': sensor.datastream,
+        'contains_pi_data': sensor.contains_pi_data == 'Ja',
+        'active_until': active_until and active_until.isoformat(),
+        'location': location_ewkt(location.get('location')),
+        'location_description': location.get('location_description'),
+        'regions': sorted({name.lower() for name in get_regions(location)}),
+        'themes': sorted({name.lower() for name in get_themes(sensor)}),
+        # the privacy declaration may be None
+        'observation_goals': sorted(goals, key=repr),
+        'projects': sorted(set(get_project_paths(sensor))),
+    }
+    normalised = json.dumps(data, sort_keys=True)
+    return hashlib.sha256(normalised.encode()).hexdigest()
+
+
+def get_fingerprints(keys: Set[Tuple[str, int]]) -> Dict[Tuple[str, int], tuple]:
+    """
+    The id and fingerprint of the existing devices, by their reference and
+    owner id.
+    """
+    devices = models.Device.objects.filter(
+        reference__in={reference for reference, _ in keys},
+        owner_id__in={owner_id for _, owner_id in keys},
+    ).values_list('reference', 'owner_id', 'pk', 'fingerprint')
+    return {
+        (reference, owner_id): (pk, fingerprint)
+        for reference, owner_id, pk, fingerprint in devices
+        if (reference, owner_id) in keys
+    }
+
+
+@contextlib.contextmanager
+def keep_fingerprints():
+    """
+    Keep the fingerprints of the devices when their relations are changed
+    (within a transaction), which the database triggers clear otherwise. The
+    setting is local to the transaction (or savepoint), so it is also undone
+    when the transaction fails.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT set_config('iot.keep_fingerprints', 'on', true)")
+    yield
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT set_config('iot.keep_fingerprints', '', true)")
+
+
+def write_devices(
+    batch: List[Tuple[SensorData, models.Person, dict, str]],
+    resolver: LookupResolver,
+) -> Dict[Tuple[str, int], Tuple[int, bool]]:
+    """
+    Write the (validated) sensors with their owner, location and fingerprint
+    to their devices. Returns the id and whether it was created of every
+    device, by its reference and owner id.
+    """
+    resolver.resolve(models.Type, (sensor.type for sensor, *_ in batch))
+    resolver.resolve(
+        models.Theme, (theme for sensor, *_ in batch for theme in get_themes(sensor))
+    )
+    resolver.resolve(
+        models.Region,
+        (region for _, _, location, _ in batch for region in get_regions(location)),
+    )
+    goals = {goal for sensor, *_ in batch for goal in get_observation_goals(sensor)}
+    resolver.resolve(
+        models.LegalGround,
+        (legal_ground for _, _, legal_ground in goals if legal_ground),
+    )
+    goal_keys = {
+        goal: (
+            goal[0],
+            goal[1],
+            resolver.get(models.LegalGround, goal[2]) if goal[2] else None,
+        )
+        for goal in goals
+    }
+    resolver.resolve(models.ObservationGoal, goal_keys.values())
+    resolver.resolve(
+        models.Project,
+        ((path,) for sensor, *_ in batch for path in get_project_paths(sensor)),
+    )
+
+    rows = [
+        [
+            sensor.reference,
+            owner.pk,
+            resolver.get(models.Type, sensor.type),
+            sensor.datastream,
+            sensor.contains_pi_data == 'Ja',
+            parse_date(sensor.active_until),
+            location_ewkt(location.get('location')),
+            location.get('location_description'),
+            sensor_fingerprint,
+        ]
+        for sensor, owner, location, sensor_fingerprint in batch
+    ]
+    upserted = {
+        (reference, owner_id): (pk, created)
+        for pk, reference, owner_id, created in upsert_devices(rows)
+    }
+
+    # the many to many relations of every device, from the last sensor of the
+    # device
+    regions, themes, goals_of_device, projects = {}, {}, {}, {}
+    for sensor, owner, location, _ in batch:
+        pk, _ = upserted[sensor.reference, owner.pk]
+        regions[pk] = {
+            resolver.get(models.Region, name) for name in get_regions(location)
+        }
+        themes[pk] = {resolver.get(models.Theme, name) for name in get_themes(sensor)}
+        goals_of_device[pk] = {
+            resolver.get(models.ObservationGoal, *goal_keys[goal])
+            for goal in get_observation_goals(sensor)
+        }
+        projects[pk] = {
+            resolver.get(models.Project, path) for path in get_project_paths(sensor)
+        }
+    # the relations match the fingerprints that were just stored, so these
+    # shouldn't be cleared (see the migration 0027_device_fingerprint_triggers)
+    with keep_fingerprints():
+        set_relations(models.Device.regions, regions)
+        set_relations(models.Device.themes, themes)
+        set_relations(models.Device.observation_goals, goals_of_device)
+        set_relations(models.Device.projects, projects)
+    return upserted
+
+
+def import_batch(
+    batch: List[Tuple[SensorData, models.Person, dict]],
+    resolver: LookupResolver,
+    action_logger,
+) -> Tuple[List[models.Device], int, int, int]:
+    """
+    Import the (validated) sensors with their owner and location, returns the
+    devices (one for every sensor) and the number of created, updated and
+    unchanged devices. The devices of which the last sensor has the stored
+    fingerprint aren't written at all.
+    """
+    if not batch:
+        return [], 0, 0, 0
+
+    fingerprints = [fingerprint(sensor, location) for sensor, _, location in batch]
+    keys = [(sensor.reference, owner.pk) for sensor, owner, _ in batch]
+    stored = get_fingerprints(set(keys))
+
+    # the last sensor of every device wins, as it would when importing the
+    # sensors one at a time
+    last = {
+        key: (*item, item_fingerprint)
+        for key, item, item_fingerprint in zip(keys, batch, fingerprints)
+    }
+    changed = [
+        item
+        for key, item in last.items()
+        if key not in stored or stored[key][1] != item[-1]
+    ]
+    ids = {key: (pk, False) for key, (pk, _) in stored.items()}
+    if changed:
+        ids.update(write_devices(changed, resolver))
+
+    # count every sensor as if they were imported one at a time: the first
+    # sensor of a new device creates it, any others update it, unless it has
+    # the same fingerprint as the device
+    devices = models.Device.objects.in_bulk([pk for pk, _ in ids.values()])
+    current = {key: item_fingerprint for key, (_, item_fingerprint) in stored.items()}
+    result, counter = [], Counter()
+    for key, item_fingerprint in zip(keys, fingerprints):
+        pk, created = ids[key]
+        device = devices[pk]
+        result.append(device)
+        if key not in current:
+            action = 'created' if created else 'updated'
+        elif current[key] == item_fingerprint:
+            action = 'unchanged'
+        else:
+            action = 'updated'
+        current[key] = item_fingerprint
+        counter.update([action])
+        if action != 'unchanged':
+            action_logger((device, action == 'created'))
+    return result, counter['created'], counter['updated'], counter['unchanged']
+
+
+def location_ewkt(point) -> Optional[str]:
+    if point is None:
+        return None
+    srid = point.srid or models.Device._meta.get_field('location').srid
+    return f'SRID={srid};{point.wkt}'
+
+
+def import_sensors(
+    sensors: List[SensorData],
+    owners: Dict[str, models.Person],
+    action_logger=lambda x: x,
+    resolver: Optional[LookupResolver] = None,
+    geocoder: Optional[Geocoder] = None,
+) -> Tuple[List[Exception], List[models.Device], int, int, int]:
+    """
+    Import the sensors, owners holds the (imported) owners by their lower cased
+    email address. Returns the errors of the sensors that couldn't be
+    imported, the imported devices and the number of created, updated and
+    unchanged devices, like importing the sensors one at a time with
+    import_sensor.
+
+    The sensors are imported settings.IMPORT_CHUNK_SIZE at a time, every chunk
+    in a transaction. A resolver can be passed to share the lookups between the
+    imports of a run, otherwise the lookup tables are read for this import.
+    Likewise a geocoder can be passed, e.g. to report its stats.
+    """
+    if resolver is None:
+        resolver = LookupResolver(action_logger)
+    if geocoder is None:
+        geocoder = Geocoder()
+    errors: List[Exception] = []
+    batch = []
+    for sensor_data in sensors:
+        try:
+            validate_sensor(sensor_data)
+            owner = owners[sensor_data.owner.email.lower()]
+            batch.append((sensor_data, owner, get_location(sensor_data, geocoder)))
+        except Exception as e:
+            errors.append(e)
+
+    # every chunk is imported in a transaction, so an aborted import leaves no
+    # device without its relations
+    devices, counts = [], [0, 0, 0]
+    for chunk in chunked(batch, settings.IMPORT_CHUNK_SIZE):
+        with resolver.atomic():
+            try:
+                with resolver.atomic():
+                    result = import_batch(chunk, resolver, action_logger)
+                results = [result]
+            except DatabaseError:
+                # one of the sensors can't be stored (e.g. a value that is too
+                # long), so import them one by one (each in a savepoint) to find
+                # out which
+                results = []
+                for item in chunk:
+                    try:
+                        with resolver.atomic():
+                            results.append(
+                                import_batch([item], resolver, action_logger)
+                            )
+                    except DatabaseError as e:
+                        errors.append(e)
+        for result in results:
+            devices += result[0]
+            counts = [count + n for count, n in zip(counts, result[1:])]
+
+    created, updated, unchanged = counts
+    return errors, devices, created, updated, unchanged
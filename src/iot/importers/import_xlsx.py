@@ -2,9 +2,11 @@ from collections import Counter
 from typing import Generator, List
 
 from django.conf import settings
+from django.db import transaction
 from openpyxl import Workbook
 from rest_framework.exceptions import ValidationError
 
+from iot import http_cache, models
 from iot.constants.sensor_fields import (
     BULK_PERSON_FIELDS,
     BULK_SENSOR_FIELDS,
@@ -19,19 +21,21 @@ from iot.dateclasses import (
     SensorData,
 )
 from iot.importers.import_person import import_person
-from iot.importers.import_sensor import import_sensor
+from iot.importers.import_sensors import import_sensors
 from iot.utils import Values
-from iot.validators import validate_person_data, validate_sensor
+from iot.validators import validate_person_data
 
 
-def import_xlsx(workbook, action_logger=lambda x: x):
+def import_xlsx(workbook, action_logger=lambda x: x, geocoder=None):
     """
     Load, parse and import person and sensor data from the given bulk or iprox
-    excel file.
+    excel file. The postcodes and house numbers are geocoded by the geocoder,
+    if given (see import_sensor.Geocoder).
 
     :param workbook: openpyxl workbook containing excel data to import.
 
-    :return: tuple containing lists of sensors : (errors, created, updated)
+    :return: tuple containing lists of sensors : (errors, sensors, created, updated,
+             unchanged)
     """
     # For bulk registration the contact details are in a separate sheet
     parser = parse_bulk_xlsx if "Uw gegevens" in workbook else parse_iprox_xlsx
@@ -44,7 +48,7 @@ def import_xlsx(workbook, action_logger=lambda x: x):
         if count > 1
     ]
     if errors:
-        return errors, 0, 0
+        return errors, [], 0, 0, 0
 
     for sensor in sensors:
         try:
@@ -55,25 +59,38 @@ def import_xlsx(workbook, action_logger=lambda x: x):
                 f" (rij {sensor.row_number}): {e}"
             ) from e
 
-    imported_owners = {
-        person_data.email.lower(): import_person(person_data, action_logger)
-        for person_data in [s.owner for s in sensors]
-    }
+    # every owner is imported once, with its last data (as that is what it
+    # would end up with when importing them all)
+    owners_by_email = {sensor.owner.email.lower(): sensor.owner for sensor in sensors}
+    with transaction.atomic():
+        imported_owners = {
+            email: import_person(person_data, action_logger)
+            for email, person_data in owners_by_email.items()
+        }
 
-    counter = Counter()
+    # the keys of the created and updated devices, to purge from the caches
+    device_keys = http_cache.DeviceKeys()
 
-    imported_sensors = []
-    for sensor_data in sensors:
-        try:
-            validate_sensor(sensor_data)
-            owner = imported_owners[sensor_data.owner.email.lower()]
-            sensor, created = import_sensor(sensor_data, owner, action_logger)
-            imported_sensors.append(sensor)
-            counter.update([created])
-        except Exception as e:
-            errors.append(e)
+    def log_action(result):
+        if isinstance(result[0], models.Device):
+            device_keys.add(result[0])
+        return action_logger(result)
+
+    import_errors, imported_sensors, created, updated, unchanged = import_sensors(
+        sensors, imported_owners, log_action, geocoder=geocoder
+    )
+    errors += import_errors
+
+    # the owners are updated as well, which shows in all of their devices
+    http_cache.purge(
+        [
+            http_cache.DEVICES,
+            *device_keys,
+            *(http_cache.owner_key(owner.pk) for owner in imported_owners.values()),
+        ]
+    )
 
-    return errors, imported_sensors, counter[True], counter[False]
+    return errors, imported_sensors, created, updated, unchanged
 
 
 def parse_bulk_xlsx(workbook: Workbook) -> Generator[SensorData, None, None]:
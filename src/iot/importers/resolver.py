@@ -0,0 +1,116 @@
+import contextlib
+from typing import Dict, Hashable, Iterable
+
+from django.db import transaction
+
+from iot import models
+
+# The fields identifying the lookups. The names are unique and case
+# insensitive (CITEXT), the observation goals and projects have no unique
+# constraint, so these are identified by all of their values.
+KEY_FIELDS = {
+    models.Type: ['name'],
+    models.Theme: ['name'],
+    models.Region: ['name'],
+    models.LegalGround: ['name'],
+    models.ObservationGoal: [
+        'observation_goal',
+        'privacy_declaration',
+        'legal_ground_id',
+    ],
+    models.Project: ['path'],
+}
+
+
+def to_key(model, values: Iterable) -> Hashable:
+    """
+    The key of a lookup in the resolver from the values of its KEY_FIELDS.
+    """
+    values = tuple(
+        # array fields are read as lists, which aren't hashable
+        tuple(value) if isinstance(value, (list, tuple)) else value
+        for value in values
+    )
+    if KEY_FIELDS[model] == ['name']:
+        return values[0].lower()
+    return values
+
+
+class LookupResolver:
+    """
+    Resolves the lookups of the sensors to their ids during an import run. Every
+    lookup table is read once, the first time it is needed, and the missing
+    lookups are created by one bulk statement per table, so the number of
+    queries doesn't depend on the number of sensors.
+
+    The names are matched case insensitively, like the CITEXT columns, e.g.
+
+        resolver.resolve(models.Theme, ['Mobiliteit: auto'])
+        resolver.get(models.Theme, 'mobiliteit: AUTO')
+    """
+
+    def __init__(self, action_logger=lambda x: x):
+        self.action_logger = action_logger
+        self.ids: Dict[type, Dict[Hashable, int]] = {}
+
+    def get_ids(self, model) -> Dict[Hashable, int]:
+        if model not in self.ids:
+            fields = KEY_FIELDS[model]
+            self.ids[model] = {
+                to_key(model, values): pk
+                # the oldest of any duplicates, like get_or_create would find
+                for pk, *values in model.objects.order_by('-pk').values_list(
+                    'pk', *fields
+                )
+            }
+        return self.ids[model]
+
+    def get(self, model, *values) -> int:
+        """
+        The id of a resolved lookup, by the values of its KEY_FIELDS.
+        """
+        return self.get_ids(model)[to_key(model, values)]
+
+    def resolve(self, model, keys: Iterable) -> None:
+        """
+        Create the lookups that don't exist yet, the keys are names or tuples
+        of the values of the KEY_FIELDS.
+        """
+        ids = self.get_ids(model)
+        fields = KEY_FIELDS[model]
+        missing: Dict[Hashable, tuple] = {}
+        for key in keys:
+            values = (key,) if isinstance(key, str) else tuple(key)
+            missing.setdefault(to_key(model, values), values)
+        for key in ids.keys() & missing.keys():
+            del missing[key]
+        if not missing:
+            return
+
+        instances = [model(**dict(zip(fields, values))) for values in missing.values()]
+        if fields == ['name']:
+            # the names may have been created by a concurrent import since the
+            # table was read
+            model.objects.bulk_create(instances, ignore_conflicts=True)
+            names = [values[0] for values in missing.values()]
+            instances = list(model.objects.filter(name__in=names))
+        else:
+            instances = model.objects.bulk_create(instances)
+        for instance in instances:
+            key = to_key(model, [getattr(instance, field) for field in fields])
+            ids[key] = instance.pk
+            self.action_logger((instance, True))
+
+    @contextlib.contextmanager
+    def atomic(self):
+        """
+        A transaction.atomic block, which forgets the lookups that were created
+        in it when it is rolled back.
+        """
+        ids = {model: dict(ids) for model, ids in self.ids.items()}
+        try:
+            with transaction.atomic():
+                yield
+        except Exception:
+            self.ids = ids
+            raise
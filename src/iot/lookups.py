@@ -0,0 +1,67 @@
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from iot import device_documents
+from iot.models import LegalGround, Person, Region, Theme, Type
+
+CACHE_KEY = 'iot-lookups-{version}'
+
+
+def count_devices(relation: str) -> Count:
+    """
+    Count the public devices (i.e. those with a location) via the relation.
+    """
+    return Count(
+        relation, filter=Q(**{f'{relation}__location__isnull': False}), distinct=True
+    )
+
+
+def build_lookups() -> dict:
+    """
+    The lookup lists the frontend builds its filters from, with the number of
+    (public) devices for every value.
+    """
+    fields = ['id', 'name', 'is_other', 'device_count']
+    return {
+        'types': list(
+            Type.objects.annotate(device_count=count_devices('device'))
+            .order_by('name')
+            .values(*fields)
+        ),
+        'themes': list(
+            Theme.objects.annotate(device_count=count_devices('device'))
+            .order_by('name')
+            .values(*fields)
+        ),
+        'regions': list(
+            Region.objects.annotate(device_count=count_devices('device'))
+            .order_by('name')
+            .values(*fields)
+        ),
+        'legal_grounds': list(
+            LegalGround.objects.annotate(
+                device_count=count_devices('observationgoal__device')
+            )
+            .order_by('name')
+            .values('id', 'name', 'device_count')
+        ),
+        'organisations': [
+            {'name': organisation['organisation'], 'device_count': organisation['n']}
+            for organisation in Person.objects.exclude(organisation__isnull=True)
+            .exclude(organisation='')
+            .values('organisation')
+            .annotate(n=count_devices('device'))
+            .order_by('organisation')
+        ],
+    }
+
+
+def get_lookups() -> dict:
+    """
+    The lookups of the current registry version, these are only built once per
+    version and cached after that. The version also changes when only a lookup
+    changes, e.g. a theme that no device uses is renamed.
+    """
+    version = device_documents.get_registry_version()
+    lookups = cache.get_or_set(CACHE_KEY.format(version=version), build_lookups, None)
+    return {'version': version, **lookups}
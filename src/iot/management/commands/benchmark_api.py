@@ -0,0 +1,90 @@
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+import requests
+from django.core.management.base import BaseCommand
+
+
+def percentile(durations, p: int) -> float:
+    """
+    The duration below which p percent of the (sorted) durations fall.
+    """
+    index = min(len(durations) - 1, round(p / 100 * (len(durations) - 1)))
+    return durations[index]
+
+
+def run_benchmark(url: str, num_requests: int, concurrency: int) -> Dict:
+    """
+    Send num_requests GET requests to the url, concurrency at a time, returns
+    the number of requests per second, the latency percentiles (in ms) and the
+    number of failed requests.
+    """
+    local = threading.local()
+
+    def get():
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        start = time.perf_counter()
+        try:
+            # the whole body is read, like a client would
+            ok = local.session.get(url, timeout=60).ok
+        except requests.RequestException:
+            ok = False
+        return time.perf_counter() - start, ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda _: get(), range(num_requests)))
+    elapsed = time.perf_counter() - start
+
+    durations = sorted(duration * 1000 for duration, _ in results)
+    return {
+        'url': url,
+        'requests': num_requests,
+        'failed': sum(1 for _, ok in results if not ok),
+        'rps': num_requests / elapsed,
+        'mean': statistics.mean(durations),
+        'p50': percentile(durations, 50),
+        'p95': percentile(durations, 95),
+        'p99': percentile(durations, 99),
+    }
+
+
+class Command(BaseCommand):
+    """
+    Compare the throughput and latency of deployments of the api under
+    concurrent load, e.g. the wsgi (uwsgi) and the asgi (uvicorn) deployment:
+
+        python manage.py benchmark_api \\
+            http://wsgi:8000/iothings/devices/ http://asgi:8000/iothings/devices/
+    """
+
+    help = 'Load test urls: python manage.py benchmark_api <url> [<url> ...]'
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='+', help='the urls to load test')
+        parser.add_argument(
+            '--requests', type=int, default=1000, help='the number of requests per url'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=50,
+            help='the number of concurrent requests',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{'url':<60} {'req/s':>8} {'mean':>8} {'p50':>8} {'p95':>8} "
+            f"{'p99':>8} {'failed':>7}"
+        )
+        for url in options['urls']:
+            result = run_benchmark(url, options['requests'], options['concurrency'])
+            self.stdout.write(
+                f"{result['url']:<60} {result['rps']:>8.1f} {result['mean']:>8.1f} "
+                f"{result['p50']:>8.1f} {result['p95']:>8.1f} {result['p99']:>8.1f} "
+                f"{result['failed']:>7}"
+            )
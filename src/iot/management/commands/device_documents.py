@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from iot import device_documents
+from iot.db import statement_timeout
+
+
+class Command(BaseCommand):
+    """
+    The json documents of the devices are maintained by database triggers, this
+    command can be used to check that they are still consistent with the live
+    data, or to rebuild them from scratch.
+    """
+
+    help = 'Rebuild (default) or verify (--verify) the stored device documents'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='only compare the stored documents with the live data',
+        )
+
+    def handle(self, *args, **options):
+        with statement_timeout(settings.IMPORT_STATEMENT_TIMEOUT):
+            self.run(**options)
+
+    def run(self, **options):
+        if options['verify']:
+            device_ids = device_documents.verify()
+            if device_ids:
+                ids = ', '.join(map(str, device_ids))
+                raise CommandError(
+                    f'{len(device_ids)} device documents out of sync: {ids}'
+                )
+            self.stdout.write(self.style.SUCCESS('device documents are in sync'))
+        else:
+            count = device_documents.rebuild()
+            self.stdout.write(self.style.SUCCESS(f'rebuilt {count} device documents'))
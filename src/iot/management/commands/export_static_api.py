@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from iot import exports
+from iot.db import statement_timeout
+
+
+class Command(BaseCommand):
+    """
+    Write the public registry as static files, so the public read path can be
+    served without hitting django or the database. The directory is swapped
+    atomically, see exports.export_static_api.
+    """
+
+    help = 'Export the devices as static json files: python manage.py export_static_api <dir>'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', type=str, help='the directory to export to')
+
+    def handle(self, *args, **options):
+        try:
+            with statement_timeout(settings.IMPORT_STATEMENT_TIMEOUT):
+                manifest = exports.export_static_api(options['directory'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"exported {len(manifest['files'])} files of version "
+                f"{manifest['version']} to {options['directory']}"
+            )
+        )
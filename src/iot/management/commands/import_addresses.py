@@ -0,0 +1,34 @@
+import csv
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from iot.db import statement_timeout
+from iot.importers.import_addresses import load_addresses
+
+
+class Command(BaseCommand):
+    """
+    Loads the addresses of a BAG extract (a csv file), which are used to
+    geocode the postcodes and house numbers of the sensors before asking the
+    atlas search api, e.g.
+
+        python manage.py import_addresses bag_adressen.csv --delimiter ';'
+    """
+
+    help = 'Loads the addresses of a BAG extract, to geocode the sensors with'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', type=str, help='the csv file of the extract')
+        parser.add_argument(
+            '--delimiter', type=str, default=',', help='the delimiter of the csv file'
+        )
+
+    def handle(self, *args, **options):
+        with open(options['path'], newline='', encoding='utf-8-sig') as file:
+            rows = csv.DictReader(file, delimiter=options['delimiter'])
+            # loading a whole extract takes (much) longer than a request
+            with statement_timeout(settings.IMPORT_STATEMENT_TIMEOUT):
+                count = load_addresses(rows)
+
+        self.stdout.write(self.style.SUCCESS(f'{count} addresses loaded'))
@@ -1,7 +1,10 @@
-import requests
+from django.conf import settings
+from django.core.management import call_command
 from django.core.management.base import BaseCommand
 
+from iot.db import statement_timeout
 from iot.importers import import_apis
+from iot.importers.resolver import LookupResolver
 
 
 class Command(BaseCommand):
@@ -28,14 +31,20 @@ class Command(BaseCommand):
         parser.add_argument(
             'api_name', nargs='*', type=str, help='provide the api_name'
         )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='import the apis, even when they did not change since their last import',
+        )
 
     def handle(self, *args, **options) -> str:
         """
         takes a list of the name(s) of the api as a param, calls the url that belongs to it in the
-        API_MAPPER. when the data is fetched from the api, it will convert it to a dict
-        and pass it to the convert_api_data together with the api_name.
+        API_MAPPER (all at once, see fetch_apis). when the data is fetched from the api, it will
+        convert it to a dict and pass it to the convert_api_data together with the api_name.
         A tuple will be returned that will contain the results. The results will be a list dict
-        for each api's result of inserts, updates and errors.
+        for each api's result of inserts, updates, unchanged and errors. The apis that didn't change since
+        their last import are skipped, unless --force is given.
         """
         # if the list api_names is an empty list, copy the list of all the api_names (keys)
         # from the API_MAPPER dict so the api_names will contain a list of all the api_name
@@ -46,22 +55,50 @@ class Command(BaseCommand):
         if not api_names:
             api_names = import_apis.API_MAPPER.keys()
 
-        for api in api_names:
-            api_url = import_apis.API_MAPPER[
-                api
-            ]  # get the url that belongs to the api.
+        # every url is fetched once, and only returns data when it changed since
+        # the last import, see fetch_apis
+        states = import_apis.get_upstream_states(api_names)
+        api_data = import_apis.fetch_apis(api_names, states, force=options['force'])
+        imported = False
+        failed = set()
+
+        # the lookups (types, themes etc.) are read once for all the apis
+        resolver = LookupResolver()
+
+        try:
+            # imports may take (much) longer than the requests of the api
+            with statement_timeout(settings.IMPORT_STATEMENT_TIMEOUT):
+                for api in api_names:
+                    if api_data[api] is None:
+                        self.stdout.write(self.style.SUCCESS(f'{api}: unchanged'))
+                        continue
+                    imported = True
+                    result = import_apis.convert_api_data(
+                        api_name=api, api_data=api_data[api], resolver=resolver
+                    )
+                    # convert the out to a str with inserts, updates, unchanged and errors
+                    output = (
+                        f'{api}: inserts {result[1]}, updates {result[2]}, '
+                        f'unchanged {result[3]}, errors {len(result[0])}'
+                    )
 
-            response = requests.get(url=api_url)
-            # check if response is 200 and content type is json, if not, return
-            if (
-                response.status_code != 200
-                or 'application/json' not in response.headers["Content-Type"]
-            ):
-                raise RuntimeError(f"{response.status_code} - {response.content}")
+                    self.stdout.write(self.style.SUCCESS(f'{output}'))
+                    if result[0]:
+                        failed.add(api)
+        finally:
+            for data in api_data.values():
+                if data is not None:
+                    data.close()
 
-            data = response.json()  # get the content of the response as dict
-            result = import_apis.convert_api_data(api_name=api, api_data=data)
-            # convert the out to a str with inserts, updates and errors
-            output = f'{api}: inserts {result[1]}, updates {result[2]}, errors {len(result[0])}'
+        # only once all the apis are imported, so a failed import is retried,
+        # as are the apis with sensors that failed to import
+        for api, state in states.items():
+            if api not in failed:
+                state.save()
 
-            self.stdout.write(self.style.SUCCESS(f'{output}'))
+        # refresh the static copy of the public api (when configured), as the
+        # registry only changes after imports
+        if imported and settings.STATIC_API_ROOT:
+            call_command(
+                'export_static_api', settings.STATIC_API_ROOT, stdout=self.stdout
+            )
@@ -1,9 +1,11 @@
 import requests
+from django.conf import settings
 from django.contrib.gis.geos import Polygon
 from django.core.management import BaseCommand
 from rest_framework_gis.fields import GeometryField
 
 from iot.dateclasses import LatLong, Location, ObservationGoal, PersonData, SensorData
+from iot.db import statement_timeout
 from iot.importers.import_person import import_person
 from iot.importers.import_sensor import import_sensor
 
@@ -92,5 +94,6 @@ class Command(BaseCommand):
             projects=["Gemeente Amsterdam"],
         )
 
-        owner = import_person(sensor.owner)
-        import_sensor(sensor, owner)
+        with statement_timeout(settings.IMPORT_STATEMENT_TIMEOUT):
+            owner = import_person(sensor.owner)
+            import_sensor(sensor, owner)
@@ -0,0 +1,15 @@
+from django.core.management.commands import migrate
+
+from iot.db import statement_timeout
+
+
+class Command(migrate.Command):
+    """
+    The migrate command without the (short) default statement timeout of the
+    connection (see DATABASE_STATEMENT_TIMEOUT), as migrations that add columns
+    or triggers to a large table, or rewrite its rows, can take a lot longer.
+    """
+
+    def handle(self, *args, **options):
+        with statement_timeout(0):
+            return super().handle(*args, **options)
@@ -0,0 +1,94 @@
+import asyncio
+
+from asgiref.sync import markcoroutinefunction
+from django.conf import settings
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.messages.middleware import MessageMiddleware
+from django.contrib.sessions.middleware import SessionMiddleware
+from mozilla_django_oidc.middleware import SessionRefresh
+
+from iot.db import statement_timeout
+
+
+def is_public_read(request) -> bool:
+    """
+    Whether the request only reads from the public api, which doesn't need a
+    session or user, see settings.PUBLIC_PATH_PREFIXES.
+    """
+    return request.method in ('GET', 'HEAD', 'OPTIONS') and request.path.startswith(
+        tuple(settings.PUBLIC_PATH_PREFIXES)
+    )
+
+
+class StatementTimeoutMiddleware:
+    """
+    Use the statement timeout of the longest matching path prefix in
+    settings.STATEMENT_TIMEOUTS, e.g. a longer timeout for the admin. All the
+    other requests use the default timeout of the connection.
+
+    Under asgi (see main.asgi) only the public api is served, which runs its
+    queries in threads of their own, so the requests are passed on as they are.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # mark the middleware as async, as django's MiddlewareMixin does
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.get_response(request)
+        for prefix, timeout in sorted(
+            settings.STATEMENT_TIMEOUTS.items(), key=lambda item: -len(item[0])
+        ):
+            if request.path.startswith(prefix):
+                with statement_timeout(timeout):
+                    return self.get_response(request)
+        return self.get_response(request)
+
+
+# The middlewares below skip the public reads, so these don't load a session or
+# user from the database (e.g. when the browser of an admin user sends its
+# session cookie along) and never set any cookies. The admin and the
+# authentication views use the full stack.
+
+
+class PublicSessionMiddleware(SessionMiddleware):
+    def process_request(self, request):
+        if not is_public_read(request):
+            super().process_request(request)
+
+    def process_response(self, request, response):
+        if is_public_read(request):
+            return response
+        return super().process_response(request, response)
+
+
+class PublicAuthenticationMiddleware(AuthenticationMiddleware):
+    def process_request(self, request):
+        if is_public_read(request):
+            request.user = AnonymousUser()
+        else:
+            super().process_request(request)
+
+
+class PublicMessageMiddleware(MessageMiddleware):
+    def process_request(self, request):
+        if not is_public_read(request):
+            super().process_request(request)
+
+    def process_response(self, request, response):
+        if is_public_read(request):
+            return response
+        return super().process_response(request, response)
+
+
+class PublicSessionRefresh(SessionRefresh):
+    def process_request(self, request):
+        if not is_public_read(request):
+            return super().process_request(request)
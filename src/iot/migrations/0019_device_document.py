@@ -0,0 +1,251 @@
+from django.db import migrations, models
+
+# The finished json document of every device (as returned by the devices
+# endpoint) is stored in iot_device_document. The documents are kept up to date
+# by the triggers below, which refresh the documents of the affected devices
+# whenever a device, one of its related objects or one of the m2m through
+# tables changes. The iot_device_document_live view contains the aggregate the
+# documents are built from, so it can also be used to rebuild or verify them.
+CREATE_DEVICE_DOCUMENT = """
+CREATE TABLE "iot_device_document" (
+    "device_id" integer NOT NULL PRIMARY KEY,
+    "document" jsonb NOT NULL
+);
+
+CREATE VIEW "iot_device_document_live" AS
+SELECT "iot_device"."id" AS "device_id",
+       JSONB_BUILD_OBJECT(
+           'id', "iot_device"."id",
+           'themes', JSONB_AGG(DISTINCT "iot_theme"."name"),
+           'observation_goals', JSONB_AGG(DISTINCT JSONB_BUILD_OBJECT(
+               'id', "iot_observationgoal"."id",
+               'observation_goal', "iot_observationgoal"."observation_goal",
+               'legal_ground', "iot_legalground"."name",
+               'privacy_declaration', "iot_observationgoal"."privacy_declaration"
+           )),
+           'project_paths', JSONB_AGG(DISTINCT "iot_project"."path") FILTER (WHERE "iot_project"."path" is not null),
+           'regions', JSONB_AGG(DISTINCT "iot_region"."name") FILTER (WHERE "iot_region"."name" is not null),
+           'owner', JSONB_BUILD_OBJECT(
+               'name', "iot_person"."name",
+               'email', "iot_person"."email",
+               'organisation', "iot_person"."organisation"
+           ),
+           'location', JSONB_BUILD_OBJECT(
+               'latitude', ST_Y("iot_device"."location"),
+               'longitude', ST_X("iot_device"."location")
+           ),
+           'active_until', "iot_device"."active_until",
+           'contains_pi_data', "iot_device"."contains_pi_data",
+           'datastream', "iot_device"."datastream",
+           'location_description', "iot_device"."location_description",
+           'reference', "iot_device"."reference",
+           'type', "iot_type"."name"
+       ) AS "document"
+FROM "iot_device"
+     LEFT OUTER JOIN "iot_device_themes"
+                     ON ("iot_device"."id" = "iot_device_themes"."device_id")
+     LEFT OUTER JOIN "iot_theme"
+                     ON ("iot_device_themes"."theme_id" = "iot_theme"."id")
+     LEFT OUTER JOIN "iot_device_observation_goals"
+                     ON ("iot_device"."id" = "iot_device_observation_goals"."device_id")
+     LEFT OUTER JOIN "iot_observationgoal"
+                     ON ("iot_device_observation_goals"."observationgoal_id" = "iot_observationgoal"."id")
+     LEFT OUTER JOIN "iot_legalground"
+                     ON ("iot_observationgoal"."legal_ground_id" = "iot_legalground"."id")
+     LEFT OUTER JOIN "iot_device_projects"
+                     ON ("iot_device"."id" = "iot_device_projects"."device_id")
+     LEFT OUTER JOIN "iot_project"
+                     ON ("iot_device_projects"."project_id" = "iot_project"."id")
+     LEFT OUTER JOIN "iot_device_regions"
+                     ON ("iot_device"."id" = "iot_device_regions"."device_id")
+     LEFT OUTER JOIN "iot_region"
+                     ON ("iot_device_regions"."region_id" = "iot_region"."id")
+     INNER JOIN     "iot_person"
+                     ON ("iot_device"."owner_id" = "iot_person"."id")
+     INNER JOIN     "iot_type"
+                     ON ("iot_device"."type_id" = "iot_type"."id")
+WHERE "iot_device"."location" IS NOT NULL
+GROUP BY "iot_device"."id", "iot_person"."id", "iot_type"."name";
+
+CREATE FUNCTION "iot_device_document_refresh"(device_ids integer[]) RETURNS void AS $$
+    DELETE FROM "iot_device_document" WHERE "device_id" = ANY(device_ids);
+    INSERT INTO "iot_device_document" ("device_id", "document")
+    SELECT "device_id", "document"
+    FROM "iot_device_document_live"
+    WHERE "device_id" = ANY(device_ids);
+$$ LANGUAGE sql;
+
+-- iot_device
+CREATE FUNCTION "iot_device_document_device_trigger"() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM "iot_device_document_refresh"(ARRAY[OLD."id"]);
+    ELSE
+        PERFORM "iot_device_document_refresh"(ARRAY[NEW."id"]);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER "iot_device_document_sync"
+    AFTER INSERT OR DELETE ON "iot_device"
+    FOR EACH ROW EXECUTE PROCEDURE "iot_device_document_device_trigger"();
+CREATE TRIGGER "iot_device_document_sync_update"
+    AFTER UPDATE ON "iot_device"
+    FOR EACH ROW WHEN (OLD.* IS DISTINCT FROM NEW.*)
+    EXECUTE PROCEDURE "iot_device_document_device_trigger"();
+
+-- m2m through tables, all of them have a device_id column
+CREATE FUNCTION "iot_device_document_through_trigger"() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM "iot_device_document_refresh"(ARRAY[OLD."device_id"]);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM "iot_device_document_refresh"(ARRAY[NEW."device_id"]);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER "iot_device_document_sync"
+    AFTER INSERT OR UPDATE OR DELETE ON "iot_device_themes"
+    FOR EACH ROW EXECUTE PROCEDURE "iot_device_document_through_trigger"();
+CREATE TRIGGER "iot_device_document_sync"
+    AFTER INSERT OR UPDATE OR DELETE ON "iot_device_regions"
+    FOR EACH ROW EXECUTE PROCEDURE "iot_device_document_through_trigger"();
+CREATE TRIGGER "iot_device_document_sync"
+    AFTER INSERT OR UPDATE OR DELETE ON "iot_device_observation_goals"
+    FOR EACH ROW EXECUTE PROCEDURE "iot_device_document_through_trigger"();
+CREATE TRIGGER "iot_device_document_sync"
+    AFTER INSERT OR UPDATE OR DELETE ON "iot_device_projects"
+    FOR EACH ROW EXECUTE PROCEDURE "iot_device_document_through_trigger"();
+
+-- iot_person and iot_type, referenced by a foreign key on the device
+CREATE FUNCTION "iot_device_document_foreign_key_trigger"() RETURNS trigger AS $$
+BEGIN
+    -- TG_ARGV[0] is the name of the foreign key column on iot_device
+    EXECUTE format(
+        'SELECT "iot_device_document_refresh"(ARRAY(SELECT "id" FROM "iot_device" WHERE %I = $1))',
+        TG_ARGV[0]
+    ) USING NEW."id";
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER "iot_device_document_sync"
+    AFTER UPDATE ON "iot_person"
+    FOR EACH ROW
+    WHEN ((OLD."name", OLD."email", OLD."organisation")
+          IS DISTINCT FROM (NEW."name", NEW."email", NEW."organisation"))
+    EXECUTE PROCEDURE "iot_device_document_foreign_key_trigger"('owner_id');
+CREATE TRIGGER "iot_device_document_sync"
+    AFTER UPDATE ON "iot_type"
+    FOR EACH ROW WHEN (OLD."name" IS DISTINCT FROM NEW."name")
+    EXECUTE PROCEDURE "iot_device_document_foreign_key_trigger"('type_id');
+
+-- lookup tables, related to the device through an m2m through table
+CREATE FUNCTION "iot_device_document_lookup_trigger"() RETURNS trigger AS $$
+BEGIN
+    -- TG_ARGV[0] is the through table, TG_ARGV[1] the column referencing the lookup
+    EXECUTE format(
+        'SELECT "iot_device_document_refresh"(ARRAY(SELECT "device_id" FROM %I WHERE %I = $1))',
+        TG_ARGV[0],
+        TG_ARGV[1]
+    ) USING NEW."id";
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER "iot_device_document_sync"
+    AFTER UPDATE ON "iot_theme"
+    FOR EACH ROW WHEN (OLD."name" IS DISTINCT FROM NEW."name")
+    EXECUTE PROCEDURE "iot_device_document_lookup_trigger"('iot_device_themes', 'theme_id');
+CREATE TRIGGER "iot_device_document_sync"
+    AFTER UPDATE ON "iot_region"
+    FOR EACH ROW WHEN (OLD."name" IS DISTINCT FROM NEW."name")
+    EXECUTE PROCEDURE "iot_device_document_lookup_trigger"('iot_device_regions', 'region_id');
+CREATE TRIGGER "iot_device_document_sync"
+    AFTER UPDATE ON "iot_project"
+    FOR EACH ROW WHEN (OLD."path" IS DISTINCT FROM NEW."path")
+    EXECUTE PROCEDURE "iot_device_document_lookup_trigger"('iot_device_projects', 'project_id');
+CREATE TRIGGER "iot_device_document_sync"
+    AFTER UPDATE ON "iot_observationgoal"
+    FOR EACH ROW
+    WHEN ((OLD."observation_goal", OLD."privacy_declaration", OLD."legal_ground_id")
+          IS DISTINCT FROM (NEW."observation_goal", NEW."privacy_declaration", NEW."legal_ground_id"))
+    EXECUTE PROCEDURE "iot_device_document_lookup_trigger"('iot_device_observation_goals', 'observationgoal_id');
+
+-- iot_legalground, related to the device through the observation goals
+CREATE FUNCTION "iot_device_document_legalground_trigger"() RETURNS trigger AS $$
+BEGIN
+    PERFORM "iot_device_document_refresh"(ARRAY(
+        SELECT "iot_device_observation_goals"."device_id"
+        FROM "iot_device_observation_goals"
+             INNER JOIN "iot_observationgoal"
+                        ON ("iot_device_observation_goals"."observationgoal_id" = "iot_observationgoal"."id")
+        WHERE "iot_observationgoal"."legal_ground_id" = NEW."id"
+    ));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER "iot_device_document_sync"
+    AFTER UPDATE ON "iot_legalground"
+    FOR EACH ROW WHEN (OLD."name" IS DISTINCT FROM NEW."name")
+    EXECUTE PROCEDURE "iot_device_document_legalground_trigger"();
+
+-- the backfill builds the document of every device, which can take longer than
+-- the (short) default statement timeout of the connection, see
+-- DATABASE_STATEMENT_TIMEOUT. The migration runs in a transaction, so this only
+-- applies to the migration.
+SET LOCAL statement_timeout = 0;
+INSERT INTO "iot_device_document" ("device_id", "document")
+SELECT "device_id", "document" FROM "iot_device_document_live";
+"""
+
+DROP_DEVICE_DOCUMENT = """
+DROP TRIGGER "iot_device_document_sync" ON "iot_legalground";
+DROP TRIGGER "iot_device_document_sync" ON "iot_observationgoal";
+DROP TRIGGER "iot_device_document_sync" ON "iot_project";
+DROP TRIGGER "iot_device_document_sync" ON "iot_region";
+DROP TRIGGER "iot_device_document_sync" ON "iot_theme";
+DROP TRIGGER "iot_device_document_sync" ON "iot_type";
+DROP TRIGGER "iot_device_document_sync" ON "iot_person";
+DROP TRIGGER "iot_device_document_sync" ON "iot_device_projects";
+DROP TRIGGER "iot_device_document_sync" ON "iot_device_observation_goals";
+DROP TRIGGER "iot_device_document_sync" ON "iot_device_regions";
+DROP TRIGGER "iot_device_document_sync" ON "iot_device_themes";
+DROP TRIGGER "iot_device_document_sync_update" ON "iot_device";
+DROP TRIGGER "iot_device_document_sync" ON "iot_device";
+DROP FUNCTION "iot_device_document_legalground_trigger"();
+DROP FUNCTION "iot_device_document_lookup_trigger"();
+DROP FUNCTION "iot_device_document_foreign_key_trigger"();
+DROP FUNCTION "iot_device_document_through_trigger"();
+DROP FUNCTION "iot_device_document_device_trigger"();
+DROP FUNCTION "iot_device_document_refresh"(integer[]);
+DROP VIEW "iot_device_document_live";
+DROP TABLE "iot_device_document";
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('iot', '0018_auto_20221129_1040'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeviceDocument',
+            fields=[
+                ('device_id', models.IntegerField(primary_key=True, serialize=False)),
+                ('document', models.JSONField()),
+            ],
+            options={
+                'db_table': 'iot_device_document',
+                'managed': False,
+            },
+        ),
+        migrations.RunSQL(CREATE_DEVICE_DOCUMENT, DROP_DEVICE_DOCUMENT),
+    ]
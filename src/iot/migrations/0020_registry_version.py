@@ -0,0 +1,60 @@
+from django.db import migrations
+
+# The registry version is incremented whenever a device document actually
+# changes, so it can be used to tell whether anything that was derived from the
+# documents (e.g. exports) is still up to date. It is stored in a (single row)
+# table rather than a sequence, so a new version only becomes visible together
+# with the documents that changed. Refreshing a document now also only writes
+# it when it changed.
+CREATE_REGISTRY_VERSION = """
+CREATE TABLE "iot_registry_version" (
+    "version" bigint NOT NULL
+);
+INSERT INTO "iot_registry_version" ("version") VALUES (1);
+
+CREATE OR REPLACE FUNCTION "iot_device_document_refresh"(device_ids integer[]) RETURNS void AS $$
+    WITH "live" AS (
+        SELECT "device_id", "document"
+        FROM "iot_device_document_live"
+        WHERE "device_id" = ANY(device_ids)
+    ), "deleted" AS (
+        DELETE FROM "iot_device_document"
+        WHERE "device_id" = ANY(device_ids)
+              AND "device_id" NOT IN (SELECT "device_id" FROM "live")
+        RETURNING "device_id"
+    ), "upserted" AS (
+        INSERT INTO "iot_device_document" ("device_id", "document")
+        SELECT "device_id", "document" FROM "live"
+        ON CONFLICT ("device_id") DO UPDATE
+        SET "document" = EXCLUDED."document"
+        WHERE "iot_device_document"."document" IS DISTINCT FROM EXCLUDED."document"
+        RETURNING "device_id"
+    )
+    UPDATE "iot_registry_version"
+    SET "version" = "version" + 1
+    WHERE EXISTS (SELECT FROM "deleted") OR EXISTS (SELECT FROM "upserted");
+$$ LANGUAGE sql;
+"""
+
+DROP_REGISTRY_VERSION = """
+CREATE OR REPLACE FUNCTION "iot_device_document_refresh"(device_ids integer[]) RETURNS void AS $$
+    DELETE FROM "iot_device_document" WHERE "device_id" = ANY(device_ids);
+    INSERT INTO "iot_device_document" ("device_id", "document")
+    SELECT "device_id", "document"
+    FROM "iot_device_document_live"
+    WHERE "device_id" = ANY(device_ids);
+$$ LANGUAGE sql;
+
+DROP TABLE "iot_registry_version";
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('iot', '0019_device_document'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_REGISTRY_VERSION, DROP_REGISTRY_VERSION),
+    ]
@@ -0,0 +1,26 @@
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('iot', '0022_device_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeocodeResult',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('postcode', models.CharField(max_length=16)),
+                ('house_number', models.CharField(max_length=32)),
+                ('suffix', models.CharField(blank=True, default='', max_length=32)),
+                ('point', django.contrib.gis.db.models.fields.PointField(null=True, srid=4326)),
+                ('expires_at', models.DateTimeField()),
+            ],
+            options={
+                'unique_together': {('postcode', 'house_number', 'suffix')},
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('iot', '0023_geocoderesult'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Address',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('postcode', models.CharField(max_length=16)),
+                ('house_number', models.CharField(max_length=32)),
+                ('suffix', models.CharField(blank=True, default='', max_length=32)),
+                ('point', django.contrib.gis.db.models.fields.PointField(srid=4326)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='address',
+            index=models.Index(fields=['postcode', 'house_number'], name='iot_address_postcod_0766b2_idx'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+from django.db import migrations
+
+# The bootstrap lookups (see iot.lookups) are cached per registry version, but
+# they also list the types, themes, regions, legal grounds and organisations
+# that no (public) device uses, with their names and is_other. The registry
+# version is therefore also incremented whenever one of these lookup tables
+# changes, not only when a device document changes.
+LOOKUP_TABLES = [
+    'iot_type',
+    'iot_theme',
+    'iot_region',
+    'iot_legalground',
+    'iot_person',
+]
+
+CREATE_LOOKUP_TRIGGERS = """
+CREATE FUNCTION "iot_registry_version_lookup_trigger"() RETURNS trigger AS $$
+BEGIN
+    UPDATE "iot_registry_version" SET "version" = "version" + 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+""" + ''.join(
+    f"""
+CREATE TRIGGER "iot_registry_version_sync"
+    AFTER INSERT OR DELETE ON "{table}"
+    FOR EACH ROW EXECUTE PROCEDURE "iot_registry_version_lookup_trigger"();
+CREATE TRIGGER "iot_registry_version_sync_update"
+    AFTER UPDATE ON "{table}"
+    FOR EACH ROW WHEN (OLD.* IS DISTINCT FROM NEW.*)
+    EXECUTE PROCEDURE "iot_registry_version_lookup_trigger"();
+"""
+    for table in LOOKUP_TABLES
+)
+
+DROP_LOOKUP_TRIGGERS = ''.join(
+    f"""
+DROP TRIGGER "iot_registry_version_sync_update" ON "{table}";
+DROP TRIGGER "iot_registry_version_sync" ON "{table}";
+"""
+    for table in LOOKUP_TABLES
+) + """
+DROP FUNCTION "iot_registry_version_lookup_trigger"();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('iot', '0024_address'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_LOOKUP_TRIGGERS, DROP_LOOKUP_TRIGGERS),
+    ]
@@ -0,0 +1,101 @@
+from django.db import migrations
+
+# The registry version was incremented for every refreshed device document (and
+# every changed lookup), so an import wrote the single row of
+# iot_registry_version for every device it changed. It is now incremented at
+# most once per statement, the time the statement started is kept in a
+# transaction local setting to tell whether it was already incremented.
+CREATE_VERSION_BUMP = """
+CREATE FUNCTION "iot_registry_version_bump"() RETURNS void AS $$
+BEGIN
+    IF current_setting('iot.registry_version_bumped', true)
+       IS DISTINCT FROM statement_timestamp()::text THEN
+        PERFORM set_config(
+            'iot.registry_version_bumped', statement_timestamp()::text, true
+        );
+        UPDATE "iot_registry_version" SET "version" = "version" + 1;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION "iot_device_document_refresh"(device_ids integer[]) RETURNS void AS $$
+DECLARE
+    changed boolean;
+BEGIN
+    WITH "live" AS (
+        SELECT "device_id", "document"
+        FROM "iot_device_document_live"
+        WHERE "device_id" = ANY(device_ids)
+    ), "deleted" AS (
+        DELETE FROM "iot_device_document"
+        WHERE "device_id" = ANY(device_ids)
+              AND "device_id" NOT IN (SELECT "device_id" FROM "live")
+        RETURNING "device_id"
+    ), "upserted" AS (
+        INSERT INTO "iot_device_document" ("device_id", "document")
+        SELECT "device_id", "document" FROM "live"
+        ON CONFLICT ("device_id") DO UPDATE
+        SET "document" = EXCLUDED."document"
+        WHERE "iot_device_document"."document" IS DISTINCT FROM EXCLUDED."document"
+        RETURNING "device_id"
+    )
+    SELECT EXISTS (SELECT FROM "deleted") OR EXISTS (SELECT FROM "upserted")
+    INTO changed;
+    IF changed THEN
+        PERFORM "iot_registry_version_bump"();
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION "iot_registry_version_lookup_trigger"() RETURNS trigger AS $$
+BEGIN
+    PERFORM "iot_registry_version_bump"();
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+DROP_VERSION_BUMP = """
+CREATE OR REPLACE FUNCTION "iot_registry_version_lookup_trigger"() RETURNS trigger AS $$
+BEGIN
+    UPDATE "iot_registry_version" SET "version" = "version" + 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION "iot_device_document_refresh"(device_ids integer[]) RETURNS void AS $$
+    WITH "live" AS (
+        SELECT "device_id", "document"
+        FROM "iot_device_document_live"
+        WHERE "device_id" = ANY(device_ids)
+    ), "deleted" AS (
+        DELETE FROM "iot_device_document"
+        WHERE "device_id" = ANY(device_ids)
+              AND "device_id" NOT IN (SELECT "device_id" FROM "live")
+        RETURNING "device_id"
+    ), "upserted" AS (
+        INSERT INTO "iot_device_document" ("device_id", "document")
+        SELECT "device_id", "document" FROM "live"
+        ON CONFLICT ("device_id") DO UPDATE
+        SET "document" = EXCLUDED."document"
+        WHERE "iot_device_document"."document" IS DISTINCT FROM EXCLUDED."document"
+        RETURNING "device_id"
+    )
+    UPDATE "iot_registry_version"
+    SET "version" = "version" + 1
+    WHERE EXISTS (SELECT FROM "deleted") OR EXISTS (SELECT FROM "upserted");
+$$ LANGUAGE sql;
+
+DROP FUNCTION "iot_registry_version_bump"();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('iot', '0025_registry_version_lookups'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_VERSION_BUMP, DROP_VERSION_BUMP),
+    ]
@@ -0,0 +1,144 @@
+from django.db import migrations
+
+# The fingerprint of a device (see import_sensors.fingerprint) tells the
+# importers that the device still matches the sensor it was imported from. The
+# triggers below clear it whenever the device is changed in any other way: its
+# own columns (e.g. in a shell), its relations (e.g. the through rows that are
+# deleted together with a region) or the lookups it refers to (e.g. a renamed
+# theme), so the next import writes the device again.
+#
+# The importers set iot.keep_fingerprints while writing the relations of the
+# devices they import, which match the fingerprints they just stored.
+CREATE_FINGERPRINT_TRIGGERS = """
+CREATE FUNCTION "iot_device_fingerprint_clear"(device_ids integer[]) RETURNS void AS $$
+    UPDATE "iot_device"
+    SET "fingerprint" = ''
+    WHERE "id" = ANY(device_ids)
+          AND "fingerprint" <> ''
+          AND current_setting('iot.keep_fingerprints', true) IS DISTINCT FROM 'on';
+$$ LANGUAGE sql;
+
+-- iot_device, when it is updated without a new fingerprint
+CREATE FUNCTION "iot_device_fingerprint_device_trigger"() RETURNS trigger AS $$
+BEGIN
+    IF NEW."fingerprint" = OLD."fingerprint" THEN
+        NEW."fingerprint" := '';
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER "iot_device_fingerprint_sync"
+    BEFORE UPDATE ON "iot_device"
+    FOR EACH ROW WHEN (OLD.* IS DISTINCT FROM NEW.* AND OLD."fingerprint" <> '')
+    EXECUTE PROCEDURE "iot_device_fingerprint_device_trigger"();
+
+-- m2m through tables, all of them have a device_id column
+CREATE FUNCTION "iot_device_fingerprint_through_trigger"() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM "iot_device_fingerprint_clear"(ARRAY[OLD."device_id"]);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM "iot_device_fingerprint_clear"(ARRAY[NEW."device_id"]);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER "iot_device_fingerprint_sync"
+    AFTER INSERT OR UPDATE OR DELETE ON "iot_device_themes"
+    FOR EACH ROW EXECUTE PROCEDURE "iot_device_fingerprint_through_trigger"();
+CREATE TRIGGER "iot_device_fingerprint_sync"
+    AFTER INSERT OR UPDATE OR DELETE ON "iot_device_regions"
+    FOR EACH ROW EXECUTE PROCEDURE "iot_device_fingerprint_through_trigger"();
+CREATE TRIGGER "iot_device_fingerprint_sync"
+    AFTER INSERT OR UPDATE OR DELETE ON "iot_device_observation_goals"
+    FOR EACH ROW EXECUTE PROCEDURE "iot_device_fingerprint_through_trigger"();
+CREATE TRIGGER "iot_device_fingerprint_sync"
+    AFTER INSERT OR UPDATE OR DELETE ON "iot_device_projects"
+    FOR EACH ROW EXECUTE PROCEDURE "iot_device_fingerprint_through_trigger"();
+
+-- the lookups that are part of the fingerprint
+CREATE FUNCTION "iot_device_fingerprint_lookup_trigger"() RETURNS trigger AS $$
+BEGIN
+    -- TG_ARGV[0] is the query of the ids of the devices using the lookup $1
+    EXECUTE format(
+        'SELECT "iot_device_fingerprint_clear"(ARRAY(%s))', TG_ARGV[0]
+    ) USING NEW."id";
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER "iot_device_fingerprint_sync"
+    AFTER UPDATE ON "iot_type"
+    FOR EACH ROW WHEN (OLD."name" IS DISTINCT FROM NEW."name")
+    EXECUTE PROCEDURE "iot_device_fingerprint_lookup_trigger"(
+        'SELECT "id" FROM "iot_device" WHERE "type_id" = $1'
+    );
+CREATE TRIGGER "iot_device_fingerprint_sync"
+    AFTER UPDATE ON "iot_theme"
+    FOR EACH ROW WHEN (OLD."name" IS DISTINCT FROM NEW."name")
+    EXECUTE PROCEDURE "iot_device_fingerprint_lookup_trigger"(
+        'SELECT "device_id" FROM "iot_device_themes" WHERE "theme_id" = $1'
+    );
+CREATE TRIGGER "iot_device_fingerprint_sync"
+    AFTER UPDATE ON "iot_region"
+    FOR EACH ROW WHEN (OLD."name" IS DISTINCT FROM NEW."name")
+    EXECUTE PROCEDURE "iot_device_fingerprint_lookup_trigger"(
+        'SELECT "device_id" FROM "iot_device_regions" WHERE "region_id" = $1'
+    );
+CREATE TRIGGER "iot_device_fingerprint_sync"
+    AFTER UPDATE ON "iot_project"
+    FOR EACH ROW WHEN (OLD."path" IS DISTINCT FROM NEW."path")
+    EXECUTE PROCEDURE "iot_device_fingerprint_lookup_trigger"(
+        'SELECT "device_id" FROM "iot_device_projects" WHERE "project_id" = $1'
+    );
+CREATE TRIGGER "iot_device_fingerprint_sync"
+    AFTER UPDATE ON "iot_observationgoal"
+    FOR EACH ROW
+    WHEN ((OLD."observation_goal", OLD."privacy_declaration", OLD."legal_ground_id")
+          IS DISTINCT FROM (NEW."observation_goal", NEW."privacy_declaration", NEW."legal_ground_id"))
+    EXECUTE PROCEDURE "iot_device_fingerprint_lookup_trigger"(
+        'SELECT "device_id" FROM "iot_device_observation_goals" WHERE "observationgoal_id" = $1'
+    );
+CREATE TRIGGER "iot_device_fingerprint_sync"
+    AFTER UPDATE ON "iot_legalground"
+    FOR EACH ROW WHEN (OLD."name" IS DISTINCT FROM NEW."name")
+    EXECUTE PROCEDURE "iot_device_fingerprint_lookup_trigger"(
+        'SELECT "iot_device_observation_goals"."device_id"
+         FROM "iot_device_observation_goals"
+              INNER JOIN "iot_observationgoal"
+                         ON ("iot_device_observation_goals"."observationgoal_id" = "iot_observationgoal"."id")
+         WHERE "iot_observationgoal"."legal_ground_id" = $1'
+    );
+"""
+
+DROP_FINGERPRINT_TRIGGERS = """
+DROP TRIGGER "iot_device_fingerprint_sync" ON "iot_legalground";
+DROP TRIGGER "iot_device_fingerprint_sync" ON "iot_observationgoal";
+DROP TRIGGER "iot_device_fingerprint_sync" ON "iot_project";
+DROP TRIGGER "iot_device_fingerprint_sync" ON "iot_region";
+DROP TRIGGER "iot_device_fingerprint_sync" ON "iot_theme";
+DROP TRIGGER "iot_device_fingerprint_sync" ON "iot_type";
+DROP TRIGGER "iot_device_fingerprint_sync" ON "iot_device_projects";
+DROP TRIGGER "iot_device_fingerprint_sync" ON "iot_device_observation_goals";
+DROP TRIGGER "iot_device_fingerprint_sync" ON "iot_device_regions";
+DROP TRIGGER "iot_device_fingerprint_sync" ON "iot_device_themes";
+DROP TRIGGER "iot_device_fingerprint_sync" ON "iot_device";
+DROP FUNCTION "iot_device_fingerprint_lookup_trigger"();
+DROP FUNCTION "iot_device_fingerprint_through_trigger"();
+DROP FUNCTION "iot_device_fingerprint_device_trigger"();
+DROP FUNCTION "iot_device_fingerprint_clear"(integer[]);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('iot', '0026_registry_version_per_statement'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_FINGERPRINT_TRIGGERS, DROP_FINGERPRINT_TRIGGERS),
+    ]
@@ -0,0 +1,34 @@
+from django.db import migrations
+
+# The results for the same postcode and house number with other suffixes are the
+# same (the api ignores the suffix), only one of them is kept.
+DELETE_DUPLICATES = """
+DELETE FROM "iot_geocoderesult" AS "duplicate"
+USING "iot_geocoderesult" AS "kept"
+WHERE "duplicate"."postcode" = "kept"."postcode"
+      AND "duplicate"."house_number" = "kept"."house_number"
+      AND "duplicate"."id" > "kept"."id";
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('iot', '0027_device_fingerprint_triggers'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='geocoderesult',
+            unique_together=set(),
+        ),
+        migrations.RunSQL(DELETE_DUPLICATES, migrations.RunSQL.noop),
+        migrations.RemoveField(
+            model_name='geocoderesult',
+            name='suffix',
+        ),
+        migrations.AlterUniqueTogether(
+            name='geocoderesult',
+            unique_together={('postcode', 'house_number')},
+        ),
+    ]
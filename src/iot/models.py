@@ -148,6 +148,18 @@ class DeviceJson(models.Model):
         managed = False
 
 
+class DeviceDocument(models.Model):
+    # unmanaged model for the denormalised json document of every device, the
+    # table is kept up to date by database triggers (see the migration
+    # 0019_device_document) and is what the api reads from.
+    device_id = models.IntegerField(primary_key=True)
+    document = models.JSONField()
+
+    class Meta:
+        managed = False
+        db_table = 'iot_device_document'
+
+
 class Device(models.Model):
     """
     The iot device "thing"
@@ -206,10 +218,81 @@ class Device(models.Model):
         null=True, verbose_name="Tot wanneer is de sensor actief?"
     )
 
+    # the hash of the sensor data the device was last imported from, so the
+    # importers can skip the sensors that didn't change (see
+    # import_sensors.fingerprint). Cleared when the device is edited, and by
+    # the database whenever the device, its relations or its lookups change
+    # other than by an import (see the migration 0027_device_fingerprint_triggers).
+    fingerprint = models.CharField(
+        max_length=64, blank=True, default='', editable=False
+    )
+
     def __str__(self):
         return self.reference
 
+    def clean(self):
+        # edited in a form (e.g. the admin), so the device no longer matches the
+        # sensor it was imported from
+        self.fingerprint = ''
+
     class Meta:
         verbose_name = "Sensor"
         verbose_name_plural = "Sensoren"
         unique_together = "reference", "owner"
+
+
+class UpstreamState(models.Model):
+    """
+    The state of an api of the import_api command at its last import, used to
+    skip importing it when it didn't change (see import_apis.fetch_apis).
+    """
+
+    api_name = models.CharField(max_length=64, unique=True)
+    url = models.URLField(max_length=255)
+    etag = models.CharField(max_length=255, blank=True, default='')
+    last_modified = models.CharField(max_length=64, blank=True, default='')
+    # the sha256 of the normalised features of the api, see import_apis.content_hash
+    content_hash = models.CharField(max_length=64, blank=True, default='')
+    checked_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.api_name
+
+
+class GeocodeResult(models.Model):
+    """
+    The point of an address, as found by the atlas search api, cached until it
+    expires (see import_sensor.Geocoder). The point is null when the address
+    wasn't found. The api ignores the suffix of the house number, so neither
+    does the cache.
+    """
+
+    postcode = models.CharField(max_length=16)
+    house_number = models.CharField(max_length=32)
+    point = gis_models.PointField(null=True)
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f'{self.postcode} {self.house_number}'
+
+    class Meta:
+        unique_together = "postcode", "house_number"
+
+
+class Address(models.Model):
+    """
+    An address of a (BAG) extract, loaded by the import_addresses command, to
+    geocode the sensors without the atlas search api (see import_sensor.Geocoder).
+    """
+
+    postcode = models.CharField(max_length=16)
+    house_number = models.CharField(max_length=32)
+    # the house letter and addition, see import_sensor.normalize_suffix
+    suffix = models.CharField(max_length=32, blank=True, default='')
+    point = gis_models.PointField()
+
+    def __str__(self):
+        return f'{self.postcode} {self.house_number}{self.suffix}'
+
+    class Meta:
+        indexes = [models.Index(fields=["postcode", "house_number"])]
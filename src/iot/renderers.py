@@ -0,0 +1,69 @@
+import json
+
+import cbor2
+import msgpack
+from rest_framework import renderers
+from rest_framework.utils import encoders
+
+
+class NDJSONRenderer(renderers.BaseRenderer):
+    """
+    Render a list as newline delimited json, one item per line and without any
+    pagination envelope. Note that the devices view streams this format
+    straight from the database, this renderer takes care of the content
+    negotiation and of any other responses (e.g. errors).
+    """
+
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        items = data if isinstance(data, list) else [data]
+        return b''.join(
+            json.dumps(item, cls=encoders.JSONEncoder, ensure_ascii=False).encode()
+            + b'\n'
+            for item in items
+        )
+
+
+class MessagePackRenderer(renderers.BaseRenderer):
+    """
+    Render the data as MessagePack, for machine clients for which parsing the
+    json is relatively expensive.
+    """
+
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        # anything msgpack can't encode is converted like the json renderer would
+        return msgpack.packb(data, default=encoders.JSONEncoder().default)
+
+
+class CBORRenderer(renderers.BaseRenderer):
+    """
+    Render the data as CBOR (RFC 8949), for machine clients for which parsing
+    the json is relatively expensive.
+    """
+
+    media_type = 'application/cbor'
+    format = 'cbor'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        default = encoders.JSONEncoder().default
+        return cbor2.dumps(
+            data, default=lambda encoder, value: encoder.encode(default(value))
+        )
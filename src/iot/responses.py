@@ -0,0 +1,68 @@
+import re
+from pathlib import Path
+
+from django.http import FileResponse, HttpResponse
+
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class FileRange:
+    """
+    A file-like object reading the bytes from start up to and including end of
+    the file, so a range can be streamed by a FileResponse. It has no fileno on
+    purpose, a wsgi file wrapper would then send the rest of the file.
+    """
+
+    def __init__(self, file, start: int, end: int):
+        file.seek(start)
+        self.file = file
+        self.remaining = end - start + 1
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        content = self.file.read(size)
+        self.remaining -= len(content)
+        return content
+
+    def close(self):
+        self.file.close()
+
+
+def ranged_file_response(request, path: Path, content_type: str) -> HttpResponse:
+    """
+    Serve the file at path, honouring a (single) byte range request, so clients
+    can fetch only the parts of the file they need. Any other kind of range
+    request, or an invalid one (e.g. bytes=5-3), is answered with the complete
+    file, as RFC 7233 requires.
+    """
+    size = path.stat().st_size
+    match = RANGE_PATTERN.match(request.headers.get('Range', '').strip())
+    first, last = match.groups() if match else ('', '')
+
+    if not (first or last) or (first and last and int(first) > int(last)):
+        response = FileResponse(path.open('rb'), content_type=content_type)
+    else:
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        else:
+            # a suffix range, i.e. the last n bytes
+            start = max(size - int(last), 0)
+            end = size - 1
+
+        if start > end:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+        response = FileResponse(
+            FileRange(path.open('rb'), start, end),
+            status=206,
+            content_type=content_type,
+        )
+        response['Content-Length'] = end - start + 1
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+
+    response['Accept-Ranges'] = 'bytes'
+    return response
@@ -1,4 +1,5 @@
 from datapunt_api.rest import HALSerializer
+from django.conf import settings
 from rest_framework import serializers
 from rest_framework.serializers import ModelSerializer
 
@@ -88,3 +89,24 @@ class DeviceJsonSerializer(ModelSerializer):
     class Meta:
         model = DeviceJson
         fields = '__all__'
+
+
+class DeviceLookupSerializer(serializers.Serializer):
+    """
+    The references of the devices to look up, optionally only those of the
+    given organisation.
+    """
+
+    references = serializers.ListField(
+        child=serializers.CharField(max_length=64), allow_empty=False
+    )
+    organisation = serializers.CharField(required=False)
+
+    def validate_references(self, references):
+        max_references = settings.DEVICE_LOOKUP_MAX_REFERENCES
+        if len(references) > max_references:
+            raise serializers.ValidationError(
+                f'Ensure this field has no more than {max_references} elements.'
+            )
+        # remove any duplicates, but keep the order
+        return list(dict.fromkeys(references))
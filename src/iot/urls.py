@@ -8,7 +8,7 @@ from drf_yasg.views import get_schema_view
 from rest_framework import permissions
 from rest_framework.routers import DefaultRouter
 
-from . import auth, views
+from . import auth, http_cache, views
 
 
 class IoTRouter(DefaultRouter):
@@ -19,6 +19,8 @@ router = IoTRouter()
 router.register(r'devices', views.DevicesViewSet, basename='device')
 
 
+cache_schema = http_cache.surrogate_keys(http_cache.SCHEMA)
+
 schema_view = get_schema_view(
     openapi.Info(
         title='IoT API',
@@ -34,14 +36,19 @@ schema_view = get_schema_view(
 )
 
 
-urlpatterns = router.urls + [
+urlpatterns = [
+    # before the router urls, which would otherwise see these as device details
+    path('devices/export.fgb', views.export_flatgeobuf, name='device-export-fgb'),
+    path('devices/snapshot.json', views.devices_snapshot, name='device-snapshot'),
+] + router.urls + [
     re_path(
         r'^swagger(?P<format>\.json|\.yaml)$',
-        schema_view.without_ui(cache_timeout=None),
+        cache_schema(schema_view.without_ui(cache_timeout=None)),
         name='schema-json',
     ),
-    path('swagger/', schema_view.with_ui('swagger', cache_timeout=None), name='schema-swagger-ui',),
+    path('swagger/', cache_schema(schema_view.with_ui('swagger', cache_timeout=None)), name='schema-swagger-ui',),
     path('ping/', views.PingView.as_view(), name='ping'),
+    path('bootstrap/', views.BootstrapView.as_view(), name='bootstrap'),
     path('oidc/', include('keycloak_oidc.urls')),
     path('admin/login/', auth.oidc_login),
     path('admin/', admin.site.urls),
@@ -0,0 +1,26 @@
+from django.urls import path, re_path
+from rest_framework.urlpatterns import format_suffix_patterns
+
+from . import async_views, views
+
+# The public read api, as served by the asgi deployment (see main.asgi), with
+# the same urls and names as in iot.urls.
+device_urlpatterns = format_suffix_patterns(
+    [
+        re_path(r'^devices/$', async_views.device_list, name='device-list'),
+        re_path(
+            r'^devices/(?P<pk>[^/.]+)/$',
+            async_views.device_detail,
+            name='device-detail',
+        ),
+    ]
+)
+
+urlpatterns = [
+    # before the device urls, which would otherwise see these as device details
+    path('devices/export.fgb', async_views.export_flatgeobuf, name='device-export-fgb'),
+    path('devices/snapshot.json', async_views.devices_snapshot, name='device-snapshot'),
+    *device_urlpatterns,
+    path('ping/', views.PingView.as_view(), name='ping'),
+    path('bootstrap/', async_views.bootstrap, name='bootstrap'),
+]
@@ -1,8 +1,10 @@
 import contextlib
 import dataclasses
 import datetime
+import threading
+from collections import OrderedDict
 from itertools import islice
-from typing import Union
+from typing import Dict, Hashable, Iterable, Iterator, Union
 
 from openpyxl.cell import Cell
 
@@ -77,6 +79,48 @@ class Values:
         raise KeyError(field)
 
 
+def chunked(iterable: Iterable, size: int) -> Iterator[list]:
+    """
+    The items of the iterable in lists of (at most) size items.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class LRUCache:
+    """
+    A (thread safe) mapping of at most maxsize items, which forgets the least
+    recently used items.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.items: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: Hashable, default=None):
+        with self.lock:
+            if key not in self.items:
+                return default
+            self.items.move_to_end(key)
+            return self.items[key]
+
+    def set(self, key: Hashable, value) -> None:
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.items.clear()
+
+
 def parse_date(value: Union[str, datetime.date, datetime.datetime]):
     """
     Parse a date value, it may be that the value came from loading an excel
@@ -92,6 +136,37 @@ def parse_date(value: Union[str, datetime.date, datetime.datetime]):
         )
 
 
-def remove_all(relation):
-    for entity in relation.all():
-        relation.remove(entity)
+def set_relations(relation, related_ids: Dict[int, Iterable[int]]):
+    """
+    Set the related objects of a many to many relation (e.g. Device.themes) for
+    the instances in related_ids, which holds the ids of the related objects by
+    the id of the instance. Only the differences with the current rows of the
+    through table are written, so setting unchanged relations writes nothing.
+    """
+    through = relation.through
+    source = relation.field.m2m_field_name() + '_id'
+    target = relation.field.m2m_reverse_field_name() + '_id'
+    wanted = {
+        (instance_id, related_id)
+        for instance_id, ids in related_ids.items()
+        for related_id in ids
+    }
+    current = {
+        (instance_id, related_id): pk
+        for pk, instance_id, related_id in through.objects.filter(
+            **{f'{source}__in': list(related_ids)}
+        ).values_list('pk', source, target)
+    }
+
+    removed = [pk for pair, pk in current.items() if pair not in wanted]
+    if removed:
+        through.objects.filter(pk__in=removed).delete()
+    added = wanted - current.keys()
+    if added:
+        through.objects.bulk_create(
+            [
+                through(**{source: instance_id, target: related_id})
+                for instance_id, related_id in added
+            ],
+            ignore_conflicts=True,
+        )
@@ -1,12 +1,27 @@
 # -*- coding: utf-8 -*-
 
+from typing import Optional
+from urllib.parse import urlencode
+
 from datapunt_api.rest import DatapuntViewSet
+from django.conf import settings
+from django.core.cache import cache
+from django.db import OperationalError
+from django.http import FileResponse, Http404, StreamingHttpResponse
+from django.urls import reverse
 from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import require_safe
 from rest_framework import routers, views
+from rest_framework.decorators import action
 from rest_framework.response import Response
 
-from .models import DeviceJson
-from .serializers import DeviceJsonSerializer
+from . import compact, db, device_documents, exports, http_cache, lookups
+from .models import Device, DeviceJson
+from .renderers import CBORRenderer, MessagePackRenderer, NDJSONRenderer
+from .responses import ranged_file_response
+from .serializers import DeviceJsonSerializer, DeviceLookupSerializer
 
 
 class IotRootView(routers.APIRootView):
@@ -28,6 +43,48 @@ class PingView(views.APIView):
         return Response({'date': timezone.now()})
 
 
+@method_decorator(http_cache.surrogate_keys(http_cache.DEVICES), name='dispatch')
+class BootstrapView(views.APIView):
+    """
+    Everything the frontend needs for its first paint: the lookup lists for the
+    filters (with the number of devices for every value), the registry version
+    and the url of the devices.
+    """
+
+    authentication_classes = ()
+
+    def get(self, request):
+        data = lookups.get_lookups()
+        devices_url = reverse('device-snapshot')
+        data['devices'] = request.build_absolute_uri(
+            f"{devices_url}?version={data['version']}"
+        )
+        return Response(data)
+
+
+# The fields of DeviceJson, read from the stored device documents
+DEVICE_JSON_SQL = """
+    SELECT "device_id" AS "id",
+           "document"->'themes' AS "themes",
+           "document"->'observation_goals' AS "observation_goals",
+           "document"->'project_paths' AS "project_paths",
+           "document"->'regions' AS "regions",
+           "document"->'owner' AS "owner",
+           "document"->'location' AS "location",
+           ("document"->>'active_until')::date AS "active_until",
+           ("document"->>'contains_pi_data')::boolean AS "contains_pi_data",
+           "document"->>'datastream' AS "datastream",
+           "document"->>'location_description' AS "location_description",
+           "document"->>'reference' AS "reference",
+           "document"->>'type' AS "type"
+    FROM "iot_device_document"
+"""
+
+
+STALE_CACHE_KEY = 'iot-devices-last-good-{query}'
+STALE_WARNING = '110 - "Response is Stale"'
+
+
 class DevicesViewSet(DatapuntViewSet):
     """
     A view that will return the iot devices
@@ -35,66 +92,191 @@ class DevicesViewSet(DatapuntViewSet):
 
     # Because there a lots of ManyToMany relationships even with django's
     # prefetch_related we end up with terrible performance. Particularly
-    # since the front end tries to load all sensors at once. But we can
-    # use the postgres specific aggregations to build this json objects
-    # we need in SQL, meaning we can retrieve all the necessary data in
-    # one query, this gives a nice 90% speedup.
-    queryset = DeviceJson.objects.raw(
-        """
-        SELECT "iot_device"."id" AS "id",
-               JSONB_AGG(DISTINCT "iot_theme"."name") AS "themes",
-               JSONB_AGG(DISTINCT JSONB_BUILD_OBJECT(
-                   'id', "iot_observationgoal"."id",
-                   'observation_goal', "iot_observationgoal"."observation_goal",
-                   'legal_ground', "iot_legalground"."name",
-                   'privacy_declaration', "iot_observationgoal"."privacy_declaration"
-               )) AS "observation_goals",
-               JSONB_AGG(DISTINCT "iot_project"."path") FILTER (WHERE "iot_project"."path" is not null) AS "project_paths",
-               JSONB_AGG(DISTINCT "iot_region"."name") FILTER (WHERE "iot_region"."name" is not null) AS "regions",
-               JSONB_BUILD_OBJECT(
-                   'name', "iot_person"."name",
-                   'email', "iot_person"."email",
-                   'organisation', "iot_person"."organisation"
-               ) AS "owner",
-               JSONB_BUILD_OBJECT(
-                   'latitude', ST_Y("iot_device"."location"),
-                   'longitude', ST_X("iot_device"."location")
-               ) AS "location",
-               "iot_device"."active_until",
-               "iot_device"."contains_pi_data",
-               "iot_device"."datastream",
-               "iot_device"."location_description",
-               "iot_device"."reference",
-               "iot_type"."name" as "type"
-        FROM "iot_device"
-             LEFT OUTER JOIN "iot_device_themes"
-                             ON ("iot_device"."id" = "iot_device_themes"."device_id")
-             LEFT OUTER JOIN "iot_theme"
-                             ON ("iot_device_themes"."theme_id" = "iot_theme"."id")
-             LEFT OUTER JOIN "iot_device_observation_goals"
-                             ON ("iot_device"."id" = "iot_device_observation_goals"."device_id")
-             LEFT OUTER JOIN "iot_observationgoal"
-                             ON ("iot_device_observation_goals"."observationgoal_id" = "iot_observationgoal"."id")
-             LEFT OUTER JOIN "iot_legalground"
-                             ON ("iot_observationgoal"."legal_ground_id" = "iot_legalground"."id")
-             LEFT OUTER JOIN "iot_device_projects"
-                             ON ("iot_device"."id" = "iot_device_projects"."device_id")
-             LEFT OUTER JOIN "iot_project"
-                             ON ("iot_device_projects"."project_id" = "iot_project"."id")
-             LEFT OUTER JOIN "iot_device_regions"
-                             ON ("iot_device"."id" = "iot_device_regions"."device_id")
-             LEFT OUTER JOIN "iot_region"
-                             ON ("iot_device_regions"."region_id" = "iot_region"."id")
-             INNER JOIN     "iot_person"
-                             ON ("iot_device"."owner_id" = "iot_person"."id")
-             INNER JOIN     "iot_type"
-                             ON ("iot_device"."type_id" = "iot_type"."id")
-        WHERE "iot_device"."location" IS NOT NULL
-        GROUP BY "iot_device"."id", "iot_person"."id", "iot_type"."name"
-        ORDER BY "iot_device"."id"
-    """
-    )
+    # since the front end tries to load all sensors at once. So the json
+    # document of every device is built in SQL and stored in the
+    # iot_device_document table, which is kept up to date by database
+    # triggers. Here we only need to read the documents back, which is a
+    # plain scan of the primary key index.
+    queryset = DeviceJson.objects.raw(f'{DEVICE_JSON_SQL} ORDER BY "device_id"')
     serializer_class = DeviceJsonSerializer
     serializer_detail_class = DeviceJsonSerializer
+    # the api is public, see also settings.PUBLIC_PATH_PREFIXES
+    authentication_classes = ()
+    renderer_classes = (
+        *DatapuntViewSet.renderer_classes,
+        NDJSONRenderer,
+        MessagePackRenderer,
+        CBORRenderer,
+    )
+
+    http_method_names = ['get', 'post']
+
+    def list(self, request, *args, **kwargs):
+        # The last good response of every url is kept, so it can be served
+        # (marked as stale) when the database doesn't answer within the
+        # statement timeout, rather than failing the request. It is only
+        # written again when the registry version changed.
+        cache_key = self.get_stale_cache_key(request)
+        try:
+            version = None
+            if cache_key is not None:
+                version = device_documents.get_registry_version()
+            response = self.get_list_response(request, *args, **kwargs)
+        except OperationalError as e:
+            data = None
+            if cache_key is not None and db.is_statement_timeout(e):
+                data = cache.get(cache_key)
+            if data is None:
+                raise
+            return Response(data, headers={'Warning': STALE_WARNING})
+
+        if cache_key is not None:
+            version_key = f'{cache_key}-version'
+            if cache.get(version_key) != version or not cache.has_key(cache_key):
+                cache.set_many(
+                    {cache_key: response.data, version_key: version},
+                    settings.STALE_RESPONSE_TIMEOUT,
+                )
+        return response
 
-    http_method_names = ['get']
+    def get_stale_cache_key(self, request) -> Optional[str]:
+        """
+        The cache key of the last good list response for the request. Only the
+        query parameters the response depends on are allowed (and normalized),
+        the responses of other requests are not kept, so the number of kept
+        responses stays bounded.
+        """
+        # the streamed ndjson isn't kept
+        if request.accepted_renderer.format == NDJSONRenderer.format:
+            return None
+        params = {}
+        for name, values in request.query_params.lists():
+            value = values[0]
+            if len(values) > 1:
+                return None
+            if name in ('page', 'page_size') and value.isdigit():
+                params[name] = int(value)
+            elif name == 'encoding' and value == compact.ENCODING:
+                params[name] = value
+            elif name == 'format':
+                params[name] = value
+            else:
+                return None
+        if 'page_size' in params:
+            max_page_size = getattr(self.paginator, 'max_page_size', None)
+            if not max_page_size:
+                return None
+            params['page_size'] = min(params['page_size'], max_page_size)
+        return STALE_CACHE_KEY.format(query=urlencode(sorted(params.items())))
+
+    def get_list_response(self, request, *args, **kwargs):
+        # Bulk consumers can ask for newline delimited json, which is streamed
+        # straight from the database, one device per line and not paginated.
+        if request.accepted_renderer.format == NDJSONRenderer.format:
+            return StreamingHttpResponse(
+                device_documents.stream_ndjson(),
+                content_type=NDJSONRenderer.media_type,
+            )
+        # Clients that load all the devices at once can ask for the compact
+        # representation, which is much smaller, see iot.compact.
+        if request.query_params.get('encoding') == compact.ENCODING:
+            return Response(compact.encode(device_documents.get_documents()))
+        return super().list(request, *args, **kwargs)
+
+    @action(detail=False, methods=['post'], pagination_class=None)
+    def lookup(self, request):
+        """
+        Look up the devices by their references (optionally only those of an
+        organisation), returns the devices that were found and the references
+        that were not.
+        """
+        serializer = DeviceLookupSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        references = serializer.validated_data['references']
+        organisation = serializer.validated_data.get('organisation')
+
+        # the join on iot_device can use the index on its (reference, owner_id)
+        sql = f"""
+            {DEVICE_JSON_SQL}
+            INNER JOIN "iot_device" ON "iot_device"."id" = "device_id"
+            INNER JOIN "iot_person" ON "iot_person"."id" = "iot_device"."owner_id"
+            WHERE "iot_device"."reference" = ANY(%s)
+        """
+        params = [references]
+        if organisation is not None:
+            sql += ' AND LOWER("iot_person"."organisation") = LOWER(%s)'
+            params.append(organisation)
+        devices = list(DeviceJson.objects.raw(f'{sql} ORDER BY "device_id"', params))
+
+        found = {device.reference for device in devices}
+        return Response(
+            {
+                'results': DeviceJsonSerializer(devices, many=True).data,
+                'missing': [ref for ref in references if ref not in found],
+            }
+        )
+
+    def get_object(self):
+        # a raw queryset can't be filtered, so the device is read by its own
+        # query
+        pk = self.kwargs['pk']
+        devices = (
+            list(
+                DeviceJson.objects.raw(
+                    f'{DEVICE_JSON_SQL} WHERE "device_id" = %s', [pk]
+                )
+            )
+            if pk.isdigit()
+            else []
+        )
+        if not devices:
+            raise Http404
+        return devices[0]
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if request.method not in ('GET', 'HEAD') or response.status_code != 200:
+            return response
+        if response.has_header('Warning'):
+            # a stale response shouldn't be cached any longer
+            return response
+
+        if self.action == 'retrieve':
+            # the owner and type aren't part of the document
+            device = Device.objects.filter(pk=kwargs['pk']).first()
+            keys = http_cache.device_keys(device) if device else [http_cache.DEVICE]
+        else:
+            keys = [http_cache.DEVICES]
+        return http_cache.patch_cache_headers(response, keys)
+
+
+@require_safe
+@http_cache.surrogate_keys(http_cache.DEVICES)
+def export_flatgeobuf(request):
+    """
+    All the devices as a FlatGeobuf file, including its spatial index. The file
+    is regenerated when the registry changes and supports range requests, so
+    GIS clients can fetch just the features within their viewport.
+    """
+    path = exports.get_export_path('devices.fgb', exports.build_flatgeobuf)
+    return ranged_file_response(request, path, 'application/flatgeobuf')
+
+
+@require_safe
+@http_cache.surrogate_keys(http_cache.DEVICES)
+def devices_snapshot(request):
+    """
+    All the devices as a json list. The file is written once per registry
+    version and shared by all workers, which serve it with sendfile (through
+    wsgi.file_wrapper), so it doesn't need to be rendered or held in memory by
+    every worker. Clients that accept gzip get the precompressed file.
+    """
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        path = exports.get_export_path('devices.json.gz', exports.build_devices_json_gz)
+        response = FileResponse(path.open('rb'), content_type='application/json')
+        response['Content-Encoding'] = 'gzip'
+    else:
+        path = exports.get_export_path('devices.json', exports.build_devices_json)
+        response = FileResponse(path.open('rb'), content_type='application/json')
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return response
@@ -0,0 +1,19 @@
+"""
+ASGI config for iot project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+The asgi deployment only serves the public read api, see main.urls_asgi, the
+admin and the authentication views are served by the wsgi deployment.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/dev/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "main.settings")
+os.environ.setdefault("ROOT_URLCONF", "main.urls_asgi")
+
+application = get_asgi_application()
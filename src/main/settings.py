@@ -58,6 +58,14 @@ OIDC_OP_LOGOUT_ENDPOINT = LOGOUT_REDIRECT_URL = os.environ.get(
 )
 LOGIN_REDIRECT_URL_FAILURE = '/iothings/static/403.html'
 
+# The access tokens of api requests are verified locally, see iot.auth
+OIDC_JWT_AUDIENCE = os.environ.get('OIDC_JWT_AUDIENCE')
+OIDC_JWT_ISSUER = os.environ.get('OIDC_JWT_ISSUER')
+OIDC_JWT_LEEWAY = int(os.environ.get('OIDC_JWT_LEEWAY', 10))
+OIDC_JWKS_MIN_REFRESH_INTERVAL = int(
+    os.environ.get('OIDC_JWKS_MIN_REFRESH_INTERVAL', 60)
+)
+
 # APP CONFIGURATION
 # ------------------------------------------------------------------------------
 DJANGO_APPS = [
@@ -92,13 +100,24 @@ INSTALLED_APPS = DJANGO_APPS + THIRD_PARTY_APPS + LOCAL_APPS
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'iot.middleware.StatementTimeoutMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
-    'mozilla_django_oidc.middleware.SessionRefresh',
+    'iot.middleware.PublicSessionMiddleware',
+    'iot.middleware.PublicAuthenticationMiddleware',
+    'iot.middleware.PublicMessageMiddleware',
+    'iot.middleware.PublicSessionRefresh',
+]
+
+# The paths of the public api, the (read) requests to these skip the session,
+# authentication, messages and oidc session refresh middlewares
+PUBLIC_PATH_PREFIXES = [
+    '/iothings/devices/',
+    '/iothings/bootstrap/',
+    '/iothings/ping/',
+    '/iothings/swagger',
+    '/status/',
 ]
 
 DEBUG_MIDDLEWARE = [
@@ -131,8 +150,10 @@ AUTHENTICATION_BACKENDS = [
 
 SENSOR_REGISTER_ADMIN_ROLE_NAME = os.environ.get('SENSOR_REGISTER_ADMIN_ROLE_NAME', 'x')
 
-ROOT_URLCONF = "main.urls"
+# the asgi deployment only serves the public api, see main.asgi
+ROOT_URLCONF = os.getenv("ROOT_URLCONF", "main.urls")
 WSGI_APPLICATION = "main.wsgi.application"
+ASGI_APPLICATION = "main.asgi.application"
 
 TEMPLATES = [
     {
@@ -153,6 +174,20 @@ TEMPLATES = [
 SHELL_PLUS_PRINT_SQL = True
 SHELL_PLUS_PRINT_SQL_TRUNCATE = 10_000
 
+# Statement timeouts in milliseconds. The default (short, for the public api)
+# is set on the connection, the longer ones for the admin and the imports are
+# set by the StatementTimeoutMiddleware and the import commands. The migrate
+# command runs without a timeout.
+DATABASE_STATEMENT_TIMEOUT = int(os.getenv('DATABASE_STATEMENT_TIMEOUT', 5_000))
+STATEMENT_TIMEOUTS = {
+    '/iothings/admin/': int(os.getenv('ADMIN_STATEMENT_TIMEOUT', 60_000)),
+}
+IMPORT_STATEMENT_TIMEOUT = int(os.getenv('IMPORT_STATEMENT_TIMEOUT', 600_000))
+# the timeout (in seconds) of the requests of the apis imported by import_api
+IMPORT_API_TIMEOUT = int(os.getenv('IMPORT_API_TIMEOUT', 60))
+# the number of sensors that are parsed and imported at a time
+IMPORT_CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', 1000))
+
 DATABASES = {
     "default": {
         "ENGINE": "django.contrib.gis.db.backends.postgis",
@@ -162,6 +197,7 @@ DATABASES = {
         "HOST": os.getenv("DATABASE_HOST", "database"),
         "CONN_MAX_AGE": 20,
         "PORT": os.getenv("DATABASE_PORT", "5432"),
+        "OPTIONS": {"options": f"-c statement_timeout={DATABASE_STATEMENT_TIMEOUT}"},
     },
 }
 
@@ -178,6 +214,30 @@ STATIC_ROOT = os.path.join(os.path.dirname(BASE_DIR), 'static')
 MEDIA_URL = '/iothings/media/'
 MEDIA_ROOT = os.path.join(os.path.dirname(BASE_DIR), 'media')
 
+# Exports of the registry (e.g. devices.fgb), regenerated when the registry changes
+EXPORT_ROOT = os.getenv('EXPORT_ROOT', '/tmp/iothings/exports')
+# How long (in seconds) the exports of a previous version are kept after a new
+# version was exported, for the requests that are still reading them
+EXPORT_GRACE_PERIOD = int(os.getenv('EXPORT_GRACE_PERIOD', 3600))
+
+# When set, import_api exports the public api as static files to this directory
+# (a symlink to the latest export), see the export_static_api command
+STATIC_API_ROOT = os.getenv('STATIC_API_ROOT')
+
+# Caching of the public api by reverse proxies and CDNs, see iot.http_cache
+CACHE_CONTROL_MAX_AGE = int(os.getenv('CACHE_CONTROL_MAX_AGE', 60))
+CACHE_CONTROL_S_MAXAGE = int(os.getenv('CACHE_CONTROL_S_MAXAGE', 3600))
+CACHE_CONTROL_STALE_WHILE_REVALIDATE = int(
+    os.getenv('CACHE_CONTROL_STALE_WHILE_REVALIDATE', 86400)
+)
+# How long (in seconds) the last good response of the devices list is kept, to
+# be served when the database doesn't answer in time, see iot.views
+STALE_RESPONSE_TIMEOUT = int(os.getenv('STALE_RESPONSE_TIMEOUT', 86400))
+# The dotted path of the function called with the surrogate keys to purge after
+# the data changed, e.g. iot.http_cache.http_purge
+CACHE_PURGE_HOOK = os.getenv('CACHE_PURGE_HOOK')
+CACHE_PURGE_URL = os.getenv('CACHE_PURGE_URL')
+
 
 # Django cache settings
 CACHES = {
@@ -293,7 +353,7 @@ REST_FRAMEWORK = dict(
     UNAUTHENTICATED_USER={},
     UNAUTHENTICATED_TOKEN={},
     DEFAULT_AUTHENTICATION_CLASSES=(
-        'mozilla_django_oidc.contrib.drf.OIDCAuthentication',
+        'iot.auth.JWTAuthentication',
         # 'rest_framework.authentication.BasicAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ),
@@ -314,8 +374,17 @@ REST_FRAMEWORK = dict(
     DEFAULT_THROTTLE_RATES={'nouser': '60/hour'},
 )
 
+# The maximum number of references of a single request to devices/lookup/
+DEVICE_LOOKUP_MAX_REFERENCES = int(os.getenv('DEVICE_LOOKUP_MAX_REFERENCES', 5000))
+
 ATLAS_POSTCODE_SEARCH = 'https://api.data.amsterdam.nl/atlas/search/postcode'
 ATLAS_ADDRESS_SEARCH = 'https://api.data.amsterdam.nl/atlas/search/adres'
+# the addresses geocoded by the atlas search apis are cached (in the database)
+# for GEOCODE_CACHE_TTL seconds, with the last GEOCODE_CACHE_SIZE in memory. The
+# addresses that weren't found are cached for GEOCODE_NEGATIVE_CACHE_TTL seconds
+GEOCODE_CACHE_TTL = int(os.getenv('GEOCODE_CACHE_TTL', 30 * 24 * 60 * 60))
+GEOCODE_NEGATIVE_CACHE_TTL = int(os.getenv('GEOCODE_NEGATIVE_CACHE_TTL', 24 * 60 * 60))
+GEOCODE_CACHE_SIZE = int(os.getenv('GEOCODE_CACHE_SIZE', 10_000))
 
 DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
 
@@ -0,0 +1,7 @@
+from django.urls import include, path
+
+# The urls of the asgi deployment, see main.asgi
+urlpatterns = [
+    path('iothings/', include('iot.urls_asgi')),
+    path('status/', include('health.urls')),
+]
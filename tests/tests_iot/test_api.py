@@ -1,7 +1,14 @@
+import json
+
+import cbor2
+import msgpack
+from django.core.cache import cache
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
 
+from iot import compact, device_documents
+from iot.models import Theme
 from iot.serializers import DeviceJsonSerializer
 from iot.views import DevicesViewSet
 from tests.factories import DeviceFactory
@@ -27,3 +34,162 @@ class DeviceTestCase(APITestCase):
         actual = response.json()['results'][0]
         expected = DeviceJsonSerializer(DevicesViewSet.queryset[0]).data
         assert actual == expected
+
+    def test_get_detail(self):
+        device = DeviceFactory.create()
+        response = self.client.get(reverse('device-detail', args=[device.pk]))
+        assert response.status_code == 200
+        assert response.json() == DeviceJsonSerializer(DevicesViewSet.queryset[0]).data
+
+    def test_get_detail_not_found(self):
+        for pk in ['0', 'x']:
+            response = self.client.get(reverse('device-detail', args=[pk]))
+            assert response.status_code == 404
+
+    def test_get_ndjson(self):
+        DeviceFactory.create()
+        url = reverse('device-list')
+        expected = [
+            json.loads(json.dumps(DeviceJsonSerializer(device).data))
+            for device in DevicesViewSet.queryset
+        ]
+        for params, headers in [
+            ({'format': 'ndjson'}, {}),
+            ({}, {'HTTP_ACCEPT': 'application/x-ndjson'}),
+        ]:
+            response = self.client.get(url, params, **headers)
+            assert response['Content-Type'] == 'application/x-ndjson'
+            lines = b''.join(response.streaming_content).decode().splitlines()
+            assert [json.loads(line) for line in lines] == expected
+
+    def test_get_binary_formats(self):
+        # the binary formats should contain exactly the same data as the json
+        DeviceFactory.create()
+        url = reverse('device-list')
+        expected = self.client.get(url).json()
+        for media_type, loads in [
+            ('application/msgpack', msgpack.unpackb),
+            ('application/cbor', cbor2.loads),
+        ]:
+            response = self.client.get(url, HTTP_ACCEPT=media_type)
+            assert response['Content-Type'] == media_type
+            assert loads(response.content) == expected
+
+    def test_get_compact(self):
+        DeviceFactory.create()
+        url = reverse('device-list')
+        expected = self.client.get(url).json()['results']
+        response = self.client.get(url, {'encoding': 'compact'})
+        actual = compact.decode(response.json())
+        for device in expected:
+            location = device['location']
+            location['latitude'] = round(location['latitude'], 6)
+            location['longitude'] = round(location['longitude'], 6)
+        assert actual == expected
+
+
+class BootstrapTestCase(APITestCase):
+    def setUp(self):
+        # the lookups are cached by the registry version, which is rolled back
+        # with every test
+        cache.clear()
+
+    def test_get(self):
+        device = DeviceFactory.create()
+        response = self.client.get(reverse('bootstrap'))
+        assert response.status_code == 200
+        data = response.json()
+
+        version = device_documents.get_registry_version()
+        assert data['version'] == version
+        assert data['devices'].endswith(
+            f"{reverse('device-snapshot')}?version={version}"
+        )
+
+        types = {t['name']: t for t in data['types']}
+        assert types[device.type.name]['device_count'] == 1
+        assert types[device.type.name]['is_other'] == device.type.is_other
+        assert sum(t['device_count'] for t in data['types']) == 1
+
+        themes = {t['name']: t['device_count'] for t in data['themes']}
+        for theme in device.themes.all():
+            assert themes[theme.name] == 1
+
+        assert data['organisations'] == [
+            {'name': device.owner.organisation, 'device_count': 1}
+        ]
+
+    def test_lookups_should_be_cached_per_version(self):
+        device = DeviceFactory.create()
+        url = reverse('bootstrap')
+        self.client.get(url)
+        with self.assertNumQueries(1):  # only the registry version
+            self.client.get(url)
+
+        device.location = None
+        device.save()
+        data = self.client.get(url).json()
+        assert sum(t['device_count'] for t in data['types']) == 0
+
+    def test_lookups_should_change_with_unused_lookups(self):
+        DeviceFactory.create()
+        url = reverse('bootstrap')
+        self.client.get(url)
+
+        theme = Theme.objects.create(name='ongebruikt')
+        data = self.client.get(url).json()
+        themes = {t['name']: t['device_count'] for t in data['themes']}
+        assert themes['ongebruikt'] == 0
+
+        theme.is_other = not theme.is_other
+        theme.save()
+        data = self.client.get(url).json()
+        themes = {t['name']: t['is_other'] for t in data['themes']}
+        assert themes['ongebruikt'] == theme.is_other
+
+
+class DeviceLookupTestCase(APITestCase):
+    url = reverse('device-lookup')
+
+    def test_lookup(self):
+        device = DeviceFactory.create()
+        response = self.client.post(
+            self.url,
+            {'references': [device.reference, 'unknown', device.reference]},
+            format='json',
+        )
+        assert response.status_code == 200
+        data = response.json()
+        expected = DeviceJsonSerializer(DevicesViewSet.queryset[0]).data
+        assert data['results'] == [expected]
+        assert data['missing'] == ['unknown']
+
+    def test_lookup_by_organisation(self):
+        device = DeviceFactory.create()
+        for organisation, num_results in [
+            (device.owner.organisation.upper(), 1),
+            ('Een andere organisatie', 0),
+        ]:
+            data = {'references': [device.reference], 'organisation': organisation}
+            response = self.client.post(self.url, data, format='json')
+            assert len(response.json()['results']) == num_results
+
+    def test_lookup_should_use_a_single_query(self):
+        DeviceFactory.create()
+        references = [f'sensor-{i}' for i in range(1000)]
+        with self.assertNumQueries(1):
+            response = self.client.post(
+                self.url, {'references': references}, format='json'
+            )
+        assert response.json()['missing'] == references
+
+    def test_lookup_invalid(self):
+        for data in [{}, {'references': []}, {'references': 'sensor-1'}]:
+            response = self.client.post(self.url, data, format='json')
+            assert response.status_code == 400
+
+    def test_lookup_too_many_references(self):
+        with self.settings(DEVICE_LOOKUP_MAX_REFERENCES=2):
+            data = {'references': ['a', 'b', 'c']}
+            response = self.client.post(self.url, data, format='json')
+        assert response.status_code == 400
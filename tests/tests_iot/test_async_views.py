@@ -0,0 +1,133 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from django.core.cache import cache
+from django.urls import reverse
+
+from iot import async_views
+from iot.management.commands.benchmark_api import percentile, run_benchmark
+from iot.middleware import StatementTimeoutMiddleware
+from tests.factories import DeviceFactory
+
+
+def get(client, settings, urlconf, url, **kwargs):
+    settings.ROOT_URLCONF = urlconf
+    cache.clear()
+    return client.get(url, **kwargs)
+
+
+# the async views run their queries in threads of their own, with their own
+# database connections, which only see committed data
+@pytest.mark.django_db(transaction=True)
+class TestAsyncViews:
+    @pytest.fixture
+    def device(self):
+        return DeviceFactory()
+
+    def test_views_should_be_async(self):
+        for view in [
+            async_views.device_list,
+            async_views.device_detail,
+            async_views.devices_snapshot,
+            async_views.export_flatgeobuf,
+            async_views.bootstrap,
+        ]:
+            assert asyncio.iscoroutinefunction(view)
+
+    @pytest.mark.parametrize(
+        "name,headers",
+        [
+            ('device-list', {}),
+            ('device-list', {'HTTP_ACCEPT': 'application/msgpack'}),
+            ('device-detail', {}),
+            ('bootstrap', {}),
+        ],
+    )
+    def test_same_responses(self, client, settings, device, name, headers):
+        args = [device.pk] if name == 'device-detail' else []
+        url = reverse(name, args=args)
+        expected = get(client, settings, 'main.urls', url, **headers)
+        response = get(client, settings, 'main.urls_asgi', url, **headers)
+        assert response.status_code == 200
+        assert response.content == expected.content
+        for header in ['Content-Type', 'Cache-Control', 'Surrogate-Key']:
+            assert response[header] == expected[header]
+
+    def test_ndjson(self, client, settings, device):
+        url = reverse('device-list')
+        expected = get(client, settings, 'main.urls', url, data={'format': 'ndjson'})
+        response = get(
+            client, settings, 'main.urls_asgi', url, data={'format': 'ndjson'}
+        )
+        assert response['Content-Type'] == 'application/x-ndjson'
+        # spooled to a file, not read into memory
+        assert response.streaming
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        assert [json.loads(line) for line in lines] == [
+            json.loads(line)
+            for line in b''.join(expected.streaming_content).decode().splitlines()
+        ]
+
+    def test_snapshot(self, client, settings, device, tmp_path):
+        settings.EXPORT_ROOT = str(tmp_path)
+        url = reverse('device-snapshot')
+        response = get(client, settings, 'main.urls_asgi', url)
+        assert response.status_code == 200
+        devices = json.loads(b''.join(response.streaming_content))
+        assert [d['id'] for d in devices] == [device.pk]
+
+    def test_not_found(self, client, settings):
+        url = reverse('device-detail', args=[1])
+        assert get(client, settings, 'main.urls_asgi', url).status_code == 404
+
+
+def test_statement_timeout_middleware_should_be_async():
+    async def get_response(request):
+        return 'response'
+
+    middleware = StatementTimeoutMiddleware(get_response)
+    assert asyncio.iscoroutinefunction(middleware)
+    assert asyncio.run(middleware(None)) == 'response'
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200 if self.path == '/ok' else 500)
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+    server.server_close()
+
+
+class TestBenchmark:
+    def test_run_benchmark(self, server):
+        result = run_benchmark(f'{server}/ok', num_requests=20, concurrency=4)
+        assert result['requests'] == 20
+        assert result['failed'] == 0
+        assert result['rps'] > 0
+        assert 0 < result['p50'] <= result['p95'] <= result['p99']
+
+    def test_failures(self, server):
+        result = run_benchmark(f'{server}/error', num_requests=5, concurrency=2)
+        assert result['failed'] == 5
+
+    def test_percentile(self):
+        durations = list(range(1, 101))
+        assert percentile(durations, 50) == 51
+        assert percentile(durations, 99) == 99
+        assert percentile(durations, 100) == 100
+        assert percentile([5], 95) == 5
@@ -0,0 +1,189 @@
+import json
+import time
+
+import jwt
+import pytest
+import requests
+import responses
+from cryptography.hazmat.primitives.asymmetric import rsa
+from django.conf import settings
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from iot import auth
+
+
+def generate_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+def to_jwk(key, kid):
+    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(key.public_key()))
+    return {**jwk, 'kid': kid, 'alg': 'RS256', 'use': 'sig'}
+
+
+def create_token(key, kid, **claims):
+    claims = {
+        'exp': int(time.time()) + 300,
+        'email': 'p.er.soon@amsterdam.nl',
+        'given_name': 'Piet',
+        'family_name': 'Er Soon',
+        'realm_access': {'roles': ['medewerker']},
+        **claims,
+    }
+    return jwt.encode(claims, key, algorithm='RS256', headers={'kid': kid})
+
+
+def authenticate(token):
+    request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {token}')
+    return auth.JWTAuthentication().authenticate(Request(request))
+
+
+@pytest.fixture
+def key():
+    return generate_key()
+
+
+@pytest.fixture
+def stub_jwks(key):
+    """
+    A local stub of the JWKS endpoint of the identity provider, the keys it
+    returns can be changed through the keys list.
+    """
+    auth.jwks.clear()
+    cache.clear()
+    keys = [to_jwk(key, 'key-1')]
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as mock:
+        mock.add_callback(
+            responses.GET,
+            settings.OIDC_OP_JWKS_ENDPOINT,
+            callback=lambda request: (200, {}, json.dumps({'keys': keys})),
+        )
+        mock.keys = keys
+        yield mock
+
+
+@pytest.mark.django_db
+class TestJWTAuthentication:
+    def test_authenticate(self, key, stub_jwks):
+        user, _ = authenticate(create_token(key, 'key-1'))
+        assert user.email == 'p.er.soon@amsterdam.nl'
+        assert [group.name for group in user.groups.all()] == ['medewerker']
+
+    def test_no_token(self):
+        request = APIRequestFactory().get('/')
+        assert auth.JWTAuthentication().authenticate(Request(request)) is None
+
+    def test_keys_should_be_cached(self, key, stub_jwks):
+        authenticate(create_token(key, 'key-1'))
+        authenticate(create_token(key, 'key-1', given_name='Pieter'))
+        assert len(stub_jwks.calls) == 1
+
+    def test_token_should_be_cached(
+        self, key, stub_jwks, django_assert_max_num_queries
+    ):
+        token = create_token(key, 'key-1')
+        user, _ = authenticate(token)
+
+        # only the user is read
+        auth.jwks.clear()
+        with django_assert_max_num_queries(1):
+            assert authenticate(token)[0] == user
+        assert len(stub_jwks.calls) == 1
+
+    def test_rotated_keys_should_be_fetched(self, key, stub_jwks, settings):
+        settings.OIDC_JWKS_MIN_REFRESH_INTERVAL = 0
+        authenticate(create_token(key, 'key-1'))
+
+        new_key = generate_key()
+        stub_jwks.keys[:] = [to_jwk(new_key, 'key-2')]
+        user, _ = authenticate(create_token(new_key, 'key-2'))
+        assert user.email == 'p.er.soon@amsterdam.nl'
+        assert len(stub_jwks.calls) == 2
+
+    def test_unknown_keys_should_not_be_fetched_too_often(self, key, stub_jwks):
+        authenticate(create_token(key, 'key-1'))
+        for _ in range(3):
+            with pytest.raises(AuthenticationFailed):
+                authenticate(create_token(key, 'unknown'))
+        assert len(stub_jwks.calls) == 1
+
+    @pytest.mark.parametrize(
+        'response',
+        [
+            {'body': requests.ConnectionError('unreachable')},
+            {'status': 500},
+            {'body': 'not json'},
+            {'json': {'keys': []}},
+        ],
+    )
+    def test_unavailable_keys_should_fail_authentication(self, key, response):
+        auth.jwks.clear()
+        with responses.RequestsMock() as mock:
+            mock.add(responses.GET, settings.OIDC_OP_JWKS_ENDPOINT, **response)
+            for _ in range(2):
+                with pytest.raises(AuthenticationFailed):
+                    authenticate(create_token(key, 'key-1'))
+            # the failed fetch isn't retried within the refresh interval
+            assert len(mock.calls) == 1
+
+    def test_expired_token(self, key, stub_jwks):
+        token = create_token(key, 'key-1', exp=int(time.time()) - 60)
+        with pytest.raises(AuthenticationFailed):
+            authenticate(token)
+
+    def test_invalid_signature(self, stub_jwks):
+        token = create_token(generate_key(), 'key-1')
+        with pytest.raises(AuthenticationFailed):
+            authenticate(token)
+
+    def test_issuer(self, key, stub_jwks, settings):
+        settings.OIDC_JWT_ISSUER = 'https://iam.amsterdam.nl/auth/realms/datapunt'
+        with pytest.raises(AuthenticationFailed):
+            authenticate(create_token(key, 'key-1', iss='https://example.com'))
+        token = create_token(key, 'key-1', iss=settings.OIDC_JWT_ISSUER)
+        user, _ = authenticate(token)
+        assert user.email == 'p.er.soon@amsterdam.nl'
+
+
+@pytest.mark.django_db
+class TestUpdateGroups:
+    @pytest.fixture
+    def user(self):
+        return User.objects.create_user('piet', 'p.er.soon@amsterdam.nl')
+
+    def update_groups(self, user, *roles):
+        auth.OIDCAuthenticationBackend().update_groups(user, {'roles': list(roles)})
+        user.refresh_from_db()
+        return sorted(group.name for group in user.groups.all())
+
+    def test_update_groups(self, user, settings):
+        settings.DEBUG = False
+        admin = settings.SENSOR_REGISTER_ADMIN_ROLE_NAME
+        assert self.update_groups(user, 'a', 'b') == ['a', 'b']
+        assert not user.is_staff
+
+        assert self.update_groups(user, 'b', admin) == ['b', admin]
+        assert user.is_staff and user.is_superuser
+
+        assert self.update_groups(user, 'c') == ['c']
+        assert not user.is_staff and not user.is_superuser
+        assert Group.objects.filter(name='c').count() == 1
+
+    def test_debug_should_make_staff(self, user, settings):
+        settings.DEBUG = True
+        self.update_groups(user, 'a')
+        assert user.is_staff and user.is_superuser
+
+    def test_unchanged_groups_should_only_be_read(
+        self, user, settings, django_assert_num_queries
+    ):
+        settings.DEBUG = False
+        self.update_groups(user, 'a', 'b')
+        with django_assert_num_queries(1):
+            auth.OIDCAuthenticationBackend().update_groups(
+                user, {'roles': ['b', 'a']}
+            )
@@ -0,0 +1,91 @@
+from io import StringIO
+from unittest.mock import patch
+
+import pytest
+from django.contrib.gis.geos import Point
+from django.core.management import call_command
+from rest_framework.exceptions import ValidationError
+
+from iot import models
+from iot.importers import import_sensor
+
+EXTRACT = """\
+openbareruimte;huisnummer;huisletter;huisnummertoevoeging;postcode;woonplaats;lon;lat
+Herengracht;1;;;1015BA;Amsterdam;4.892287;52.379056
+Herengracht;3;A;2;1015BA;Amsterdam;4.892301;52.379102
+Herengracht;5;;;;Amsterdam;4.892401;52.379202
+"""
+
+
+@pytest.fixture
+def extract(tmp_path):
+    path = tmp_path / "adressen.csv"
+    path.write_text(EXTRACT)
+    return str(path)
+
+
+def get_center_coordinates(postcode, house_number):
+    raise AssertionError("the atlas search api should not be requested")
+
+
+@pytest.mark.django_db
+class TestImportAddresses:
+    @pytest.fixture(autouse=True)
+    def clear_geocode_cache(self):
+        import_sensor.geocode_cache.clear()
+
+    def import_addresses(self, extract):
+        with StringIO() as out:
+            call_command("import_addresses", extract, "--delimiter", ";", stdout=out)
+            return out.getvalue()
+
+    def test_import_addresses(self, extract):
+        assert self.import_addresses(extract).strip() == "2 addresses loaded"
+        # the address without a postcode is skipped
+        assert sorted(
+            models.Address.objects.values_list("postcode", "house_number", "suffix")
+        ) == [("1015BA", "1", ""), ("1015BA", "3", "A2")]
+
+    def test_import_addresses_should_replace_the_addresses(self, extract):
+        self.import_addresses(extract)
+        self.import_addresses(extract)
+        assert models.Address.objects.count() == 2
+        # the table is swapped with the ids, sequence and indexes it had
+        models.Address.objects.create(
+            postcode="1015BA", house_number="7", point=Point(4.8925, 52.3793)
+        )
+        assert len(set(models.Address.objects.values_list("pk", flat=True))) == 3
+
+    def test_geocoder_should_use_the_addresses(self, extract):
+        self.import_addresses(extract)
+        geocoder = import_sensor.Geocoder()
+        with patch(
+            "iot.importers.import_sensor.get_center_coordinates",
+            get_center_coordinates,
+        ):
+            point = geocoder.get_center_coordinates("1015 ba", 3, "a-2")
+            assert tuple(point) == (4.892301, 52.379102)
+            # an unknown suffix is ignored
+            point = geocoder.get_center_coordinates("1015 BA", 1, "B")
+            assert tuple(point) == (4.892287, 52.379056)
+        assert geocoder.stats.address_hits == 2
+        assert geocoder.stats.misses == 0
+
+    def test_other_processes_should_find_the_loaded_addresses(self, extract):
+        geocoder = import_sensor.Geocoder()
+        with patch(
+            "iot.importers.import_sensor.get_center_coordinates",
+            side_effect=ValidationError("1015 BA", 1),
+        ):
+            with pytest.raises(ValidationError):
+                geocoder.get_center_coordinates("1015 BA", 1)
+
+        # e.g. imported by another process, the address that wasn't found
+        # isn't cached in the memory of this one
+        self.import_addresses(extract)
+        with patch(
+            "iot.importers.import_sensor.get_center_coordinates",
+            get_center_coordinates,
+        ):
+            point = geocoder.get_center_coordinates("1015 BA", 1)
+        assert tuple(point) == (4.892287, 52.379056)
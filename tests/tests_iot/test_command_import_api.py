@@ -1,9 +1,14 @@
 from io import StringIO
+from unittest.mock import patch
 
 import pytest
+import responses
 from django.core.management import call_command
 from django.test import TestCase
 
+from iot import models
+from iot.importers import import_apis
+
 
 class ImportApiTest(TestCase):
     """
@@ -17,3 +22,159 @@ class ImportApiTest(TestCase):
         with StringIO() as out:
             with pytest.raises(Exception):
                 call_command('import_api', 'something', stdout=out)
+
+    @responses.activate
+    def test_command_import_api_should_fetch_every_url_once(self):
+        """
+        call the import_api command with the apis of the VIS layer, which share
+        a url, and expect the url to be requested once.
+        """
+        empty = {"type": "FeatureCollection", "features": []}
+        apis = [
+            'cctv_camera_verkeersmanagement',
+            'kentekencamera_reistijd',
+            'kentekencamera_milieuzone',
+            'ais_masten',
+        ]
+        for url in {import_apis.API_MAPPER[api] for api in apis}:
+            responses.add(responses.GET, url, json=empty)
+
+        with StringIO() as out:
+            call_command('import_api', *apis, stdout=out)
+            output = out.getvalue()
+
+        assert sorted(call.request.url for call in responses.calls) == sorted(
+            {import_apis.API_MAPPER[api] for api in apis}
+        )
+        for api in apis:
+            assert f'{api}: inserts 0, updates 0, unchanged 0, errors 0' in output
+
+    @responses.activate
+    def test_command_import_api_failing_api(self):
+        """
+        call the import_api command with an api that doesn't return json and
+        expect an exception to be raised before anything is imported.
+        """
+        url = import_apis.API_MAPPER['ais_masten']
+        responses.add(responses.GET, url, status=500)
+        with StringIO() as out:
+            with pytest.raises(RuntimeError):
+                call_command('import_api', 'ais_masten', stdout=out)
+
+    @responses.activate
+    def test_command_import_api_should_skip_unchanged_api(self):
+        """
+        call the import_api command twice with an api that returns the same
+        data (in another order), and expect it to be skipped the second time,
+        unless forced.
+        """
+        url = import_apis.API_MAPPER['ais_masten']
+        responses.add(
+            responses.GET, url, json={"type": "FeatureCollection", "features": []}
+        )
+        for _ in range(2):
+            responses.add(
+                responses.GET, url, json={"features": [], "type": "FeatureCollection"}
+            )
+
+        with StringIO() as out:
+            call_command('import_api', 'ais_masten', stdout=out)
+            call_command('import_api', 'ais_masten', stdout=out)
+            call_command('import_api', 'ais_masten', '--force', stdout=out)
+            output = out.getvalue().splitlines()
+
+        assert output == [
+            'ais_masten: inserts 0, updates 0, unchanged 0, errors 0',
+            'ais_masten: unchanged',
+            'ais_masten: inserts 0, updates 0, unchanged 0, errors 0',
+        ]
+
+    @responses.activate
+    def test_command_import_api_should_retry_api_with_errors(self):
+        """
+        call the import_api command twice with an api that returns the same
+        data, and expect it to be imported again when some of its sensors
+        failed to import the first time.
+        """
+        url = import_apis.API_MAPPER['ais_masten']
+        for _ in range(2):
+            responses.add(
+                responses.GET, url, json={"type": "FeatureCollection", "features": []}
+            )
+
+        with StringIO() as out:
+            with patch.object(
+                import_apis, 'convert_api_data', return_value=([ValueError()], 0, 0, 0)
+            ):
+                call_command('import_api', 'ais_masten', stdout=out)
+            call_command('import_api', 'ais_masten', stdout=out)
+            output = out.getvalue().splitlines()
+
+        assert output == [
+            'ais_masten: inserts 0, updates 0, unchanged 0, errors 1',
+            'ais_masten: inserts 0, updates 0, unchanged 0, errors 0',
+        ]
+
+    @responses.activate
+    def test_command_import_api_should_send_conditional_request(self):
+        """
+        call the import_api command twice with an api that returns an ETag and
+        Last-Modified, and expect the second request to be conditional and the
+        api to be skipped when it isn't modified.
+        """
+        url = import_apis.API_MAPPER['ais_masten']
+        headers = {'ETag': '"v1"', 'Last-Modified': 'Mon, 19 Oct 2026 10:00:00 GMT'}
+        responses.add(
+            responses.GET,
+            url,
+            json={"type": "FeatureCollection", "features": []},
+            headers=headers,
+        )
+        responses.add(responses.GET, url, status=304)
+
+        with StringIO() as out:
+            call_command('import_api', 'ais_masten', stdout=out)
+            call_command('import_api', 'ais_masten', stdout=out)
+            output = out.getvalue().splitlines()
+
+        assert output[-1] == 'ais_masten: unchanged'
+        request = responses.calls[1].request
+        assert request.headers['If-None-Match'] == '"v1"'
+        assert request.headers['If-Modified-Since'] == headers['Last-Modified']
+
+        state = models.UpstreamState.objects.get(api_name='ais_masten')
+        assert state.url == url
+        assert state.etag == '"v1"'
+        assert state.content_hash == import_apis.content_hash([])
+
+    @responses.activate
+    def test_command_import_api_should_import_in_chunks(self):
+        """
+        call the import_api command with an api with more sensors than the
+        chunk size, and expect all of them to be imported.
+        """
+        url = import_apis.API_MAPPER['ais_masten']
+        features = [
+            {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [4.899393, 52.4001061]},
+                "properties": {
+                    "Locatienaam": f"Mast {i}",
+                    "Privacyverklaring": "https://www.amsterdam.nl/privacy/",
+                },
+            }
+            for i in range(5)
+        ]
+        responses.add(
+            responses.GET, url, json={"type": "FeatureCollection", "features": features}
+        )
+
+        with StringIO() as out, self.settings(IMPORT_CHUNK_SIZE=2):
+            call_command('import_api', 'ais_masten', stdout=out)
+            output = out.getvalue()
+
+        assert 'ais_masten: inserts 5, updates 0, unchanged 0, errors 0' in output
+        assert sorted(models.Device.objects.values_list('reference', flat=True)) == [
+            f"Mast {i}" for i in range(5)
+        ]
+        assert models.Person.objects.count() == 1
@@ -0,0 +1,76 @@
+import json
+
+from iot import compact
+
+
+def make_document(i, owner, type, themes):
+    return {
+        'id': i,
+        'reference': f'sensor-{i}',
+        'owner': owner,
+        'type': type,
+        'themes': themes,
+        'regions': None,
+        'observation_goals': [
+            {
+                'id': 1,
+                'observation_goal': 'Tellen van voetgangers',
+                'legal_ground': 'Verkeersbeleid',
+                'privacy_declaration': 'https://www.amsterdam.nl/privacy',
+            }
+        ],
+        'project_paths': [['Amsterdam', 'Mobiliteit']],
+        'location': {'latitude': 52.3 + i / 3000, 'longitude': 4.9 + i / 7000},
+        'active_until': '2050-01-01',
+        'contains_pi_data': bool(i % 2),
+        'datastream': '',
+        'location_description': None,
+    }
+
+
+OWNERS = [
+    {'name': 'Piet', 'email': 'p@amsterdam.nl', 'organisation': 'Gemeente Amsterdam'},
+    {'name': 'Klaas', 'email': 'k@amsterdam.nl', 'organisation': 'Gemeente Amsterdam'},
+]
+
+DOCUMENTS = [
+    make_document(
+        i, OWNERS[i % 2], 'Camera' if i % 3 else 'Sensor', ['Mobiliteit: auto'][: i % 2]
+    )
+    for i in range(100)
+]
+
+
+def round_location(document):
+    location = document['location']
+    return {
+        **document,
+        'location': {
+            'latitude': round(location['latitude'], 6),
+            'longitude': round(location['longitude'], 6),
+        },
+    }
+
+
+class TestCompact:
+    def test_dictionaries(self):
+        payload = compact.encode(DOCUMENTS)
+        assert payload['count'] == 100
+        assert payload['dictionaries']['owners'] == OWNERS
+        assert payload['dictionaries']['types'] == ['Sensor', 'Camera']
+        assert payload['dictionaries']['legal_grounds'] == ['Verkeersbeleid']
+        assert payload['columns']['owner'][:3] == [0, 1, 0]
+        assert payload['columns']['themes'][:2] == [[], [0]]
+        assert payload['columns']['regions'][0] is None
+
+    def test_round_trip(self):
+        payload = json.loads(json.dumps(compact.encode(DOCUMENTS)))
+        assert compact.decode(payload) == [round_location(d) for d in DOCUMENTS]
+
+    def test_empty(self):
+        assert compact.decode(compact.encode([])) == []
+
+    def test_size(self):
+        # the repeated values make up most of the documents
+        size = len(json.dumps(compact.encode(DOCUMENTS)))
+        assert size * 3 < len(json.dumps(DOCUMENTS))
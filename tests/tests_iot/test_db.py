@@ -0,0 +1,136 @@
+from unittest.mock import patch
+
+import pytest
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.commands import migrate
+from django.db import OperationalError, connection, transaction
+from django.test import RequestFactory
+from django.urls import reverse
+
+from iot import db
+from iot.middleware import StatementTimeoutMiddleware
+from iot.views import DevicesViewSet
+from tests.factories import DeviceFactory
+
+
+def get_statement_timeout():
+    with connection.cursor() as cursor:
+        cursor.execute('SHOW statement_timeout')
+        return cursor.fetchone()[0]
+
+
+def get_timeout_error():
+    try:
+        # in a savepoint, so the test transaction can be used after the error
+        with db.statement_timeout(1), transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_sleep(1)')
+    except OperationalError as e:
+        return e
+    raise AssertionError('the statement should have timed out')
+
+
+@pytest.mark.django_db
+class TestStatementTimeout:
+    def test_default(self, settings):
+        expected = settings.DATABASE_STATEMENT_TIMEOUT // 1000
+        assert get_statement_timeout() == f'{expected}s'
+
+    def test_statement_timeout(self):
+        default = get_statement_timeout()
+        with db.statement_timeout(60_000):
+            assert get_statement_timeout() == '1min'
+        assert get_statement_timeout() == default
+
+    def test_is_statement_timeout(self):
+        assert db.is_statement_timeout(get_timeout_error())
+        assert not db.is_statement_timeout(OperationalError())
+
+    def test_migrate_should_not_time_out(self):
+        timeouts = []
+
+        def handle(*args, **options):
+            timeouts.append(get_statement_timeout())
+
+        with patch.object(migrate.Command, 'handle', handle):
+            call_command('migrate')
+        assert timeouts == ['0']
+        assert get_statement_timeout() != '0'
+
+    def test_middleware(self, settings):
+        settings.STATEMENT_TIMEOUTS = {'/iothings/admin/': 60_000, '/iothings/': 1000}
+        middleware = StatementTimeoutMiddleware(lambda request: get_statement_timeout())
+        for path, expected in [
+            ('/iothings/admin/iot/device/', '1min'),
+            ('/iothings/devices/', '1s'),
+            ('/status/health', get_statement_timeout()),
+        ]:
+            assert middleware(RequestFactory().get(path)) == expected
+
+
+def get_transaction_isolation():
+    with connection.cursor() as cursor:
+        cursor.execute('SHOW transaction_isolation')
+        return cursor.fetchone()[0]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_repeatable_read():
+    with db.repeatable_read():
+        assert get_transaction_isolation() == 'repeatable read'
+        # within the transaction, it is used as it is
+        with db.repeatable_read():
+            assert get_transaction_isolation() == 'repeatable read'
+    assert get_transaction_isolation() == 'read committed'
+
+
+@pytest.mark.django_db
+class TestStaleFallback:
+    url = reverse('device-list')
+
+    @pytest.fixture(autouse=True)
+    def clear_cache(self):
+        cache.clear()
+
+    def test_timeout_should_serve_the_last_good_response(self, client):
+        DeviceFactory()
+        expected = client.get(self.url).json()
+
+        error = get_timeout_error()
+        with patch.object(DevicesViewSet, 'get_list_response', side_effect=error):
+            response = client.get(self.url)
+        assert response.status_code == 200
+        assert response['Warning'] == '110 - "Response is Stale"'
+        assert 'Surrogate-Key' not in response
+        assert response.json() == expected
+
+    def test_response_should_be_kept_per_canonical_url(self, client):
+        DeviceFactory()
+        expected = client.get(self.url, {'page': '01'}).json()
+
+        error = get_timeout_error()
+        with patch.object(DevicesViewSet, 'get_list_response', side_effect=error):
+            assert client.get(self.url, {'page': 1}).json() == expected
+
+    def test_other_query_params_should_not_be_kept(self, client):
+        DeviceFactory()
+        client.get(self.url, {'unknown': 1})
+
+        error = get_timeout_error()
+        with patch.object(DevicesViewSet, 'get_list_response', side_effect=error):
+            with pytest.raises(OperationalError):
+                client.get(self.url, {'unknown': 1})
+
+    def test_unchanged_response_should_not_be_written(self, client):
+        DeviceFactory()
+        client.get(self.url)
+        with patch.object(cache, 'set_many') as set_many:
+            client.get(self.url)
+        set_many.assert_not_called()
+
+    def test_timeout_without_cached_response_should_fail(self, client):
+        error = get_timeout_error()
+        with patch.object(DevicesViewSet, 'get_list_response', side_effect=error):
+            with pytest.raises(OperationalError):
+                client.get(self.url)
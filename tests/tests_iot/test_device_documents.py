@@ -0,0 +1,86 @@
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from iot import device_documents, models
+from tests.factories import DeviceFactory
+
+
+def get_document(device):
+    return models.DeviceDocument.objects.get(device_id=device.id).document
+
+
+@pytest.mark.django_db
+class TestDeviceDocuments:
+    def test_document_should_be_created_with_the_device(self):
+        device = DeviceFactory()
+        assert get_document(device)['reference'] == device.reference
+        assert device_documents.verify() == []
+
+    def test_document_should_follow_lookup_changes(self):
+        # renaming a theme should be reflected in the documents of its devices
+        device = DeviceFactory()
+        theme = device.themes.first()
+        theme.name = 'Iets heel anders'
+        theme.save()
+        assert 'Iets heel anders' in get_document(device)['themes']
+        assert device_documents.verify() == []
+
+    def test_document_should_follow_owner_changes(self):
+        device = DeviceFactory()
+        device.owner.name = 'Piet Er Soon'
+        device.owner.save()
+        assert get_document(device)['owner']['name'] == 'Piet Er Soon'
+        assert device_documents.verify() == []
+
+    def test_document_should_be_removed_with_the_location(self):
+        # the api only returns the devices that can be shown on the map
+        device = DeviceFactory()
+        device.location = None
+        device.save()
+        assert not models.DeviceDocument.objects.filter(device_id=device.id).exists()
+        assert device_documents.verify() == []
+
+    def test_document_should_be_removed_with_the_device(self):
+        device = DeviceFactory()
+        device_id = device.id
+        device.delete()
+        assert not models.DeviceDocument.objects.filter(device_id=device_id).exists()
+        assert device_documents.verify() == []
+
+    def test_verify_should_report_documents_out_of_sync(self):
+        device = DeviceFactory()
+        models.DeviceDocument.objects.filter(device_id=device.id).update(document={})
+        assert device_documents.verify() == [device.id]
+
+    def test_rebuild_should_restore_documents(self):
+        device = DeviceFactory()
+        models.DeviceDocument.objects.all().delete()
+        assert device_documents.rebuild() == 1
+        assert get_document(device)['reference'] == device.reference
+        assert device_documents.verify() == []
+
+
+@pytest.mark.django_db
+class TestDeviceDocumentsCommand:
+    def test_verify(self):
+        DeviceFactory()
+        with StringIO() as out:
+            call_command('device_documents', '--verify', stdout=out)
+            assert 'in sync' in out.getvalue()
+
+    def test_verify_out_of_sync_should_fail(self):
+        device = DeviceFactory()
+        models.DeviceDocument.objects.filter(device_id=device.id).delete()
+        with pytest.raises(CommandError):
+            call_command('device_documents', '--verify', stdout=StringIO())
+
+    def test_rebuild(self):
+        DeviceFactory()
+        models.DeviceDocument.objects.all().delete()
+        with StringIO() as out:
+            call_command('device_documents', stdout=out)
+            assert 'rebuilt 1 device documents' in out.getvalue()
+        assert device_documents.verify() == []
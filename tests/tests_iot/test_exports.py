@@ -0,0 +1,297 @@
+import gzip
+import hashlib
+import json
+import struct
+from io import StringIO
+from unittest.mock import patch
+
+import pytest
+import responses
+from django.contrib.gis.geos import Point
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.urls import reverse
+from django.utils.text import slugify
+
+from iot import device_documents, exports, flatgeobuf
+from iot.importers import import_apis
+from tests.factories import DeviceFactory
+
+
+@pytest.fixture(autouse=True)
+def export_root(settings, tmp_path):
+    settings.EXPORT_ROOT = str(tmp_path)
+    return tmp_path
+
+
+def split_flatgeobuf(data, num_features):
+    """
+    Split a FlatGeobuf file into its header, index and leaves of the index,
+    checking that every leaf points to the start of a feature.
+    """
+    assert data[:8] == flatgeobuf.MAGIC_BYTES
+    (header_size,) = struct.unpack('<I', data[8:12])
+    index_start = 12 + header_size
+    header = data[12:index_start]
+
+    if not num_features:
+        assert index_start == len(data)
+        return header, b'', []
+
+    level_bounds = flatgeobuf.get_level_bounds(num_features, flatgeobuf.INDEX_NODE_SIZE)
+    index_size = level_bounds[0][1] * flatgeobuf.NODE_ITEM.size
+    index = data[index_start : index_start + index_size]
+    leaves = [
+        flatgeobuf.NODE_ITEM.unpack_from(index, i * flatgeobuf.NODE_ITEM.size)
+        for i in range(*level_bounds[0])
+    ]
+
+    # the features follow the index in the order of the leaves
+    offset = index_start + index_size
+    for leaf in leaves:
+        assert index_start + index_size + leaf[4] == offset
+        (feature_size,) = struct.unpack('<I', data[offset : offset + 4])
+        offset += 4 + feature_size
+    assert offset == len(data)
+
+    return header, index, leaves
+
+
+class TestFlatGeobuf:
+    @pytest.mark.parametrize(
+        "num_items, expected",
+        [
+            (1, [(1, 2), (0, 1)]),
+            (16, [(1, 17), (0, 1)]),
+            (17, [(3, 20), (1, 3), (0, 1)]),
+            (300, [(22, 322), (3, 22), (1, 3), (0, 1)]),
+        ],
+    )
+    def test_level_bounds(self, num_items, expected):
+        assert flatgeobuf.get_level_bounds(num_items, 16) == expected
+
+    def test_hilbert_corners(self):
+        # the curve starts in the origin and ends in the bottom right corner
+        assert flatgeobuf.hilbert(0, 0) == 0
+        assert flatgeobuf.hilbert(0xFFFF, 0) == 0xFFFFFFFF
+
+    @pytest.mark.parametrize("num_features", [0, 1, 17, 300])
+    def test_write_points(self, num_features):
+        columns = [flatgeobuf.Column('id', flatgeobuf.COLUMN_TYPE_INT)]
+        features = [
+            flatgeobuf.Feature(4.9 + i / 1000, 52.3 + (i % 7) / 1000, {'id': i})
+            for i in range(num_features)
+        ]
+        data = flatgeobuf.write_points('devices', columns, features, crs_code=4326)
+        _, _, leaves = split_flatgeobuf(data, num_features)
+
+        # every point should be in the index exactly once
+        actual = sorted((leaf[0], leaf[1]) for leaf in leaves)
+        assert actual == sorted((f.x, f.y) for f in features)
+
+
+@pytest.mark.django_db
+class TestExportFlatGeobuf:
+    url = reverse('device-export-fgb')
+
+    def test_export(self, client):
+        device = DeviceFactory()
+        response = client.get(self.url)
+        assert response.status_code == 200
+        assert response['Accept-Ranges'] == 'bytes'
+        _, _, leaves = split_flatgeobuf(b''.join(response.streaming_content), 1)
+        assert [(leaf[0], leaf[1]) for leaf in leaves] == [tuple(device.location)]
+
+    def test_range_request(self, client):
+        DeviceFactory()
+        size = len(b''.join(client.get(self.url).streaming_content))
+        response = client.get(self.url, HTTP_RANGE='bytes=0-7')
+        assert response.status_code == 206
+        assert b''.join(response.streaming_content) == flatgeobuf.MAGIC_BYTES
+        assert response['Content-Length'] == '8'
+        assert response['Content-Range'] == f'bytes 0-7/{size}'
+
+    def test_suffix_range_request(self, client):
+        DeviceFactory()
+        content = b''.join(client.get(self.url).streaming_content)
+        response = client.get(self.url, HTTP_RANGE='bytes=-10')
+        assert response.status_code == 206
+        assert b''.join(response.streaming_content) == content[-10:]
+
+    def test_invalid_range_request_should_be_ignored(self, client):
+        DeviceFactory()
+        content = b''.join(client.get(self.url).streaming_content)
+        response = client.get(self.url, HTTP_RANGE='bytes=5-3')
+        assert response.status_code == 200
+        assert b''.join(response.streaming_content) == content
+
+    def test_unsatisfiable_range_request(self, client):
+        DeviceFactory()
+        response = client.get(self.url, HTTP_RANGE='bytes=100000000-')
+        assert response.status_code == 416
+
+    def test_export_should_follow_the_registry_version(
+        self, client, export_root, settings
+    ):
+        settings.EXPORT_GRACE_PERIOD = 0
+        device = DeviceFactory()
+        version = device_documents.get_registry_version()
+        first = b''.join(client.get(self.url).streaming_content)
+
+        device.location = Point(4.9041, 52.3676)
+        device.save()
+        assert device_documents.get_registry_version() > version
+        second = b''.join(client.get(self.url).streaming_content)
+
+        assert first != second
+        # only the file of the current version is kept
+        assert len(list(export_root.iterdir())) == 1
+
+    def test_previous_version_should_be_kept_for_a_while(self, client, export_root):
+        device = DeviceFactory()
+        first = b''.join(client.get(self.url).streaming_content)
+        (previous,) = export_root.iterdir()
+
+        device.location = Point(4.9041, 52.3676)
+        device.save()
+        client.get(self.url)
+
+        # e.g. still being read by the range requests of another worker
+        assert previous.read_bytes() == first
+        assert len(list(export_root.iterdir())) == 2
+
+
+@pytest.mark.django_db
+class TestDevicesSnapshot:
+    url = reverse('device-snapshot')
+
+    def test_snapshot(self, client):
+        DeviceFactory()
+        expected = client.get(reverse('device-list')).json()['results']
+        response = client.get(self.url)
+        assert response.status_code == 200
+        assert 'Content-Encoding' not in response
+        assert json.loads(b''.join(response.streaming_content)) == expected
+
+    def test_snapshot_gzip(self, client):
+        DeviceFactory()
+        plain = b''.join(client.get(self.url).streaming_content)
+        response = client.get(self.url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        assert response['Content-Encoding'] == 'gzip'
+        assert response['Vary'] == 'Accept-Encoding'
+        assert gzip.decompress(b''.join(response.streaming_content)) == plain
+
+    def test_snapshot_should_be_written_once_per_version(
+        self, client, export_root, settings
+    ):
+        settings.EXPORT_GRACE_PERIOD = 0
+        device = DeviceFactory()
+        client.get(self.url)
+        (path,) = export_root.iterdir()
+        modified = path.stat().st_mtime_ns
+        client.get(self.url)
+        assert path.stat().st_mtime_ns == modified
+
+        device.location = Point(4.9041, 52.3676)
+        device.save()
+        response = client.get(self.url)
+        assert not path.exists()
+        (document,) = json.loads(b''.join(response.streaming_content))
+        assert document['location'] == {'latitude': 52.3676, 'longitude': 4.9041}
+
+
+@pytest.mark.django_db
+class TestExportStaticApi:
+    @pytest.fixture
+    def root(self, tmp_path):
+        return tmp_path / 'static' / 'api'
+
+    def test_export(self, root):
+        device = DeviceFactory()
+        with StringIO() as out:
+            call_command('export_static_api', str(root), stdout=out)
+            assert 'exported' in out.getvalue()
+
+        assert root.is_symlink()
+        devices = json.loads((root / 'devices.json').read_text())
+        assert [d['reference'] for d in devices] == [device.reference]
+
+        geojson = json.loads((root / 'devices.geojson').read_text())
+        (feature,) = geojson['features']
+        assert feature['id'] == device.id
+        assert feature['geometry']['coordinates'] == list(device.location)
+
+        type_devices = root / 'types' / f'{slugify(device.type.name)}.json'
+        assert json.loads(type_devices.read_text()) == devices
+        for theme in device.themes.all():
+            theme_devices = root / 'themes' / f'{slugify(theme.name)}.json'
+            assert json.loads(theme_devices.read_text()) == devices
+
+    def test_devices_without_themes(self, root):
+        device = DeviceFactory()
+        device.themes.clear()
+        call_command('export_static_api', str(root), stdout=StringIO())
+        assert not (root / 'themes').exists()
+
+    def test_names_with_the_same_slug(self):
+        location = {'longitude': 4.9041, 'latitude': 52.3676}
+        documents = [
+            {'id': 1, 'type': 'Camera', 'themes': ['Geluid', 'geluid!']},
+            {'id': 2, 'type': 'camera', 'themes': [None]},
+        ]
+        for document in documents:
+            document['location'] = location
+        files = exports.get_static_api_files(documents)
+        assert files['types/camera.json'] == [documents[0]]
+        assert files['types/camera-2.json'] == [documents[1]]
+        assert files['themes/geluid.json'] == [documents[0]]
+        assert files['themes/geluid-2.json'] == [documents[0]]
+        assert 'themes/none.json' not in files
+
+    def test_manifest(self, root):
+        DeviceFactory()
+        call_command('export_static_api', str(root), stdout=StringIO())
+
+        manifest = json.loads((root / 'manifest.json').read_text())
+        assert manifest['version'] == device_documents.get_registry_version()
+        assert 'devices.json' in manifest['files']
+        for filename, file in manifest['files'].items():
+            data = (root / filename).read_bytes()
+            assert file['size'] == len(data)
+            assert file['sha256'] == hashlib.sha256(data).hexdigest()
+
+    def test_export_should_replace_the_previous_export(self, root):
+        DeviceFactory()
+        call_command('export_static_api', str(root), stdout=StringIO())
+        previous = root.resolve()
+
+        call_command('export_static_api', str(root), stdout=StringIO())
+        assert root.resolve() != previous
+        assert not previous.exists()
+        # only the link and the current export remain
+        assert sorted(root.parent.iterdir()) == sorted([root, root.resolve()])
+
+    def test_failed_export_should_be_removed(self, root):
+        DeviceFactory()
+        call_command('export_static_api', str(root), stdout=StringIO())
+        previous = root.resolve()
+
+        with patch.object(exports, 'get_static_api_files', side_effect=OSError):
+            with pytest.raises(OSError):
+                call_command('export_static_api', str(root), stdout=StringIO())
+        assert root.resolve() == previous
+        assert sorted(root.parent.iterdir()) == sorted([root, previous])
+
+    def test_export_to_a_directory_should_fail(self, root):
+        root.mkdir(parents=True)
+        with pytest.raises(CommandError):
+            call_command('export_static_api', str(root), stdout=StringIO())
+
+    @responses.activate
+    def test_import_api_should_export(self, root, settings):
+        settings.STATIC_API_ROOT = str(root)
+        api_name = 'ais_masten'
+        responses.add(responses.GET, import_apis.API_MAPPER[api_name], json=[])
+        with patch.object(import_apis, 'convert_api_data', return_value=([], 0, 0, 0)):
+            call_command('import_api', api_name, stdout=StringIO())
+        assert (root / 'manifest.json').exists()
@@ -0,0 +1,171 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from django.contrib.auth.models import User
+from django.urls import reverse
+
+from iot import http_cache, models
+from iot.importers import import_apis
+from tests.factories import DeviceFactory
+
+
+class StubProxyHandler(BaseHTTPRequestHandler):
+    def do_PURGE(self):
+        self.server.purged.append(self.headers['Surrogate-Key'].split())
+        self.send_response(self.server.status)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def proxy(settings):
+    """
+    A local stub of a caching proxy, recording the surrogate keys of the purge
+    requests it receives.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubProxyHandler)
+    server.purged = []
+    server.status = 200
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    settings.CACHE_PURGE_HOOK = 'iot.http_cache.http_purge'
+    settings.CACHE_PURGE_URL = f'http://127.0.0.1:{server.server_port}/'
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+
+def assert_cacheable(response, keys):
+    cache_control = response['Cache-Control']
+    assert 'public' in cache_control
+    assert 's-maxage=3600' in cache_control
+    assert 'stale-while-revalidate=86400' in cache_control
+    assert response['Surrogate-Key'].split() == keys
+
+
+@pytest.mark.django_db
+class TestCacheHeaders:
+    def test_devices(self, client):
+        DeviceFactory()
+        assert_cacheable(client.get(reverse('device-list')), ['devices'])
+
+    def test_device(self, client):
+        device = DeviceFactory()
+        response = client.get(reverse('device-detail', args=[device.pk]))
+        assert_cacheable(
+            response,
+            [
+                'device',
+                f'device-{device.pk}',
+                f'owner-{device.owner_id}',
+                f'type-{device.type_id}',
+            ],
+        )
+
+    def test_errors_should_not_be_cached(self, client):
+        response = client.get(reverse('device-detail', args=[0]))
+        assert response.status_code == 404
+        assert 'Surrogate-Key' not in response
+
+    @pytest.mark.parametrize(
+        "url", [reverse('device-snapshot'), reverse('bootstrap')]
+    )
+    def test_collections(self, client, url):
+        DeviceFactory()
+        assert_cacheable(client.get(url), ['devices'])
+
+    def test_schema(self, client):
+        assert_cacheable(client.get(reverse('schema-swagger-ui')), ['schema'])
+
+
+@pytest.mark.django_db
+class TestPurge:
+    def test_purge(self, proxy, django_capture_on_commit_callbacks):
+        with django_capture_on_commit_callbacks(execute=True):
+            http_cache.purge(['device-1', 'devices', 'device-1'])
+        assert proxy.purged == [['device-1', 'devices']]
+
+    def test_purge_should_wait_for_the_commit(self, proxy):
+        # the test is never committed
+        http_cache.purge(['devices'])
+        assert proxy.purged == []
+
+    def test_failed_purge_should_be_ignored(
+        self, proxy, django_capture_on_commit_callbacks
+    ):
+        proxy.status = 500
+        with django_capture_on_commit_callbacks(execute=True):
+            http_cache.purge(['devices'])
+        assert proxy.purged == [['devices']]
+
+    def test_purge_without_hook(self, settings, django_capture_on_commit_callbacks):
+        settings.CACHE_PURGE_HOOK = None
+        with django_capture_on_commit_callbacks() as callbacks:
+            http_cache.purge(['devices'])
+        assert callbacks == []
+
+    def test_purge_after_import(self, proxy, django_capture_on_commit_callbacks):
+        api_data = {
+            "type": "FeatureCollection",
+            "features": [
+                {
+                    "id": 9,
+                    "type": "Feature",
+                    "geometry": {"type": "Point", "coordinates": [4.8993, 52.4001]},
+                    "properties": {
+                        "Locatienaam": "Floating office",
+                        "Privacyverklaring": "https://www.amsterdam.nl/privacy/",
+                    },
+                }
+            ],
+        }
+        with django_capture_on_commit_callbacks(execute=True):
+            import_apis.convert_api_data('ais_masten', api_data)
+
+        device = models.Device.objects.get()
+        assert proxy.purged == [
+            sorted(['devices', f'device-{device.pk}', f'owner-{device.owner_id}'])
+        ]
+
+        # the unchanged device isn't purged again
+        proxy.purged = []
+        with django_capture_on_commit_callbacks(execute=True):
+            import_apis.convert_api_data('ais_masten', api_data)
+        assert proxy.purged == [['devices', f'owner-{device.owner_id}']]
+
+    def test_purge_in_batches(
+        self, proxy, monkeypatch, django_capture_on_commit_callbacks
+    ):
+        monkeypatch.setattr(http_cache, 'PURGE_BATCH_SIZE', 2)
+        with django_capture_on_commit_callbacks(execute=True):
+            http_cache.purge(['device-1', 'device-2', 'devices'])
+        assert proxy.purged == [['device-1', 'device-2'], ['devices']]
+
+    def test_device_keys(self, monkeypatch):
+        monkeypatch.setattr(http_cache, 'MAX_DEVICE_KEYS', 2)
+        device_keys = http_cache.DeviceKeys()
+        for pk in [1, 2, 1]:
+            device_keys.add(models.Device(pk=pk))
+        assert sorted(device_keys) == ['device-1', 'device-2']
+
+        # too many devices changed to purge them one by one
+        for pk in [3, 4]:
+            device_keys.add(models.Device(pk=pk))
+        assert list(device_keys) == ['device']
+
+    def test_purge_after_admin_save(
+        self, client, proxy, django_capture_on_commit_callbacks
+    ):
+        user = User.objects.create_superuser('admin', 'admin@amsterdam.nl')
+        client.force_login(user)
+        type = models.Type.objects.create(name='Geluidsmeter')
+        url = reverse('admin:iot_type_change', args=[type.pk])
+        with django_capture_on_commit_callbacks(execute=True):
+            response = client.post(url, {'name': 'Geluidsensor', 'is_other': 'on'})
+        assert response.status_code == 302
+        assert proxy.purged == [['devices', f'type-{type.pk}']]
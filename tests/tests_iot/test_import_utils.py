@@ -1,4 +1,6 @@
+import copy
 import csv
+import dataclasses
 import itertools
 import json
 import os
@@ -11,14 +13,18 @@ import requests
 import responses
 from django.conf import settings
 from django.contrib.gis.geos import Point
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from openpyxl import Workbook
 from rest_framework.exceptions import ValidationError
 
 import iot.constants.sensor_fields
 import iot.dateclasses
 from iot import models, validators
-from iot.importers import import_person, import_sensor, import_xlsx
+from iot.importers import import_person, import_sensor, import_sensors, import_xlsx
+from iot.importers.resolver import LookupResolver
 from iot.serializers import DeviceSerializer
+from iot.utils import set_relations
 from iot.validators import validate_person_data
 
 
@@ -541,6 +547,289 @@ class TestImportSensor:
             assert isinstance(err, ValidationError)
 
 
+def copy_sensor(sensor_data, **changes):
+    return dataclasses.replace(copy.deepcopy(sensor_data), **changes)
+
+
+@pytest.mark.django_db
+class TestImportSensors:
+    actual = TestImportSensor.actual
+    expected = TestImportSensor.expected
+
+    def import_sensors(self, *sensors):
+        owner = import_person.import_person(sensors[0].owner)
+        owners = {owner.email.lower(): owner}
+        return import_sensors.import_sensors(list(sensors), owners)
+
+    def test_import_sensors(self, sensor_data):
+        errors, devices, created, updated, unchanged = self.import_sensors(sensor_data)
+        assert (errors, created, updated, unchanged) == ([], 1, 0, 0)
+        assert [device.reference for device in devices] == ["1234"]
+        assert self.actual == [self.expected]
+
+    def test_import_sensors_should_be_idempotent(self, sensor_data):
+        self.import_sensors(sensor_data)
+        errors, _, created, updated, unchanged = self.import_sensors(sensor_data)
+        assert (errors, created, updated, unchanged) == ([], 0, 0, 1)
+        assert self.actual == [self.expected]
+
+    def test_import_sensors_should_match_import_sensor(self, sensor_data):
+        sensor_data.location.lat_long = iot.dateclasses.LatLong(
+            latitude=52.3676, longitude=4.9041
+        )
+        sensor_data.location.regions = "Stadsdeel Centrum;Diemen"
+        self.import_sensors(
+            sensor_data,
+            copy_sensor(sensor_data, reference="2468", themes="abc;Mobiliteit: auto"),
+        )
+        expected = self.actual
+        models.Device.objects.all().delete()
+
+        owner = import_person.import_person(sensor_data.owner)
+        import_sensor.import_sensor(sensor_data, owner)
+        import_sensor.import_sensor(
+            copy_sensor(sensor_data, reference="2468", themes="abc;Mobiliteit: auto"),
+            owner,
+        )
+        assert self.actual == expected
+
+    def test_last_sensor_should_win(self, sensor_data):
+        errors, devices, created, updated, unchanged = self.import_sensors(
+            sensor_data, copy_sensor(sensor_data, datastream="lucht", projects=[])
+        )
+        assert (errors, created, updated, unchanged) == ([], 1, 1, 0)
+        assert devices[0] == devices[1]
+        expected = dict(self.expected, datastream="lucht", project_paths=[])
+        assert self.actual == [expected]
+
+    def test_should_keep_location_without_new_location(self, sensor_data):
+        sensor_data.location.lat_long = iot.dateclasses.LatLong(
+            latitude=52.3676, longitude=4.9041
+        )
+        self.import_sensors(sensor_data)
+        sensor_data.location.lat_long = None
+        self.import_sensors(sensor_data)
+        location = {"latitude": 52.3676, "longitude": 4.9041}
+        assert self.actual == [dict(self.expected, location=location)]
+
+    def test_invalid_sensors_should_be_reported(self, sensor_data):
+        errors, _, created, updated, _ = self.import_sensors(
+            copy_sensor(sensor_data, type=""),
+            copy_sensor(sensor_data, reference="x" * 65),
+            sensor_data,
+        )
+        assert len(errors) == 2
+        assert (created, updated) == (1, 0)
+        assert self.actual == [self.expected]
+
+    def test_queries_should_not_depend_on_the_number_of_sensors(
+        self, sensor_data, django_assert_max_num_queries
+    ):
+        sensors = [
+            copy_sensor(sensor_data, reference=str(i), type=f"Type {i % 3}")
+            for i in range(50)
+        ]
+        owner = import_person.import_person(sensor_data.owner)
+        owners = {owner.email.lower(): owner}
+        with django_assert_max_num_queries(40):
+            result = import_sensors.import_sensors(sensors, owners)
+        assert result[2:] == (50, 0, 0)
+
+    def test_import_sensors_in_chunks(self, sensor_data, settings):
+        settings.IMPORT_CHUNK_SIZE = 2
+        sensors = [copy_sensor(sensor_data, reference=str(i)) for i in range(5)]
+        # a reference that is too long for the database
+        sensors[2].reference = "x" * 65
+        errors, devices, *counts = self.import_sensors(*sensors)
+        assert len(errors) == 1
+        assert counts == [4, 0, 0]
+        assert sorted(device.reference for device in devices) == ["0", "1", "3", "4"]
+        assert models.Device.objects.count() == 4
+        # every device has all its relations
+        for device in models.Device.objects.all():
+            assert device.themes.count() == 2
+            assert device.projects.count() == 2
+
+    def test_unchanged_sensors_should_not_be_written(self, sensor_data):
+        sensors = [copy_sensor(sensor_data, reference=str(i)) for i in range(3)]
+        self.import_sensors(*sensors)
+        # the same sensors, with other cased themes in another order
+        sensors[0].themes = "mobiliteit: fiets;Mobiliteit: Auto"
+        sensors[1].datastream = "lucht"
+        with CaptureQueriesContext(connection) as context:
+            result = self.import_sensors(*sensors)
+        assert result[2:] == (0, 1, 2)
+        writes = [
+            query["sql"]
+            for query in context.captured_queries
+            if query["sql"].startswith(("INSERT", "UPDATE"))
+            and '"iot_device" ' in query["sql"]
+        ]
+        assert len(writes) == 1
+        assert models.Device.objects.get(reference="1").datastream == "lucht"
+
+    def test_edited_device_should_be_imported(self, sensor_data):
+        errors, (device,), *_ = self.import_sensors(sensor_data)
+        assert device.fingerprint
+        device.datastream = "lucht"
+        device.full_clean()
+        device.save()
+        assert self.import_sensors(sensor_data)[2:] == (0, 1, 0)
+        assert self.actual == [self.expected]
+
+    def test_import_sensor_should_clear_fingerprint(self, sensor_data):
+        self.import_sensors(sensor_data)
+        owner = models.Person.objects.get()
+        import_sensor.import_sensor(copy_sensor(sensor_data, datastream="lucht"), owner)
+        assert models.Device.objects.get().fingerprint == ""
+        assert self.import_sensors(sensor_data)[2:] == (0, 1, 0)
+        assert self.actual == [self.expected]
+
+    def test_changed_relations_should_clear_fingerprint(self, sensor_data):
+        self.import_sensors(sensor_data)
+        assert models.Device.objects.get().fingerprint
+        # e.g. deleted in the admin, which deletes the through rows as well
+        models.Theme.objects.filter(device__isnull=False).first().delete()
+        assert models.Device.objects.get().fingerprint == ""
+        assert self.import_sensors(sensor_data)[2:] == (0, 1, 0)
+        assert self.actual == [self.expected]
+
+    def test_renamed_lookup_should_clear_fingerprint(self, sensor_data):
+        self.import_sensors(sensor_data)
+        models.Type.objects.update(name="Andere sensor")
+        assert models.Device.objects.get().fingerprint == ""
+        assert self.import_sensors(sensor_data)[2:] == (0, 1, 0)
+
+    def test_changed_device_should_clear_fingerprint(self, sensor_data):
+        self.import_sensors(sensor_data)
+        models.Device.objects.update(datastream="lucht")
+        assert models.Device.objects.get().fingerprint == ""
+        assert self.import_sensors(sensor_data)[2:] == (0, 1, 0)
+        assert self.actual == [self.expected]
+
+
+@pytest.mark.django_db
+class TestLookupResolver:
+    def test_names_should_be_case_insensitive(self):
+        theme = models.Theme.objects.create(name="Mobiliteit: auto")
+        resolver = LookupResolver()
+        resolver.resolve(models.Theme, ["MOBILITEIT: AUTO", "Geluid", "geluid"])
+        assert resolver.get(models.Theme, "mobiliteit: Auto") == theme.pk
+        names = models.Theme.objects.order_by("pk").values_list("name", flat=True)
+        assert list(names) == [
+            "Mobiliteit: auto",
+            "Geluid",
+        ]
+        assert resolver.get(models.Theme, "GELUID") == models.Theme.objects.get(
+            name="Geluid"
+        ).pk
+
+    def test_rows(self):
+        legal_ground = models.LegalGround.objects.create(name="Publieke taak")
+        goal = models.ObservationGoal.objects.create(
+            observation_goal="Tellen", legal_ground=legal_ground
+        )
+        resolver = LookupResolver()
+        goals = [("Tellen", None, legal_ground.pk), ("Tellen", None, None)]
+        resolver.resolve(models.ObservationGoal, goals)
+        assert resolver.get(models.ObservationGoal, *goals[0]) == goal.pk
+        assert models.ObservationGoal.objects.count() == 2
+
+        resolver.resolve(models.Project, [(("a", "b"),), (("a",),)])
+        resolver.resolve(models.Project, [(("a", "b"),)])
+        assert models.Project.objects.get(pk=resolver.get(models.Project, ("a", "b")))
+        assert models.Project.objects.count() == 2
+
+    def test_tables_should_be_read_once(self, django_assert_num_queries):
+        resolver = LookupResolver()
+        # one query to read the table, and two to create the missing names
+        with django_assert_num_queries(3):
+            resolver.resolve(models.Type, [f"Type {i}" for i in range(100)])
+        with django_assert_num_queries(0):
+            resolver.resolve(models.Type, ["type 1", "Type 2"])
+            resolver.get(models.Type, "Type 3")
+
+    def test_shared_between_sensors(self, sensor_data):
+        owner = import_person.import_person(sensor_data.owner)
+        resolver = LookupResolver()
+        import_sensor.import_sensor(sensor_data, owner, resolver=resolver)
+        with CaptureQueriesContext(connection) as context:
+            for i in range(5):
+                sensor = copy_sensor(sensor_data, reference=str(i))
+                import_sensor.import_sensor(sensor, owner, resolver=resolver)
+        # the devices don't read these lookup tables themselves
+        assert not any(
+            f'FROM "{table}"' in query["sql"]
+            for query in context.captured_queries
+            for table in ["iot_type", "iot_legalground"]
+        )
+        assert models.Device.objects.count() == 6
+
+    def test_rolled_back_lookups_should_be_forgotten(self):
+        resolver = LookupResolver()
+        with pytest.raises(ZeroDivisionError):
+            with resolver.atomic():
+                resolver.resolve(models.Region, ["Diemen"])
+                1 / 0
+        resolver.resolve(models.Region, ["Diemen"])
+        assert models.Region.objects.get().pk == resolver.get(models.Region, "Diemen")
+
+
+def get_m2m_writes(queries):
+    through_tables = [
+        models.Device.regions.through._meta.db_table,
+        models.Device.themes.through._meta.db_table,
+        models.Device.observation_goals.through._meta.db_table,
+        models.Device.projects.through._meta.db_table,
+    ]
+    return [
+        query["sql"]
+        for query in queries
+        if query["sql"].startswith(("INSERT", "DELETE", "UPDATE"))
+        and any(f'"{table}"' in query["sql"] for table in through_tables)
+    ]
+
+
+@pytest.mark.django_db
+class TestSetRelations:
+    def test_set_relations(self, sensor_data):
+        owner = import_person.import_person(sensor_data.owner)
+        device, _ = import_sensor.import_sensor(sensor_data, owner)
+        through = models.Device.themes.through
+        auto, _ = models.Theme.objects.order_by("pk")
+        kept = through.objects.get(theme=auto).pk
+
+        geluid = models.Theme.objects.create(name="Geluid")
+        set_relations(models.Device.themes, {device.pk: [auto.pk, geluid.pk]})
+        assert sorted(device.themes.values_list("name", flat=True)) == [
+            "Geluid",
+            "Mobiliteit: auto",
+        ]
+        # the unchanged row is kept
+        assert through.objects.get(theme=auto).pk == kept
+
+        set_relations(models.Device.themes, {device.pk: []})
+        assert not device.themes.exists()
+
+    def test_unchanged_sensor_should_not_write_relations(self, sensor_data):
+        sensor_data.location.regions = "Centrum;Oost"
+        owner = import_person.import_person(sensor_data.owner)
+        import_sensor.import_sensor(sensor_data, owner)
+        with CaptureQueriesContext(connection) as context:
+            import_sensor.import_sensor(sensor_data, owner)
+        assert get_m2m_writes(context.captured_queries) == []
+
+    def test_unchanged_sensors_should_not_write_relations(self, sensor_data):
+        sensor_data.location.regions = "Centrum;Oost"
+        owner = import_person.import_person(sensor_data.owner)
+        owners = {owner.email.lower(): owner}
+        sensors = [copy_sensor(sensor_data, reference=str(i)) for i in range(3)]
+        import_sensors.import_sensors(sensors, owners)
+        with CaptureQueriesContext(connection) as context:
+            import_sensors.import_sensors(sensors, owners)
+        assert get_m2m_writes(context.captured_queries) == []
+
+
 @pytest.mark.django_db
 class TestValidate:
     """
@@ -673,6 +962,11 @@ def override_url_settings(settings):
     settings.ATLAS_ADDRESS_SEARCH = "http://adres"
 
 
+@pytest.fixture(autouse=True)
+def clear_geocode_cache():
+    import_sensor.geocode_cache.clear()
+
+
 class TestGetCenterCoordinates:
     @pytest.fixture(autouse=True)
     def inject_requests_mock(self, requests_mock):
@@ -722,6 +1016,76 @@ class TestGetCenterCoordinates:
         assert tuple(actual) == (4.882909214312223, 52.36816000657591)
 
 
+@pytest.mark.django_db
+class TestGeocoder:
+    @pytest.fixture(autouse=True)
+    def fake_get_center_coordinates(self):
+        self.requested = []
+
+        def get_center_coordinates(postcode, house_number):
+            self.requested.append((postcode, house_number))
+            if house_number == 11:
+                raise ValidationError(postcode, house_number)
+            return Point(4.9041, 52.3676)
+
+        with patch(
+            "iot.importers.import_sensor.get_center_coordinates",
+            get_center_coordinates,
+        ):
+            yield
+
+    def test_addresses_should_be_cached(self):
+        geocoder = import_sensor.Geocoder()
+        for postcode in ["1015 BA", "1015ba", "1015 BA"]:
+            point = geocoder.get_center_coordinates(postcode, 1, "a")
+            assert tuple(point) == (4.9041, 52.3676)
+        assert self.requested == [("1015 BA", 1)]
+        assert geocoder.stats == import_sensor.GeocodeStats(
+            memory_hits=2, database_hits=0, misses=1
+        )
+
+        # another process only has the database
+        import_sensor.geocode_cache.clear()
+        point = geocoder.get_center_coordinates("1015BA", "1", "A")
+        assert tuple(point) == (4.9041, 52.3676)
+        assert geocoder.stats.database_hits == 1
+        assert len(self.requested) == 1
+
+    def test_suffixes_should_share_the_requested_address(self):
+        geocoder = import_sensor.Geocoder()
+        for suffix in ["", "A", "B"]:
+            geocoder.get_center_coordinates("1015 BA", 12, suffix)
+        # the api ignores the suffix
+        assert self.requested == [("1015 BA", 12)]
+        assert models.GeocodeResult.objects.count() == 1
+
+    def test_addresses_not_found_should_be_cached(self):
+        geocoder = import_sensor.Geocoder()
+        for _ in range(2):
+            with pytest.raises(ValidationError):
+                geocoder.get_center_coordinates("1015 BA", 11)
+        assert self.requested == [("1015 BA", 11)]
+        assert models.GeocodeResult.objects.get().point is None
+
+    def test_addresses_not_found_should_expire_sooner(self, settings):
+        settings.GEOCODE_NEGATIVE_CACHE_TTL = -1
+        geocoder = import_sensor.Geocoder()
+        for house_number in [1, 11, 1, 11]:
+            try:
+                geocoder.get_center_coordinates("1015 BA", house_number)
+            except ValidationError:
+                pass
+        assert self.requested == [("1015 BA", 1), ("1015 BA", 11), ("1015 BA", 11)]
+
+    def test_expired_addresses_should_be_requested(self, settings):
+        settings.GEOCODE_CACHE_TTL = -1
+        geocoder = import_sensor.Geocoder()
+        geocoder.get_center_coordinates("1015 BA", 1)
+        geocoder.get_center_coordinates("1015 BA", 1)
+        assert len(self.requested) == 2
+        assert models.GeocodeResult.objects.count() == 1
+
+
 class TestGetCenterCoordinatesInvalidResponses:
 
     HERENGRACHT_POSTCODE_RESPONSE = json.dumps({"results": [{"straat": "Herengracht"}]})
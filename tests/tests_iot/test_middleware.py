@@ -0,0 +1,54 @@
+import pytest
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from tests.factories import DeviceFactory
+
+
+def get_session_and_auth_queries(client, url):
+    with CaptureQueriesContext(connection) as context:
+        response = client.get(url)
+    queries = [
+        query['sql']
+        for query in context.captured_queries
+        if 'django_session' in query['sql'] or 'auth_user' in query['sql']
+    ]
+    return response, queries
+
+
+@pytest.mark.django_db
+class TestPublicReads:
+    @pytest.fixture(autouse=True)
+    def login(self, client):
+        # the session cookie of the admin is sent along with every request
+        user = User.objects.create_superuser('admin', 'admin@amsterdam.nl')
+        client.force_login(user)
+
+    @pytest.mark.parametrize(
+        "url",
+        [
+            reverse('device-list'),
+            reverse('device-snapshot'),
+            reverse('bootstrap'),
+            reverse('ping'),
+        ],
+    )
+    def test_public_reads_should_not_use_the_session(self, client, url):
+        DeviceFactory()
+        response, queries = get_session_and_auth_queries(client, url)
+        assert response.status_code == 200
+        assert queries == []
+        assert not response.cookies
+
+    def test_device_should_not_use_the_session(self, client):
+        device = DeviceFactory()
+        url = reverse('device-detail', args=[device.pk])
+        response, queries = get_session_and_auth_queries(client, url)
+        assert response.status_code == 200
+        assert queries == []
+
+    def test_admin_should_use_the_session(self, client):
+        _, queries = get_session_and_auth_queries(client, '/iothings/admin/')
+        assert any('django_session' in query for query in queries)
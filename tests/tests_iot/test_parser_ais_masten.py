@@ -277,7 +277,7 @@ class TestConverteApiData:
             api_name='ais_masten', api_data=api_data_2
         )
 
-        assert result == ([], 2, 0)
+        assert result == ([], 2, 0, 0)
         assert len(self.actual) == 2
 
     def test_convert_api_data_ais_masten_one_insert_one_update(
@@ -310,7 +310,7 @@ class TestConverteApiData:
             None,
         )
 
-        assert result_1 == ([], 1, 0)
-        assert result_2 == ([], 1, 1)
+        assert result_1 == ([], 1, 0, 0)
+        assert result_2 == ([], 1, 1, 0)
         assert len(self.actual) == 2
         assert sensor_ref_2['location']['longitude'] == 4.999999
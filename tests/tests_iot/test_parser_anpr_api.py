@@ -363,7 +363,7 @@ class TestConvertApiData:
 
         result = import_apis.convert_api_data(api_name='anpr', api_data=api_data_2)
 
-        assert result == ([], 2, 0)
+        assert result == ([], 2, 0, 0)
         assert len(self.actual) == 2
 
     def test_convert_api_data_anpr_sensor_three_insert_one_update(
@@ -391,8 +391,8 @@ class TestConvertApiData:
             None,
         )
 
-        assert result_1 == ([], 2, 0)
-        assert result_2 == ([], 1, 1)
+        assert result_1 == ([], 2, 0, 0)
+        assert result_2 == ([], 1, 1, 0)
         assert len(self.actual) == 3
         assert sensor_ref_00001['location']['longitude'] == 4.9999999
         assert sensor_ref_00001['location']['latitude'] == 52.999999
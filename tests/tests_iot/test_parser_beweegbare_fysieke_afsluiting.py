@@ -298,7 +298,7 @@ class TestConvertApiData:
             api_name='beweegbare_fysieke_afsluiting', api_data=api_data_2
         )
 
-        assert result == ([], 2, 0)
+        assert result == ([], 2, 0, 0)
         assert len(self.actual) == 2
 
     def test_convert_api_data_beweegbare_sensor_1_insert_1_update(
@@ -327,7 +327,7 @@ class TestConvertApiData:
             (sensor for sensor in self.actual if sensor['reference'] == 'VO11'), None
         )
 
-        assert result_1 == ([], 1, 0)
-        assert result_2 == ([], 1, 1)
+        assert result_1 == ([], 1, 0, 0)
+        assert result_2 == ([], 1, 1, 0)
         assert len(self.actual) == 2
         assert sensor_ref_2['location']['longitude'] == 4.999999
@@ -283,7 +283,7 @@ class TestConvertApiData:
             api_name='camera_brug_en_sluisbediening', api_data=api_data_2
         )
 
-        assert result == ([], 2, 0)
+        assert result == ([], 2, 0, 0)
         assert len(self.actual) == 2
 
     def test_convert_api_data_brug_en_sluis_one_insert_one_update(
@@ -311,7 +311,7 @@ class TestConvertApiData:
             (sensor for sensor in self.actual if sensor['reference'] == 'SLU0101'), None
         )
 
-        assert result_1 == ([], 1, 0)
-        assert result_2 == ([], 1, 1)
+        assert result_1 == ([], 1, 0, 0)
+        assert result_2 == ([], 1, 1, 0)
         assert len(self.actual) == 2
         assert sensor_ref_2['location']['latitude'] == 52.343909
@@ -333,7 +333,7 @@ class TestConverteApiData:
             api_name='cctv_camera_verkeersmanagement', api_data=api_data_2
         )
 
-        assert result == ([], 2, 0)
+        assert result == ([], 2, 0, 0)
         assert len(self.actual) == 2
 
     def test_convert_api_data_cctvcv_one_insert_one_update(self, api_data, api_data_2):
@@ -360,7 +360,7 @@ class TestConverteApiData:
             None,
         )
 
-        assert result_1 == ([], 1, 0)
-        assert result_2 == ([], 1, 1)
+        assert result_1 == ([], 1, 0, 0)
+        assert result_2 == ([], 1, 1, 0)
         assert len(self.actual) == 2
         assert sensor_ref_2['location']['latitude'] == 52.381543
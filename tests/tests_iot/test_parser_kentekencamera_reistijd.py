@@ -331,7 +331,7 @@ class TestConvertApiData:
             api_name='kentekencamera_reistijd', api_data=api_data_2
         )
 
-        assert result == ([], 2, 0)
+        assert result == ([], 2, 0, 0)
         assert len(self.actual) == 2
 
     def test_convert_api_data_kenteken_reistijd_1_insert_1_update(
@@ -360,7 +360,7 @@ class TestConvertApiData:
             None,
         )
 
-        assert result_1 == ([], 1, 0)
-        assert result_2 == ([], 1, 1)
+        assert result_1 == ([], 1, 0, 0)
+        assert result_2 == ([], 1, 1, 0)
         assert len(self.actual) == 2
         assert sensor_ref_2['location']['longitude'] == 4.999999
@@ -264,7 +264,7 @@ class TestConvertApiData:
             api_name='sensor_crowd_management', api_data=api_data_2
         )
 
-        assert result == ([], 2, 0)
+        assert result == ([], 2, 0, 0)
         assert len(self.actual) == 2
 
     def test_convert_api_data_sensor_3_inserts_1_update(self, api_data, api_data_2):
@@ -290,7 +290,7 @@ class TestConvertApiData:
             (sensor for sensor in self.actual if sensor['reference'] == 'GABW-03'), None
         )
 
-        assert result_1 == ([], 3, 0)
-        assert result_2 == ([], 1, 1)
+        assert result_1 == ([], 3, 0, 0)
+        assert result_2 == ([], 1, 1, 0)
         assert len(self.actual) == 4
         assert sensor_ref_2['location']['longitude'] == 4.99999
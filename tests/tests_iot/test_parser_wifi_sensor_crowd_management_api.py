@@ -303,7 +303,7 @@ class TestConvertApiData:
             api_name='wifi_sensor_crowd_management', api_data=api_data_2
         )
 
-        assert result == ([], 2, 0)
+        assert result == ([], 2, 0, 0)
         assert len(self.actual) == 2
 
     def test_convert_api_data_wifi_sensor_one_insert_one_update(
@@ -331,7 +331,7 @@ class TestConvertApiData:
             (sensor for sensor in self.actual if sensor['reference'] == 'GABW-03'), None
         )
 
-        assert result_1 == ([], 1, 0)
-        assert result_2 == ([], 1, 1)
+        assert result_1 == ([], 1, 0, 0)
+        assert result_2 == ([], 1, 1, 0)
         assert len(self.actual) == 2
         assert sensor_ref_2['location']['longitude'] == 4.99999